@@ -57,14 +57,17 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'rachais.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'rachais.middleware.PrimaryPinningMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'rachais.middleware.ProfilingMiddleware',
 ]
 
 
@@ -74,7 +77,7 @@ WSGI_APPLICATION = 'rachai.wsgi.application'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'rachais.template_backends.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -105,9 +108,56 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # BEGIN IMMEDIATE: escritas concorrentes esperam a vez (timeout) em
+            # vez de falhar ao promover uma leitura para escrita no meio da transação.
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+            # Em arquivo, não em memória compartilhada: os testes de concorrência
+            # abrem uma conexão por thread e precisam que elas esperem pelo lock.
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
         }
     }
 
+# Réplicas de leitura (opcional): RACHAI_DB_REPLICAS lista, separados por
+# vírgula, os hosts das réplicas do PostgreSQL (mesmo banco e credenciais do
+# primário) ou, em desenvolvimento, caminhos de outros arquivos SQLite. Leituras
+# de GET vão para elas; escritas e leituras logo após uma escrita da mesma
+# sessão (RACHAI_PRIMARY_PIN_SECONDS) ficam no primário. Ver rachais/db_router.py.
+RACHAI_READ_REPLICAS = []
+for _index, _replica in enumerate(filter(None, (r.strip() for r in os.getenv('RACHAI_DB_REPLICAS', '').split(',')))):
+    _alias = f'replica{_index}'
+    DATABASES[_alias] = {
+        **DATABASES['default'],
+        ('HOST' if IS_PRODUCTION else 'NAME'): _replica,
+        # Nos testes, a réplica é o próprio banco de teste do primário.
+        'TEST': {'MIRROR': 'default'},
+    }
+    RACHAI_READ_REPLICAS.append(_alias)
+if RACHAI_READ_REPLICAS:
+    DATABASE_ROUTERS = ['rachais.db_router.PrimaryReplicaRouter']
+RACHAI_PRIMARY_PIN_SECONDS = int(os.getenv('RACHAI_PRIMARY_PIN_SECONDS', 10))
+
+# Cache sem serviços externos: memória local em desenvolvimento e arquivos em
+# produção (compartilhado pelos workers da mesma máquina). Com mais de uma
+# máquina, aponte RACHAI_CACHE_BACKEND/RACHAI_CACHE_LOCATION para um cache
+# compartilhado, senão um logout só vale na instância que o recebeu.
+if IS_PRODUCTION:
+    CACHES = {
+        'default': {
+            'BACKEND': os.getenv('RACHAI_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+            'LOCATION': os.getenv('RACHAI_CACHE_LOCATION', '/tmp/rachai-cache'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': os.getenv('RACHAI_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+            'LOCATION': os.getenv('RACHAI_CACHE_LOCATION', 'rachai'),
+        }
+    }
+
+# Sessões lidas do cache e gravadas também no banco (sobrevivem a um cache limpo).
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -139,4 +189,64 @@ STATICFILES_DIRS = [
 ]
 STATICFILES_STORAGE = ('whitenoise.storage.CompressedManifestStaticFilesStorage')
 
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Motor de cálculo de saldos: "ledger" (GroupBalance), "sql" (agregação no banco)
+# ou "python" (replay completo do histórico, útil para conferência).
+RACHAI_BALANCE_ENGINE = os.getenv('RACHAI_BALANCE_ENGINE', 'ledger')
+
+# Saldos e liquidações são cacheados por (grupo, revisão). Com RACHAI_CACHE_ALIAS
+# vazio, usa-se um cache LRU em processo no lugar do framework de cache do Django.
+RACHAI_CACHE_ALIAS = os.getenv('RACHAI_CACHE_ALIAS', 'default')
+RACHAI_LEDGER_CACHE_TIMEOUT = int(os.getenv('RACHAI_LEDGER_CACHE_TIMEOUT', 60 * 60 * 24))
+
+# Usuário autenticado servido do mesmo cache; invalidado ao salvar/excluir o
+# usuário (rachais/signals.py). O timeout limita o efeito de um .update() direto.
+RACHAI_USER_CACHE_TIMEOUT = int(os.getenv('RACHAI_USER_CACHE_TIMEOUT', 60 * 5))
+
+# Estratégia de liquidação: "hybrid" (padrão), "greedy", "exact" ou "sequential".
+RACHAI_SETTLEMENT_STRATEGY = os.getenv('RACHAI_SETTLEMENT_STRATEGY', 'hybrid')
+
+# Armazenamento das divisões iguais: "rows" (uma ExpenseSplit por participante)
+# ou "implicit" (só a lista de ids na despesa; as partes são derivadas).
+# Veja também `manage.py compact_equal_splits` para converter o histórico.
+RACHAI_EQUAL_SPLIT_STORAGE = os.getenv('RACHAI_EQUAL_SPLIT_STORAGE', 'rows')
+
+# Despesas por página no detalhe do grupo (paginação por keyset).
+RACHAI_EXPENSE_PAGE_SIZE = int(os.getenv('RACHAI_EXPENSE_PAGE_SIZE', 50))
+
+# Linhas buscadas por vez nas exportações em streaming.
+RACHAI_EXPORT_CHUNK_SIZE = int(os.getenv('RACHAI_EXPORT_CHUNK_SIZE', 2000))
+
+# Reenvios de add_expense/pay_debt com a mesma Idempotency-Key recebem o
+# redirecionamento original durante este prazo (segundos). Limpeza das chaves
+# vencidas: manage.py purge_idempotency_keys.
+RACHAI_IDEMPOTENCY_TTL = int(os.getenv('RACHAI_IDEMPOTENCY_TTL', 60 * 60 * 24))
+
+# Instrumentação por requisição: cabeçalho Server-Timing (db/tpl/app/total) e uma
+# linha JSON no logger "rachais.timing". Consultas idênticas repetidas a partir
+# do limite abaixo são registradas como possível N+1.
+RACHAI_REQUEST_TIMING = os.getenv('RACHAI_REQUEST_TIMING', '0').lower() in ['true', 't', '1']
+RACHAI_DUPLICATE_QUERY_THRESHOLD = int(os.getenv('RACHAI_DUPLICATE_QUERY_THRESHOLD', 5))
+
+# Perfil sob demanda: staff com ?_profile=1 ou cabeçalho X-Rachai-Profile com o
+# token de `manage.py profile_token`. Com RACHAI_PROFILER=pyinstrument (se
+# instalado) grava pilhas colapsadas; senão, .prof do cProfile. O limite de
+# perfis simultâneos só vale para o pyinstrument: o cProfile perfila um por vez.
+RACHAI_PROFILING = os.getenv('RACHAI_PROFILING', '0').lower() in ['true', 't', '1']
+RACHAI_PROFILER = os.getenv('RACHAI_PROFILER', 'cprofile')
+RACHAI_PROFILE_DIR = os.getenv('RACHAI_PROFILE_DIR', BASE_DIR / 'profiles')
+RACHAI_PROFILE_MAX_CONCURRENT = int(os.getenv('RACHAI_PROFILE_MAX_CONCURRENT', 1))
+RACHAI_PROFILE_KEEP = int(os.getenv('RACHAI_PROFILE_KEEP', 50))
+RACHAI_PROFILE_TOKEN_MAX_AGE = int(os.getenv('RACHAI_PROFILE_TOKEN_MAX_AGE', 60 * 60))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'rachais': {'handlers': ['console'], 'level': os.getenv('RACHAI_LOG_LEVEL', 'INFO')},
+    },
+}
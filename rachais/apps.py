@@ -4,3 +4,6 @@ class RachaisConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "rachais"
     verbose_name = "Grupos"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,101 @@
+"""Arquivamento do histórico já fechado dos grupos.
+
+Despesas, partes e pagamentos cobertos por um fechamento (``BalanceCheckpoint``)
+saem das tabelas quentes para ``ArchivedExpense``/``ArchivedPayment``, em lotes.
+O fechamento vira o ponto de partida dos saldos (o "saldo transportado"), então
+nenhum motor precisa do histórico arquivado.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from .balances import Checkpoint, implicit_shares, maintaining_ledger
+from .caching import bump_revision
+from .models import ArchivedExpense, ArchivedPayment, BalanceCheckpoint, Expense, ExpenseSplit, Group, Payment
+
+
+def archivable_checkpoint(group, settled_only=True):
+    """Fechamento mais recente ainda não arquivado (``None`` se não houver).
+
+    Com ``settled_only``, só fechamentos em que todos os saldos eram zero.
+    """
+    checkpoints = BalanceCheckpoint.objects.filter(group=group)
+    floor = checkpoints.filter(archived=True).order_by("-as_of").values_list("as_of", flat=True).first()
+    if floor is not None:
+        checkpoints = checkpoints.filter(as_of__gt=floor)
+    periods = checkpoints.values("as_of").annotate(open=Count("id", filter=~Q(amount=0))).order_by("-as_of")
+    if settled_only:
+        periods = periods.filter(open=0)
+    period = periods.first()
+    if period is None:
+        return None
+
+    rows = list(checkpoints.filter(as_of=period["as_of"]).values_list("user_id", "amount", "last_expense_id", "last_payment_id"))
+    _, _, last_expense_id, last_payment_id = rows[0]
+    return Checkpoint(period["as_of"], last_expense_id, last_payment_id, {row[0]: row[1] for row in rows})
+
+
+def archive_group_history(group, checkpoint, batch_size=500):
+    """Move para o arquivo o histórico coberto por ``checkpoint``.
+
+    Marca o fechamento como arquivado antes de mover qualquer linha: se o
+    processo parar no meio, os saldos continuam partindo dele e a próxima
+    execução retoma de onde parou. Devolve ``(despesas, pagamentos)`` movidos.
+    """
+    BalanceCheckpoint.objects.filter(group=group, as_of=checkpoint.as_of).update(archived=True)
+    with maintaining_ledger():
+        expenses, payments = _move_history(group, checkpoint, batch_size)
+
+    if expenses or payments:
+        bump_revision(group)
+    return expenses, payments
+
+
+def _move_history(group, checkpoint, batch_size):
+    expenses = payments = 0
+    live = Expense.objects.filter(group=group, id__lte=checkpoint.last_expense_id).order_by("id")
+    while batch := list(live[:batch_size]):
+        _archive_expenses(group, batch)
+        expenses += len(batch)
+
+    live = Payment.objects.filter(group=group, id__lte=checkpoint.last_payment_id).order_by("id")
+    while batch := list(live[:batch_size]):
+        with transaction.atomic():
+            ArchivedPayment.objects.bulk_create(
+                ArchivedPayment(
+                    original_id=p.id, group=group, payer_id=p.payer_id, receiver_id=p.receiver_id, amount=p.amount,
+                    note=p.note, created_at=p.created_at, paid_at=p.paid_at,
+                )
+                for p in batch
+            )
+            Payment.objects.filter(id__in=[p.id for p in batch]).delete()
+        payments += len(batch)
+    return expenses, payments
+
+
+@transaction.atomic
+def _archive_expenses(group, batch):
+    shares = defaultdict(list)
+    rows = ExpenseSplit.objects.filter(
+        expense_id__in=[e.id for e in batch if e.equal_split_user_ids is None]
+    ).order_by("id").values_list("expense_id", "user_id", "amount_owed")
+    for expense_id, user_id, amount_owed in rows:
+        shares[expense_id].append([user_id, str(amount_owed)])
+    for e in batch:
+        if e.equal_split_user_ids is not None:
+            shares[e.id] = [[user_id, str(owed)] for user_id, owed in implicit_shares(e.amount, e.equal_split_user_ids)]
+
+    ArchivedExpense.objects.bulk_create(
+        ArchivedExpense(
+            original_id=e.id, group=group, description=e.description, amount=e.amount, paid_by_id=e.paid_by_id,
+            split_method=e.split_method, shares=shares[e.id], created_at=e.created_at,
+        )
+        for e in batch
+    )
+    Expense.objects.filter(id__in=[e.id for e in batch]).delete()
+    Group.objects.filter(pk=group.pk).update(
+        archived_expense_count=F("archived_expense_count") + len(batch),
+        archived_expense_total=F("archived_expense_total") + sum((e.amount for e in batch), Decimal("0")),
+    )
@@ -3,6 +3,8 @@ from django.contrib.auth import authenticate, login, logout, get_user_model
 from django.shortcuts import render, redirect
 from django.views.decorators.http import require_http_methods
 
+from .backends import users_iexact
+
 User = get_user_model()
 
 
@@ -45,7 +47,7 @@ def register(request):
             messages.error(request, "Informe seu primeiro nome.")
         elif not email:
             messages.error(request, "Informe um e-mail válido.")
-        elif User.objects.filter(username__iexact=email).exists():
+        elif users_iexact("username", email).exists():
             messages.error(request, "Já existe uma conta com esse e-mail.")
         elif not password or not confirm:
             messages.error(request, "Informe e confirme a senha.")
@@ -1,17 +1,65 @@
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.db.models.functions import Lower
+
+from .caching import ledger_cache, user_cache_timeout, user_key
 
 User = get_user_model()
 
+
+def users_iexact(field, value):
+    """Equivalente a ``field__iexact`` que aproveita o índice LOWER(field).
+
+    ``__iexact`` vira ``UPPER(campo) = UPPER(valor)`` no PostgreSQL (e ``LIKE``
+    no SQLite), o que nenhum índice atende; aqui a comparação é
+    ``LOWER(campo) = valor``, a mesma expressão da migração 0008.
+
+    O ``LOWER()`` do SQLite só converte ASCII: lá, valores com acentos voltam
+    ao ``__iexact`` (sem índice), que ao menos acha o texto digitado como foi
+    gravado.
+    """
+    if connection.vendor == "sqlite" and not value.isascii():
+        return User.objects.filter(**{f"{field}__iexact": value})
+    return User.objects.alias(_lookup=Lower(field)).filter(_lookup=value.lower())
+
+
+def get_user_by_identifier(identifier):
+    """Procura por username e, se não achar, por e-mail (uma busca indexada cada)."""
+    for field in ("username", "email"):
+        user = users_iexact(field, identifier).order_by("pk").first()
+        if user is not None:
+            return user
+    return None
+
+
 class EmailOrUsernameModelBackend(ModelBackend):
     def authenticate(self, request, username=None, password=None, **kwargs):
         if username is None:
             username = kwargs.get(User.USERNAME_FIELD)
-        try:
-            user = User.objects.get(Q(username__iexact=username) | Q(email__iexact=username))
-        except User.DoesNotExist:
+        if not username:
+            return None
+        user = get_user_by_identifier(username)
+        if user is None:
             return None
         if user.check_password(password) and self.user_can_authenticate(user):
             return user
         return None
+
+    def get_user(self, user_id):
+        """Usado pelo AuthenticationMiddleware a cada requisição; evita a consulta ao banco.
+
+        O cache é limpo quando o usuário é salvo (inclusive troca de senha, que
+        também invalida o hash de sessão conferido pelo Django).
+        """
+        cache = ledger_cache()
+        key = user_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            try:
+                # Do primário, para não guardar no cache uma cópia atrasada da réplica.
+                user = User._default_manager.db_manager(DEFAULT_DB_ALIAS).get(pk=user_id)
+            except User.DoesNotExist:
+                return None
+            cache.set(key, user, user_cache_timeout())
+        return user if self.user_can_authenticate(user) else None
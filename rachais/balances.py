@@ -0,0 +1,355 @@
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import chain
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import DecimalField, F, Max, OuterRef, Q, Subquery, Sum
+
+from .caching import bump_revision
+from .models import BalanceCheckpoint, Expense, ExpenseSplit, GroupBalance, Payment
+from .splits import from_cents, split_equal, to_cents
+
+CENT = Decimal("0.01")
+_TOTAL_FIELD = DecimalField(max_digits=12, decimal_places=2)
+_ledger_maintained = ContextVar("rachai_ledger_maintained", default=False)
+
+
+def stores_implicit_split(split_method):
+    """Se a despesa guarda só a lista de participantes (sem ExpenseSplit)."""
+    return split_method == "EQUAL" and getattr(settings, "RACHAI_EQUAL_SPLIT_STORAGE", "rows") == "implicit"
+
+
+def implicit_shares(amount, user_ids):
+    """``[(user_id, valor)]`` de uma divisão igual guardada só com os ids."""
+    return [(user_id, from_cents(cents)) for user_id, cents in split_equal(to_cents(amount), user_ids)]
+
+
+def build_splits(expense, shares):
+    """Partes de uma despesa a partir de ``[(user_id, centavos)]``.
+
+    Devolve ``(partes, a_gravar)``: as partes sempre alimentam o livro-razão,
+    mas no modo implícito nenhuma é gravada e a despesa recebe
+    ``equal_split_user_ids`` (chamar antes de salvar a despesa).
+    """
+    splits = [ExpenseSplit(expense=expense, user_id=user_id, amount_owed=from_cents(cents)) for user_id, cents in shares]
+    if stores_implicit_split(expense.split_method):
+        expense.equal_split_user_ids = [user_id for user_id, _ in shares]
+        return splits, []
+    return splits, splits
+
+
+def expense_deltas(expense, splits):
+    """Variação de saldo causada por uma despesa e suas partes."""
+    deltas = defaultdict(Decimal)
+    deltas[expense.paid_by_id] += expense.amount
+    for split in splits:
+        deltas[split.user_id] -= split.amount_owed
+    return deltas
+
+
+def payment_deltas(payment):
+    """Variação de saldo causada por um pagamento entre participantes."""
+    deltas = defaultdict(Decimal)
+    deltas[payment.payer_id] += payment.amount
+    deltas[payment.receiver_id] -= payment.amount
+    return deltas
+
+
+def apply_balance_deltas(group, deltas, revision_claimed=False):
+    """Aplica as variações no livro-razão do grupo.
+
+    Deve rodar dentro do mesmo ``transaction.atomic()`` que gravou a
+    despesa/pagamento, para que o saldo nunca divirja do histórico. Também
+    avança a revisão do grupo, invalidando os saldos cacheados (a menos que
+    quem chamou já a tenha avançado com ``claim_revision``).
+    """
+    deltas = {uid: delta for uid, delta in deltas.items() if delta}
+
+    with transaction.atomic():
+        if not revision_claimed:
+            bump_revision(group)
+        if not deltas:
+            return
+
+        existing = {
+            row.user_id: row
+            for row in GroupBalance.objects.select_for_update().filter(
+                group=group, user_id__in=deltas.keys()
+            )
+        }
+        to_update = []
+        to_create = []
+        for user_id, delta in deltas.items():
+            row = existing.get(user_id)
+            if row is None:
+                to_create.append(GroupBalance(group=group, user_id=user_id, amount=delta))
+            else:
+                row.amount += delta
+                to_update.append(row)
+
+        if to_update:
+            GroupBalance.objects.bulk_update(to_update, ["amount"])
+        if to_create:
+            GroupBalance.objects.bulk_create(to_create)
+
+
+def apply_expense(expense, splits, revision_claimed=False):
+    apply_balance_deltas(expense.group, expense_deltas(expense, splits), revision_claimed)
+
+
+def apply_payment(payment, revision_claimed=False):
+    apply_balance_deltas(payment.group, payment_deltas(payment), revision_claimed)
+
+
+@contextmanager
+def maintaining_ledger():
+    """Bloco em que quem grava o histórico já atualiza o livro-razão.
+
+    Fora dele, os sinais de ``signals.py`` reconstroem o livro-razão dos grupos
+    tocados (edições pelo admin, exclusões em cascata).
+    """
+    token = _ledger_maintained.set(True)
+    try:
+        yield
+    finally:
+        _ledger_maintained.reset(token)
+
+
+def ledger_maintained():
+    return _ledger_maintained.get()
+
+
+def _nest(rows):
+    """``(group_id, user_id, valor)`` -> ``{group_id: {user_id: saldo}}``."""
+    balances = defaultdict(lambda: defaultdict(Decimal))
+    for group_id, user_id, amount in rows:
+        balances[group_id][user_id] += amount
+    return {group_id: dict(per_user) for group_id, per_user in balances.items()}
+
+
+def ledger_balances(group_ids):
+    """Lê o saldo de cada usuário dos grupos: O(participantes) linhas."""
+    return _nest(
+        GroupBalance.objects.filter(group_id__in=group_ids).values_list("group_id", "user_id", "amount")
+    )
+
+
+def _grouped_total(qs, group_field, user_field, amount_field, sign=1):
+    """``(group_id, user_id, soma)`` sem ordenação (exigida pelo UNION)."""
+    amount = F(amount_field) if sign > 0 else -F(amount_field)
+    return (
+        qs.order_by()
+        .values(group_field, user_field)
+        .annotate(total=Sum(amount, output_field=_TOTAL_FIELD))
+        .values_list(group_field, user_field, "total")
+    )
+
+
+Checkpoint = namedtuple("Checkpoint", "as_of last_expense_id last_payment_id balances")
+
+
+def latest_checkpoints(group_ids, archived=False):
+    """``{group_id: Checkpoint}`` com o fechamento mais recente de cada grupo.
+
+    Com ``archived=True``, só fechamentos cujo histórico já foi arquivado.
+    """
+    candidates = BalanceCheckpoint.objects.filter(archived=True) if archived else BalanceCheckpoint.objects.all()
+    latest = candidates.filter(group=OuterRef("group")).order_by("-as_of").values("as_of")[:1]
+    rows = candidates.filter(group_id__in=group_ids, as_of=Subquery(latest)).values_list(
+        "group_id", "user_id", "amount", "as_of", "last_expense_id", "last_payment_id"
+    )
+    checkpoints = {}
+    for group_id, user_id, amount, as_of, last_expense_id, last_payment_id in rows:
+        checkpoint = checkpoints.setdefault(group_id, Checkpoint(as_of, last_expense_id, last_payment_id, {}))
+        checkpoint.balances[user_id] = amount
+    return checkpoints
+
+
+def _id_window(field, after, upto):
+    window = Q(**{f"{field}__gt": after})
+    if upto is not None:
+        window &= Q(**{f"{field}__lte": upto})
+    return window
+
+
+def _activity(group_ids, checkpoints, through=None):
+    """Filtros ``(despesas, partes, pagamentos)`` da atividade após cada fechamento.
+
+    ``through`` (``{group_id: (último id de despesa, último id de pagamento)}``)
+    limita também o fim da janela, usado ao fechar um novo período.
+    """
+    through = through or {}
+    plain = [gid for gid in group_ids if gid not in checkpoints and gid not in through]
+    expenses, splits, payments = Q(group_id__in=plain), Q(expense__group_id__in=plain), Q(group_id__in=plain)
+    for gid in set(group_ids).difference(plain):
+        checkpoint = checkpoints.get(gid)
+        after_expense, after_payment = (checkpoint.last_expense_id, checkpoint.last_payment_id) if checkpoint else (0, 0)
+        upto_expense, upto_payment = through.get(gid, (None, None))
+        expenses |= Q(group_id=gid) & _id_window("id", after_expense, upto_expense)
+        splits |= Q(expense__group_id=gid) & _id_window("expense_id", after_expense, upto_expense)
+        payments |= Q(group_id=gid) & _id_window("id", after_payment, upto_payment)
+    return expenses, splits, payments
+
+
+def _checkpoint_rows(checkpoints):
+    for group_id, checkpoint in checkpoints.items():
+        for user_id, amount in checkpoint.balances.items():
+            yield group_id, user_id, amount
+
+
+def sql_balances(group_ids, checkpoints=None):
+    """Calcula os saldos no banco com um único ``UNION ALL`` de agregações.
+
+    Retorna o mesmo resultado que :func:`replay_balances`, mas sem
+    materializar despesas, partes ou pagamentos em Python. Parte do último
+    fechamento de cada grupo, somando só a atividade posterior.
+    """
+    if checkpoints is None:
+        checkpoints = latest_checkpoints(group_ids)
+    expense_q, split_q, payment_q = _activity(group_ids, checkpoints)
+    expenses = Expense.objects.filter(expense_q)
+    splits = ExpenseSplit.objects.filter(split_q)
+    payments = Payment.objects.filter(payment_q)
+
+    paid = _grouped_total(expenses, "group_id", "paid_by_id", "amount")
+    owed = _grouped_total(splits, "expense__group_id", "user_id", "amount_owed", sign=-1)
+    sent = _grouped_total(payments, "group_id", "payer_id", "amount")
+    received = _grouped_total(payments, "group_id", "receiver_id", "amount", sign=-1)
+
+    # SQLite soma decimais como ponto flutuante; normaliza para centavos.
+    totals = (
+        (group_id, user_id, Decimal(total).quantize(CENT))
+        for group_id, user_id, total in paid.union(owed, sent, received, all=True)
+    )
+    return _nest(chain(_checkpoint_rows(checkpoints), totals, _implicit_owed(expense_q)))
+
+
+def _implicit_owed(expense_q):
+    """``(group_id, user_id, -parte)`` das divisões iguais sem ExpenseSplit.
+
+    As partes saem da lista de ids e do valor (quociente e resto em centavos),
+    lidos numa única consulta; nenhuma linha por participante é necessária.
+    """
+    expenses = Expense.objects.filter(expense_q, equal_split_user_ids__isnull=False).values_list(
+        "group_id", "amount", "equal_split_user_ids"
+    )
+    for group_id, amount, user_ids in expenses.iterator():
+        for user_id, owed in implicit_shares(amount, user_ids):
+            yield group_id, user_id, -owed
+
+
+def replay_balances(group_ids, checkpoints=None, through=None):
+    """Recalcula os saldos percorrendo o histórico dos grupos.
+
+    Parte do último fechamento (:class:`BalanceCheckpoint`) de cada grupo, ou
+    dos ``checkpoints`` informados (``{}`` percorre o histórico inteiro).
+    """
+    if checkpoints is None:
+        checkpoints = latest_checkpoints(group_ids)
+    expense_q, split_q, payment_q = _activity(group_ids, checkpoints, through)
+    balances = defaultdict(lambda: defaultdict(Decimal))
+    for group_id, user_id, amount in _checkpoint_rows(checkpoints):
+        balances[group_id][user_id] += amount
+
+    expenses = Expense.objects.filter(expense_q).values_list("group_id", "paid_by_id", "amount")
+    for group_id, paid_by_id, amount in expenses:
+        balances[group_id][paid_by_id] += amount
+
+    splits = ExpenseSplit.objects.filter(split_q).values_list("expense__group_id", "user_id", "amount_owed")
+    for group_id, user_id, amount_owed in splits:
+        balances[group_id][user_id] -= amount_owed
+    for group_id, user_id, amount in _implicit_owed(expense_q):
+        balances[group_id][user_id] += amount
+
+    payments = Payment.objects.filter(payment_q).values_list("group_id", "payer_id", "receiver_id", "amount")
+    for group_id, payer_id, receiver_id, amount in payments:
+        balances[group_id][payer_id] += amount
+        balances[group_id][receiver_id] -= amount
+
+    return {group_id: dict(per_user) for group_id, per_user in balances.items()}
+
+
+@transaction.atomic
+def close_balance_period(group, as_of):
+    """Grava um fechamento do grupo com a atividade criada até ``as_of``.
+
+    Soma ao fechamento anterior só o que entrou desde então. Devolve os saldos
+    gravados, ou ``None`` se não houve atividade nova (ou ``as_of`` não é
+    posterior ao último fechamento).
+    """
+    previous = latest_checkpoints([group.pk]).get(group.pk)
+    if previous and previous.as_of >= as_of:
+        return None
+    last_expense_id = Expense.objects.filter(group=group, created_at__lte=as_of).aggregate(last=Max("id"))["last"] or 0
+    last_payment_id = Payment.objects.filter(group=group, created_at__lte=as_of).aggregate(last=Max("id"))["last"] or 0
+    if previous:
+        # Importações podem gravar datas antigas com ids novos; a janela só avança.
+        last_expense_id = max(last_expense_id, previous.last_expense_id)
+        last_payment_id = max(last_payment_id, previous.last_payment_id)
+        if (last_expense_id, last_payment_id) == (previous.last_expense_id, previous.last_payment_id):
+            return None
+    elif not (last_expense_id or last_payment_id):
+        return None
+
+    balances = replay_balances([group.pk], through={group.pk: (last_expense_id, last_payment_id)}).get(group.pk, {})
+    BalanceCheckpoint.objects.bulk_create(
+        BalanceCheckpoint(
+            group=group, user_id=user_id, amount=amount, as_of=as_of,
+            last_expense_id=last_expense_id, last_payment_id=last_payment_id,
+        )
+        for user_id, amount in balances.items()
+    )
+    return balances
+
+
+@transaction.atomic
+def rebuild_group_balances(group):
+    """Reconstrói o livro-razão do grupo (ex.: após edições pelo admin).
+
+    Percorre o histórico vivo a partir do fechamento arquivado (se houver) e
+    descarta os demais fechamentos, que podem ter ficado desatualizados pelas
+    mesmas edições.
+    """
+    floor = latest_checkpoints([group.pk], archived=True)
+    balances = replay_balances([group.pk], checkpoints=floor).get(group.pk, {})
+    GroupBalance.objects.filter(group=group).delete()
+    BalanceCheckpoint.objects.filter(group=group, archived=False).delete()
+    bump_revision(group)
+    GroupBalance.objects.bulk_create(
+        GroupBalance(group=group, user_id=user_id, amount=amount)
+        for user_id, amount in balances.items()
+    )
+    return balances
+
+
+BALANCE_ENGINES = {
+    "ledger": ledger_balances,
+    "sql": sql_balances,
+    "python": replay_balances,
+}
+
+
+def calculate_group_balances(group_ids, engine=None):
+    """Saldos de vários grupos de uma vez: ``{group_id: {user_id: saldo}}``.
+
+    O número de consultas é constante, independente de quantos grupos são
+    pedidos (padrão do motor: ``RACHAI_BALANCE_ENGINE``).
+    """
+    engine = engine or getattr(settings, "RACHAI_BALANCE_ENGINE", "ledger")
+    if engine not in BALANCE_ENGINES:
+        raise ImproperlyConfigured(
+            f"Motor de saldos desconhecido: {engine!r}. Use um de {sorted(BALANCE_ENGINES)}."
+        )
+    group_ids = list(group_ids)
+    if not group_ids:
+        return {}
+    return BALANCE_ENGINES[engine](group_ids)
+
+
+def calculate_balances(group, engine=None):
+    """Saldos de um único grupo: ``{user_id: saldo}``."""
+    return calculate_group_balances([group.pk], engine).get(group.pk, {})
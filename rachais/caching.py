@@ -0,0 +1,129 @@
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+
+from .models import Group
+
+
+class LRUCache:
+    """Cache em processo, usado quando nenhum cache do Django é configurado.
+
+    Implementa só o subconjunto da API de ``django.core.cache`` usado aqui.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                found[key] = value
+        return found
+
+    def set_many(self, mapping, timeout=None):
+        for key, value in mapping.items():
+            self.set(key, value, timeout)
+        return []
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, _MISSING) is not _MISSING
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_MISSING = object()
+_fallback = LRUCache()
+
+
+def ledger_cache():
+    """Cache do app (saldos, liquidações, usuários): ``RACHAI_CACHE_ALIAS`` ou o LRU em processo."""
+    alias = getattr(settings, "RACHAI_CACHE_ALIAS", "default")
+    if alias and alias in settings.CACHES:
+        return caches[alias]
+    return _fallback
+
+
+def ledger_cache_timeout():
+    return getattr(settings, "RACHAI_LEDGER_CACHE_TIMEOUT", 60 * 60 * 24)
+
+
+def ledger_key(group_id, revision, *parts):
+    """Chave versionada: uma nova revisão do grupo nunca lê dados antigos."""
+    suffix = ":".join(str(part) for part in parts)
+    return f"rachai:ledger:{group_id}:{revision}:{suffix}"
+
+
+def user_key(user_id):
+    return f"rachai:user:{user_id}"
+
+
+def user_cache_timeout():
+    return getattr(settings, "RACHAI_USER_CACHE_TIMEOUT", 60 * 5)
+
+
+def forget_user(user_id):
+    """Descarta o usuário cacheado; a próxima requisição o relê do banco."""
+    ledger_cache().delete(user_key(user_id))
+
+
+def sidebar_key(user_id):
+    return f"rachai:sidebar:{user_id}"
+
+
+def forget_sidebar(*user_ids):
+    """Descarta a lista de grupos do sidebar desses usuários.
+
+    Apaga já e de novo após o commit, para que uma requisição concorrente não
+    recoloque no cache a lista de antes da transação.
+    """
+    def forget():
+        cache = ledger_cache()
+        for user_id in user_ids:
+            cache.delete(sidebar_key(user_id))
+
+    forget()
+    transaction.on_commit(forget)
+
+
+def bump_revision(group):
+    """Incrementa a revisão do grupo, invalidando tudo que foi cacheado para ele."""
+    Group.objects.filter(pk=group.pk).update(revision=F("revision") + 1)
+
+
+def claim_revision(group, expected):
+    """Avança a revisão só se ela ainda for ``expected`` (compare-and-set).
+
+    Dentro de ``transaction.atomic()``, o UPDATE também trava a linha do grupo
+    até o commit: escritas no mesmo grupo se enfileiram e a que chega depois
+    encontra a revisão já avançada (``False``), enquanto grupos diferentes
+    seguem em paralelo. Diferente de ``select_for_update``, vale também no SQLite.
+    """
+    if not Group.objects.filter(pk=group.pk, revision=expected).update(revision=F("revision") + 1):
+        return False
+    group.revision = expected + 1
+    return True
@@ -0,0 +1,85 @@
+"""Roteamento opcional entre o banco primário e réplicas de leitura.
+
+Ativado quando ``RACHAI_READ_REPLICAS`` lista aliases de banco (ver
+``RACHAI_DB_REPLICAS`` em settings.py). Só leituras de requisições GET/HEAD
+vão para as réplicas, e apenas se a sessão não escreveu nada nos últimos
+``RACHAI_PRIMARY_PIN_SECONDS`` segundos, para que o usuário sempre veja o que
+acabou de gravar. Cada requisição lê de uma única réplica, sorteada no início,
+para não misturar réplicas com atrasos diferentes. Escritas, requisições que alteram dados e código fora de
+uma requisição (comandos de gerenciamento, shell) usam sempre o primário.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_routing = ContextVar("rachai_db_routing", default=None)
+
+
+def read_replicas():
+    return list(getattr(settings, "RACHAI_READ_REPLICAS", []))
+
+
+class RoutingState:
+    """Estado de roteamento da requisição em andamento."""
+
+    def __init__(self, pinned=False, replica=None):
+        self.pinned = pinned
+        self.wrote = False
+        self.replica = replica
+
+
+def begin_routing(pinned):
+    """Abre o escopo de roteamento de uma requisição; devolve ``(estado, token)``."""
+    replicas = read_replicas()
+    state = RoutingState(pinned, random.choice(replicas) if replicas else None)
+    return state, _routing.set(state)
+
+
+def end_routing(token):
+    _routing.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Lê do primário dentro do bloco (ex.: antes de gravar num cache compartilhado)."""
+    state = _routing.get()
+    if state is None:
+        yield
+        return
+    pinned = state.pinned
+    state.pinned = True
+    try:
+        yield
+    finally:
+        state.pinned = pinned or state.wrote
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is None or state.replica is None:
+            return None
+        if state.pinned:
+            return DEFAULT_DB_ALIAS
+        # Relacionados de um objeto vêm do mesmo banco que ele.
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            # Depois de escrever, o resto da requisição também lê do primário.
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Réplicas têm os mesmos dados do primário.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,154 @@
+"""Exportação do histórico em streaming (CSV ou JSON-lines).
+
+Cada linha vem de ``values_list(...).iterator(chunk_size=...)``: nenhum
+objeto de modelo é criado e a memória não cresce com o tamanho do histórico.
+"""
+import csv
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+
+from .balances import implicit_shares
+from .models import ArchivedExpense, ArchivedPayment, Expense, ExpenseSplit, Payment
+
+User = get_user_model()
+
+COLUMNS = ["kind", "id", "group", "expense_id", "created_at", "description", "split_method", "user", "counterparty", "amount"]
+
+
+def _chunk_size():
+    return getattr(settings, "RACHAI_EXPORT_CHUNK_SIZE", 2000)
+
+
+def _expense_rows(qs, id_field="id"):
+    rows = qs.order_by(id_field).values_list(
+        id_field, "group__name", "created_at", "description", "split_method", "paid_by__username", "amount"
+    )
+    for pk, group, created_at, description, method, paid_by, amount in rows.iterator(chunk_size=_chunk_size()):
+        yield ("expense", pk, group, pk, created_at, description, method, paid_by, "", amount)
+
+
+def _split_rows(qs):
+    rows = qs.order_by("expense_id", "id").values_list(
+        "id", "expense__group__name", "expense_id", "expense__created_at", "expense__description",
+        "expense__split_method", "user__username", "expense__paid_by__username", "amount_owed",
+    )
+    for row in rows.iterator(chunk_size=_chunk_size()):
+        yield ("split", *row)
+
+
+def _implicit_split_rows(qs, user_id=None):
+    """Partes derivadas das despesas EQUAL guardadas só com a lista de ids.
+
+    Saem no mesmo formato de ``_split_rows``, sem id de linha; com
+    ``user_id``, só as partes desse usuário.
+    """
+    rows = qs.filter(equal_split_user_ids__isnull=False).order_by("id").values_list(
+        "id", "group__name", "created_at", "description", "split_method", "paid_by__username", "amount",
+        "equal_split_user_ids",
+    )
+    shares = ((*row[:-1], implicit_shares(row[-2], row[-1])) for row in rows.iterator(chunk_size=_chunk_size()))
+    yield from _share_rows(shares, user_id)
+
+
+def _archived_split_rows(qs, user_id=None):
+    """Partes das despesas arquivadas, lidas do JSON ``shares`` de cada linha."""
+    rows = qs.order_by("original_id").values_list(
+        "original_id", "group__name", "created_at", "description", "split_method", "paid_by__username", "amount",
+        "shares",
+    )
+    shares = (
+        (*row[:-1], [(uid, Decimal(owed)) for uid, owed in row[-1]])
+        for row in rows.iterator(chunk_size=_chunk_size())
+    )
+    yield from _share_rows(shares, user_id)
+
+
+def _share_rows(rows, user_id):
+    """Expande ``(..., [(user_id, valor)])`` em linhas "split", com os nomes buscados em lote."""
+    usernames = {}
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= _chunk_size():
+            yield from _expand_shares(batch, usernames, user_id)
+            batch = []
+    yield from _expand_shares(batch, usernames, user_id)
+
+
+def _expand_shares(batch, usernames, user_id):
+    missing = {uid for row in batch for uid, _ in row[-1]} - usernames.keys()
+    if missing:
+        usernames.update(User.objects.filter(pk__in=missing).values_list("id", "username"))
+    for pk, group, created_at, description, method, paid_by, amount, shares in batch:
+        for uid, owed in shares:
+            if user_id is None or uid == user_id:
+                yield ("split", "", group, pk, created_at, description, method, usernames.get(uid, ""), paid_by, owed)
+
+
+def _payment_rows(qs, id_field="id"):
+    rows = qs.order_by(id_field).values_list(
+        id_field, "group__name", "created_at", "note", "payer__username", "receiver__username", "amount"
+    )
+    for pk, group, created_at, note, payer, receiver, amount in rows.iterator(chunk_size=_chunk_size()):
+        yield ("payment", pk, group, "", created_at, note, "", payer, receiver, amount)
+
+
+def group_rows(group):
+    """Despesas, partes e pagamentos de um grupo, com o histórico arquivado antes."""
+    yield from _expense_rows(ArchivedExpense.objects.filter(group=group), "original_id")
+    yield from _expense_rows(Expense.objects.filter(group=group))
+    yield from _archived_split_rows(ArchivedExpense.objects.filter(group=group))
+    yield from _split_rows(ExpenseSplit.objects.filter(expense__group=group))
+    yield from _implicit_split_rows(Expense.objects.filter(group=group))
+    yield from _payment_rows(ArchivedPayment.objects.filter(group=group), "original_id")
+    yield from _payment_rows(Payment.objects.filter(group=group))
+
+
+def statement_rows(user):
+    """Extrato do usuário em todos os grupos: o que pagou, o que deve e as quitações."""
+    yield from _expense_rows(ArchivedExpense.objects.filter(paid_by=user), "original_id")
+    yield from _expense_rows(Expense.objects.filter(paid_by=user))
+    # As partes arquivadas e as implícitas ficam em JSON; filtra pelos grupos
+    # do usuário e confere em Python.
+    yield from _archived_split_rows(ArchivedExpense.objects.filter(group__participants__user=user), user.pk)
+    yield from _split_rows(ExpenseSplit.objects.filter(user=user))
+    yield from _implicit_split_rows(Expense.objects.filter(group__participants__user=user), user.pk)
+    yield from _payment_rows(ArchivedPayment.objects.filter(Q(payer=user) | Q(receiver=user)), "original_id")
+    yield from _payment_rows(Payment.objects.filter(Q(payer=user) | Q(receiver=user)))
+
+
+class _Echo:
+    """Pseudo-arquivo para o ``csv.writer`` devolver cada linha em vez de gravá-la."""
+
+    def write(self, value):
+        return value
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return f"{value:.2f}"
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow([_plain(value) for value in row])
+
+
+def iter_jsonl(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, (_plain(value) for value in row))), ensure_ascii=False) + "\n"
+
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", iter_csv),
+    "jsonl": ("application/x-ndjson; charset=utf-8", iter_jsonl),
+}
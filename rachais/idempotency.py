@@ -0,0 +1,101 @@
+"""Reenvios seguros de formulários com ``Idempotency-Key``.
+
+O cliente manda a chave no cabeçalho ``Idempotency-Key`` ou no campo oculto
+``idempotency_key`` (ver a tag ``{% idempotency_field %}``). A primeira
+requisição com a chave reserva uma linha em ``IdempotencyKey``; quando a view
+grava e chama :func:`mark_written`, o redirecionamento fica guardado e os
+reenvios o recebem sem chegar à view. Chaves vencidas são apagadas em lote por
+``manage.py purge_idempotency_keys``.
+"""
+import hashlib
+from datetime import timedelta
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib import messages
+from django.db import IntegrityError
+from django.http import HttpResponse, HttpResponseRedirect
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+FIELD_NAME = "idempotency_key"
+HEADER_NAME = "Idempotency-Key"
+_IGNORED_FIELDS = {FIELD_NAME, "csrfmiddlewaretoken"}
+_WRITTEN_ATTR = "_rachai_idempotent_written"
+
+
+def idempotency_ttl():
+    return timedelta(seconds=getattr(settings, "RACHAI_IDEMPOTENCY_TTL", 60 * 60 * 24))
+
+
+def request_fingerprint(request):
+    """Hash do caminho e dos campos enviados (sem a chave nem o token CSRF)."""
+    fields = sorted(
+        (name, value) for name, values in request.POST.lists() if name not in _IGNORED_FIELDS for value in values
+    )
+    return hashlib.sha256(f"{request.path}?{urlencode(fields)}".encode()).hexdigest()
+
+
+def mark_written(request):
+    """Sinaliza ao :func:`idempotent` que a view gravou: a resposta será reaproveitada."""
+    setattr(request, _WRITTEN_ATTR, True)
+
+
+def idempotent(view):
+    """Decorador para POSTs que gravam: deduplica reenvios com a mesma chave.
+
+    Só redirecionamentos de views que chamaram :func:`mark_written` são
+    guardados; recusas (mesmo as que redirecionam) e exceções liberam a chave
+    para que o cliente possa tentar de novo.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER_NAME) or request.POST.get(FIELD_NAME)
+        if request.method != "POST" or not key or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        if len(key) > 64:
+            return HttpResponse("Idempotency-Key longa demais.", status=400)
+
+        fingerprint = request_fingerprint(request)
+        record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+        if record is not None and record.expires_at <= timezone.now():
+            record.delete()
+            record = None
+        if record is not None:
+            return _replay(request, record, fingerprint)
+
+        try:
+            record = IdempotencyKey.objects.create(
+                user=request.user, key=key, fingerprint=fingerprint, expires_at=timezone.now() + idempotency_ttl(),
+            )
+        except IntegrityError:
+            # Outra requisição com a mesma chave reservou primeiro.
+            return HttpResponse("Requisição com esta Idempotency-Key em andamento.", status=409)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            record.delete()
+            raise
+        if isinstance(response, HttpResponseRedirect) and getattr(request, _WRITTEN_ATTR, False):
+            record.status_code = response.status_code
+            record.location = response["Location"][:255]
+            record.save(update_fields=["status_code", "location"])
+        else:
+            record.delete()
+        return response
+
+    return wrapper
+
+
+def _replay(request, record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return HttpResponse("Idempotency-Key já usada com outros dados.", status=422)
+    if record.status_code is None:
+        return HttpResponse("Requisição com esta Idempotency-Key em andamento.", status=409)
+    messages.info(request, "Este envio já tinha sido processado.")
+    response = HttpResponseRedirect(record.location)
+    response.status_code = record.status_code
+    return response
@@ -0,0 +1,263 @@
+"""Importação em lote de despesas a partir de CSV ou JSON-lines.
+
+O arquivo é lido linha a linha; as linhas válidas são gravadas em lotes com
+``bulk_create`` dentro de transações curtas e as inválidas são reportadas
+sem interromper o restante da importação.
+
+Colunas (CSV) ou chaves (JSON-lines):
+
+* ``description`` e ``amount`` — obrigatórias;
+* ``paid_by`` — username, e-mail ou id de um participante;
+* ``split_method`` — ``EQUAL`` (padrão), ``UNEQUAL_VALUE`` ou ``UNEQUAL_PERCENTAGE``;
+* ``splits`` — para os métodos desiguais: ``"ana:60,00; bia:40,00"`` no CSV
+  ou um objeto ``{"ana": "60,00"}`` no JSON;
+* ``created_at`` — opcional, em ISO 8601.
+"""
+import csv
+import io
+import json
+from collections import defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .balances import apply_balance_deltas, build_splits, expense_deltas
+from .models import Expense, ExpenseSplit
+from .splits import SplitError, from_cents, split, to_cents
+
+SPLIT_METHODS = {choice for choice, _ in Expense.SPLIT_METHOD_CHOICES}
+# Expense.amount tem max_digits=10 e duas casas decimais.
+MAX_AMOUNT = Decimal("99999999.99")
+
+
+class RowError(ValueError):
+    pass
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    errors: list = field(default_factory=list)
+
+
+def _parse_amount(raw, label="valor"):
+    if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+        raw = str(raw)
+    elif raw is None:
+        raw = ""
+    elif not isinstance(raw, str):
+        raise RowError(f"{label} inválido: {raw!r}.")
+    raw = raw.strip()
+    # "1.234,56" segue o formato do formulário; "1234.56" é aceito como está.
+    norm = raw.replace(".", "").replace(",", ".") if "," in raw else raw
+    try:
+        value = Decimal(norm)
+    except InvalidOperation:
+        raise RowError(f"{label} inválido: {raw!r}.") from None
+    # Compara já arredondado para centavos, como será gravado.
+    if not value.is_finite() or abs(value) >= MAX_AMOUNT + Decimal("0.005"):
+        raise RowError(f"{label} inválido: {raw!r}.")
+    return value
+
+
+def _parse_splits(raw):
+    if isinstance(raw, dict):
+        return list(raw.items())
+    if raw is not None and not isinstance(raw, str):
+        raise RowError("Partes inválidas: use um objeto {usuario: valor} ou \"usuario:valor; ...\".")
+    pairs = []
+    for chunk in (raw or "").split(";"):
+        if not chunk.strip():
+            continue
+        who, sep, value = chunk.rpartition(":")
+        if not sep:
+            raise RowError(f"Parte inválida: {chunk.strip()!r} (use usuario:valor).")
+        pairs.append((who.strip(), value.strip()))
+    return pairs
+
+
+class _RowBuilder:
+    """Valida uma linha e monta a despesa e as partes, sem tocar no banco."""
+
+    def __init__(self, group, participant_users):
+        self.group = group
+        self.users = participant_users
+        self.lookup = {}
+        for user in participant_users:
+            self.lookup[str(user.id)] = user
+            self.lookup[user.username.lower()] = user
+            if user.email:
+                self.lookup.setdefault(user.email.lower(), user)
+
+    def _user(self, ident):
+        user = self.lookup.get(str(ident).strip().lower())
+        if user is None:
+            raise RowError(f"Participante não encontrado: {ident!r}.")
+        return user
+
+    def build(self, row):
+        description = str(row.get("description") or "").strip()
+        if not description:
+            raise RowError("Informe a descrição da despesa.")
+        if len(description) > 255:
+            raise RowError("A descrição deve ter no máximo 255 caracteres.")
+
+        amount = _parse_amount(row.get("amount"))
+        if amount <= 0:
+            raise RowError("O valor da despesa deve ser maior que zero.")
+
+        payer = self._user(row.get("paid_by") or "")
+        split_method = str(row.get("split_method") or "EQUAL").strip().upper()
+        if split_method not in SPLIT_METHODS:
+            raise RowError(f"Método de divisão inválido: {split_method!r}.")
+
+        created_at = None
+        if row.get("created_at"):
+            try:
+                created_at = parse_datetime(str(row["created_at"]).strip())
+            except ValueError:
+                created_at = None
+            if created_at is None:
+                raise RowError(f"Data inválida: {row['created_at']!r}.")
+            if timezone.is_naive(created_at):
+                created_at = timezone.make_aware(created_at)
+
+        amount_cents = to_cents(amount)
+        try:
+            shares = split(split_method, amount_cents, self._spec(split_method, row.get("splits")))
+        except SplitError as exc:
+            raise RowError(str(exc)) from None
+
+        expense = Expense(
+            group=self.group,
+            description=description,
+            amount=from_cents(amount_cents),
+            paid_by=payer,
+            split_method=split_method,
+        )
+        splits, _ = build_splits(expense, shares)
+        return expense, splits, created_at
+
+    def _spec(self, split_method, raw):
+        if split_method == "EQUAL":
+            return [user.id for user in self.users]
+
+        spec = []
+        seen = set()
+        for who, value in _parse_splits(raw):
+            user = self._user(who)
+            if user.id in seen:
+                raise RowError(f"Participante repetido nas partes: {who!r}.")
+            seen.add(user.id)
+            if split_method == "UNEQUAL_VALUE":
+                owed = _parse_amount(value, f"Valor de {who}")
+                if owed < 0:
+                    raise RowError(f"Valor inválido inserido para {who}.")
+                spec.append((user.id, to_cents(owed)))
+            else:
+                if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+                    raise RowError(f"Porcentagem inválida para {who}.")
+                try:
+                    percentage = Decimal(str(value).replace(",", "."))
+                except InvalidOperation:
+                    raise RowError(f"Porcentagem inválida para {who}.") from None
+                if not percentage.is_finite() or percentage < 0:
+                    raise RowError(f"Porcentagem inválida para {who}.")
+                spec.append((user.id, percentage))
+        return spec
+
+
+def iter_csv_rows(stream):
+    """``(linha, dict)`` de um arquivo CSV em texto, lido sob demanda."""
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def iter_jsonl_rows(stream):
+    for line_num, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as exc:
+            yield line_num, exc
+            continue
+        yield line_num, row if isinstance(row, dict) else RowError("Cada linha deve ser um objeto JSON.")
+
+
+def text_stream(binary):
+    """Envolve um arquivo binário (ex.: upload) para leitura em texto UTF-8."""
+    return io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+
+
+def _flush(group, pending):
+    """Grava um lote de despesas válidas numa única transação."""
+    with transaction.atomic():
+        expenses = Expense.objects.bulk_create([expense for expense, _, _ in pending])
+
+        dated = []
+        splits = []
+        deltas = defaultdict(Decimal)
+        for expense, (_, expense_splits, created_at) in zip(expenses, pending):
+            if expense.equal_split_user_ids is None:
+                splits.extend(expense_splits)
+            for user_id, delta in expense_deltas(expense, expense_splits).items():
+                deltas[user_id] += delta
+            if created_at is not None:
+                expense.created_at = created_at
+                dated.append(expense)
+
+        ExpenseSplit.objects.bulk_create(splits, batch_size=1000)
+        if dated:
+            Expense.objects.bulk_update(dated, ["created_at"], batch_size=1000)
+        apply_balance_deltas(group, deltas)
+
+
+def import_expenses(group, rows, chunk_size=500):
+    """Importa ``(linha, dict)`` para o grupo, em lotes de ``chunk_size``.
+
+    Se o arquivo deixa de poder ser lido no meio (bytes inválidos, CSV
+    malformado), as linhas válidas até ali são gravadas e a importação para,
+    com o ponto da falha entre os erros.
+    """
+    participant_users = [p.user for p in group.participants.select_related("user").order_by("id")]
+    builder = _RowBuilder(group, participant_users)
+    result = ImportResult()
+    pending = []
+    rows = iter(rows)
+    line_num = 0
+
+    while True:
+        try:
+            line_num, row = next(rows)
+        except StopIteration:
+            break
+        except (UnicodeDecodeError, csv.Error) as exc:
+            result.errors.append((line_num + 1, f"Não foi possível ler o arquivo a partir daqui: {exc}"))
+            break
+
+        try:
+            if isinstance(row, Exception):
+                raise RowError(str(row))
+            pending.append(builder.build(row))
+        except RowError as exc:
+            result.errors.append((line_num, str(exc)))
+            continue
+        except (ValueError, ArithmeticError, TypeError) as exc:
+            # Rede de segurança: um valor inesperado invalida só a linha.
+            result.errors.append((line_num, f"Linha inválida: {exc}."))
+            continue
+
+        if len(pending) >= chunk_size:
+            _flush(group, pending)
+            result.created += len(pending)
+            pending = []
+
+    if pending:
+        _flush(group, pending)
+        result.created += len(pending)
+    return result
@@ -0,0 +1,33 @@
+"""Utilitários compartilhados pelos comandos de benchmark (não é um comando)."""
+import time
+
+
+def percentile(samples, pct):
+    """Percentil por interpolação linear; ``samples`` não precisa estar ordenado."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def time_call(fn, repeat=1):
+    """Executa ``fn`` ``repeat`` vezes; retorna (último resultado, durações em ms)."""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return result, durations
+
+
+def summarize(durations):
+    return {
+        "p50": percentile(durations, 50),
+        "p95": percentile(durations, 95),
+        "p99": percentile(durations, 99),
+        "max": max(durations) if durations else 0.0,
+    }
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from rachais.archive import archivable_checkpoint, archive_group_history
+from rachais.models import Expense, Group, Payment
+
+
+class Command(BaseCommand):
+    help = "Move para o arquivo o histórico dos grupos coberto pelo último fechamento quitado."
+
+    def add_arguments(self, parser):
+        parser.add_argument("group_ids", nargs="*", type=int, help="IDs dos grupos (padrão: todos).")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--include-unsettled",
+            action="store_true",
+            help="Arquiva até o último fechamento mesmo com saldos em aberto (eles seguem como saldo transportado).",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Só conta o que seria arquivado.")
+
+    def handle(self, *args, group_ids, batch_size, include_unsettled, dry_run, **options):
+        groups = Group.objects.order_by("pk")
+        if group_ids:
+            groups = groups.filter(pk__in=group_ids)
+
+        archived_groups = expenses = payments = 0
+        for group in groups.iterator():
+            checkpoint = archivable_checkpoint(group, settled_only=not include_unsettled)
+            if checkpoint is None:
+                continue
+            if dry_run:
+                moved = (
+                    Expense.objects.filter(group=group, id__lte=checkpoint.last_expense_id).count(),
+                    Payment.objects.filter(group=group, id__lte=checkpoint.last_payment_id).count(),
+                )
+            else:
+                moved = archive_group_history(group, checkpoint, batch_size)
+            archived_groups += 1
+            expenses += moved[0]
+            payments += moved[1]
+
+        verb = "seriam arquivados" if dry_run else "arquivados"
+        self.stdout.write(self.style.SUCCESS(
+            f"{archived_groups} grupo(s): {expenses} despesa(s) e {payments} pagamento(s) {verb}."
+        ))
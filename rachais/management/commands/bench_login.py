@@ -0,0 +1,88 @@
+import random
+import time
+
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from rachais.backends import get_user_by_identifier, users_iexact
+
+from ._bench import summarize, time_call
+
+User = get_user_model()
+
+
+def _legacy_lookup(identifier):
+    """Busca antiga do backend: um OR de dois ``iexact`` que nenhum índice atende."""
+    return User.objects.filter(Q(username__iexact=identifier) | Q(email__iexact=identifier)).first()
+
+
+class Command(BaseCommand):
+    help = "Mede a busca de usuário do login (antiga x indexada) e a vazão de authenticate()."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1_000_000, help="Tamanho alvo da tabela de usuários.")
+        parser.add_argument("--lookups", type=int, default=200)
+        parser.add_argument("--logins", type=int, default=20, help="authenticate() completos (inclui o hash da senha).")
+        parser.add_argument("--prefix", default="login")
+        parser.add_argument("--password", default="senhaSuperF0rte")
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--explain", action="store_true", help="Mostra o plano de cada consulta.")
+
+    def handle(self, *args, **options):
+        prefix = options["prefix"]
+        existing = self._fill(options["users"], prefix, options["password"], options["batch_size"])
+        if not existing:
+            raise CommandError(f"Nenhum usuário '{prefix}-N' na tabela; aumente --users.")
+        rng = random.Random(options["seed"])
+        identifiers = [f"{prefix}-{rng.randrange(existing)}@rachai.test" for _ in range(options["lookups"])]
+        # Metade em maiúsculas: a busca precisa ignorar a caixa.
+        identifiers[1::2] = [identifier.upper() for identifier in identifiers[1::2]]
+
+        self.stdout.write(f"{User.objects.count()} usuários na tabela")
+        self.stdout.write(f"{'busca':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'buscas/s':>10}")
+        for name, lookup in (("antiga", _legacy_lookup), ("indexada", get_user_by_identifier)):
+            durations = []
+            for identifier in identifiers:
+                user, elapsed = time_call(lambda: lookup(identifier))
+                if user is None:
+                    self.stderr.write(f"{identifier} não encontrado pela busca {name}")
+                durations.extend(elapsed)
+            stats = summarize(durations)
+            rate = len(durations) / (sum(durations) / 1000)
+            self.stdout.write(
+                f"{name:>10} {stats['p50']:>9.2f} {stats['p95']:>9.2f} {stats['p99']:>9.2f} {rate:>10.0f}"
+            )
+
+        if options["explain"]:
+            sample = identifiers[0]
+            self.stdout.write("\nPlano (antiga):\n" + User.objects.filter(
+                Q(username__iexact=sample) | Q(email__iexact=sample)
+            ).explain())
+            self.stdout.write("\nPlano (indexada):\n" + users_iexact("username", sample).explain())
+
+        if options["logins"]:
+            start = time.perf_counter()
+            for identifier in identifiers[:options["logins"]]:
+                authenticate(username=identifier, password=options["password"])
+            elapsed = time.perf_counter() - start
+            count = min(options["logins"], len(identifiers))
+            self.stdout.write(f"\nauthenticate(): {count / elapsed:.1f} logins/s ({elapsed / count * 1000:.1f} ms cada)")
+
+    def _fill(self, target, prefix, password, batch_size):
+        """Completa a tabela até ``target`` usuários ``<prefix>-N``; devolve quantos existem."""
+        existing = User.objects.filter(username__startswith=f"{prefix}-").count()
+        missing = target - User.objects.count()
+        if missing <= 0:
+            return existing
+        hashed = make_password(password)
+        self.stdout.write(f"Criando {missing} usuários...")
+        for start in range(existing, existing + missing, batch_size):
+            stop = min(start + batch_size, existing + missing)
+            User.objects.bulk_create(
+                User(username=f"{prefix}-{i}@rachai.test", email=f"{prefix}-{i}@rachai.test", password=hashed)
+                for i in range(start, stop)
+            )
+        return existing + missing
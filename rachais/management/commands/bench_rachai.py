@@ -0,0 +1,131 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rachais.balances import calculate_balances
+from rachais.caching import ledger_cache
+from rachais.models import Expense, ExpenseSplit, Group, Participant, Payment
+from rachais.settlements import settle
+
+from ._bench import summarize
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Mede latência (p50/p95/p99) e número de consultas das views principais."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--group", type=int, help="Grupo a medir (padrão: o com mais despesas).")
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--cold", action="store_true", help="Limpa o cache de saldos antes de cada requisição.")
+        parser.add_argument("--read-only", action="store_true", help="Não mede add_expense nem pay_debt.")
+        parser.add_argument("--explain", action="store_true", help="Mostra o plano das consultas quentes.")
+
+    def handle(self, *args, group, repeat, cold, read_only, explain, **options):
+        if group:
+            target = Group.objects.filter(pk=group).first()
+        else:
+            target = Group.objects.annotate(n=Count("expenses")).order_by("-n").first()
+        if target is None:
+            raise CommandError("Nenhum grupo encontrado; rode seed_rachai antes.")
+
+        members = [p.user for p in target.participants.select_related("user").order_by("id")]
+        if len(members) < 2:
+            raise CommandError("O grupo precisa de ao menos dois participantes.")
+        # Mede como o maior devedor, para que pay_debt sempre tenha o que quitar.
+        balances = calculate_balances(target)
+        members.sort(key=lambda user: balances.get(user.pk, 0))
+        self.user, self.creditor = members[0], members[-1]
+        self.cold = cold
+
+        if explain:
+            self._explain(target)
+
+        self.client = Client(HTTP_HOST="localhost")
+        self.client.force_login(self.user)
+
+        self.stdout.write(f"Grupo {target.pk} ({target.expenses.count()} despesas), usuário {self.user.username}")
+        self.stdout.write(f"{'view':>14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'consultas':>10}")
+
+        list_url = reverse("rachais:group_list")
+        detail_url = reverse("rachais:group_detail", args=[target.pk])
+        self._report("group_list", repeat, lambda _: self.client.get(list_url))
+        self._report("group_detail", repeat, lambda _: self.client.get(detail_url))
+        if read_only:
+            return
+
+        add_url = reverse("rachais:add_expense", args=[target.pk])
+        self.expense_payload = {
+            "description": "Benchmark", "amount": "37,00", "paid_by": self.creditor.pk, "split_method": "EQUAL",
+        }
+        self._report("add_expense", repeat, lambda _: self.client.post(add_url, self.expense_payload), created=Expense)
+        pay_url = reverse("rachais:pay_debt")
+        self._report(
+            "pay_debt", repeat, lambda payload: self.client.post(pay_url, payload),
+            lambda: self._debt(target, add_url), created=Payment,
+        )
+
+    def _explain(self, group):
+        """Plano das consultas por grupo que os índices compostos devem atender."""
+        user = self.user
+        page = Expense.objects.filter(group=group).order_by("-created_at", "-id")[:50]
+        queries = {
+            "página de despesas": page,
+            "partes da página": ExpenseSplit.objects.filter(expense__in=list(page.values_list("id", flat=True))),
+            "partes do usuário": ExpenseSplit.objects.filter(user=user).values_list("expense_id", "amount_owed"),
+            "pagamentos feitos": Payment.objects.filter(group=group, payer=user),
+            "pagamentos recebidos": Payment.objects.filter(group=group, receiver=user),
+            "participação": Participant.objects.filter(group=group, user=user),
+        }
+        # No PostgreSQL, ANALYZE mostra tempos e linhas reais de cada nó.
+        options = {"analyze": True} if connection.vendor == "postgresql" else {}
+        for name, qs in queries.items():
+            self.stdout.write(f"-- {name} ({connection.vendor})")
+            self.stdout.write(qs.explain(**options))
+        self.stdout.write("")
+
+    def _debt(self, group, add_url):
+        """Dívida real do usuário; cada pagamento quita tudo, então cria outra se preciso."""
+        for attempt in range(2):
+            group.refresh_from_db()
+            for debtor_id, creditor_id, amount in settle(calculate_balances(group)):
+                if debtor_id == self.user.pk:
+                    return {"group_id": group.pk, "receiver_id": creditor_id, "amount": f"{amount:.2f}"}
+            if attempt == 0:
+                self.client.post(add_url, self.expense_payload)
+        raise CommandError("O usuário não tem dívida a quitar; pay_debt não pode ser medido.")
+
+    def _report(self, name, repeat, request, prepare=None, created=None):
+        """Executa ``request`` ``repeat`` vezes; ``prepare`` roda fora da medição.
+
+        Com ``created``, cada requisição precisa gravar uma linha desse modelo:
+        as views redirecionam também quando recusam o envio.
+        """
+        durations = []
+        queries = []
+        for _ in range(repeat):
+            payload = prepare() if prepare else None
+            before = created.objects.count() if created else None
+            if self.cold:
+                ledger_cache().clear()
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                response = request(payload)
+                durations.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                raise CommandError(f"{name} respondeu {response.status_code}.")
+            if created and created.objects.count() != before + 1:
+                raise CommandError(f"{name} não gravou nenhum {created.__name__}; a requisição foi recusada.")
+            queries.append(len(ctx.captured_queries))
+
+        stats = summarize(durations)
+        self.stdout.write(
+            f"{name:>14} {stats['p50']:>9.1f} {stats['p95']:>9.1f} {stats['p99']:>9.1f} {max(queries):>10}"
+        )
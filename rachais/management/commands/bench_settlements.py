@@ -0,0 +1,45 @@
+import random
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from rachais.settlements import EXACT_LIMIT, STRATEGIES, settle
+
+from ._bench import summarize, time_call
+
+
+def synthetic_balances(size, rng, step=500):
+    """Saldos aleatórios que somam exatamente zero.
+
+    Valores múltiplos de ``step`` centavos imitam contas redondas, onde
+    subconjuntos de soma zero (e portanto economia de transferências) aparecem.
+    """
+    cents = [rng.randint(-100, 100) * step for _ in range(size - 1)]
+    cents.append(-sum(cents))
+    return {user_id: Decimal(value) / 100 for user_id, value in enumerate(cents, start=1)}
+
+
+class Command(BaseCommand):
+    help = "Compara as estratégias de liquidação em número de transferências e tempo."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="3,8,12,50,500,5000", help="Participantes por grupo sintético.")
+        parser.add_argument("--strategies", default=",".join(STRATEGIES))
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--step", type=int, default=500, help="Granularidade dos saldos, em centavos.")
+
+    def handle(self, *args, sizes, strategies, repeat, seed, step, **options):
+        rng = random.Random(seed)
+        names = [name.strip() for name in strategies.split(",") if name.strip()]
+
+        self.stdout.write(f"{'participantes':>13} {'estratégia':>11} {'transf.':>8} {'p50 ms':>9} {'p95 ms':>9}")
+        for size in (int(value) for value in sizes.split(",")):
+            balances = synthetic_balances(size, rng, step)
+            for name in names:
+                if name == "exact" and size > EXACT_LIMIT:
+                    self.stdout.write(f"{size:>13} {name:>11} {'-':>8} {'-':>9} {'-':>9}")
+                    continue
+                rows, durations = time_call(lambda: settle(balances, name), repeat)
+                stats = summarize(durations)
+                self.stdout.write(f"{size:>13} {name:>11} {len(rows):>8} {stats['p50']:>9.2f} {stats['p95']:>9.2f}")
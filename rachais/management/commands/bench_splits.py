@@ -0,0 +1,99 @@
+import decimal
+import random
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from rachais.splits import split_batch, to_cents
+
+from ._bench import summarize, time_call
+
+
+# Cópia do cálculo que ficava inline em add_expense, mantida só como referência.
+def _legacy_equal(amount, user_ids):
+    split_amount = round(amount / len(user_ids), 2)
+    remainder = amount - (split_amount * len(user_ids))
+    return [(uid, split_amount + remainder if i == 0 else split_amount) for i, uid in enumerate(user_ids)]
+
+
+def _legacy_values(amount, values):
+    total = sum((value for _, value in values), Decimal("0.00"))
+    if total.quantize(Decimal("0.01")) != amount.quantize(Decimal("0.01")):
+        raise ValueError("soma")
+    return [(uid, value) for uid, value in values if value > 0]
+
+
+def _legacy_percentages(amount, percentages):
+    total = sum((p for _, p in percentages), Decimal("0.00"))
+    if total.quantize(Decimal("0.01")) != Decimal("100.00"):
+        raise ValueError("soma")
+    rows = []
+    calculated = Decimal("0.00")
+    for uid, percentage in sorted(percentages):
+        owed = (percentage / Decimal("100.00") * amount).quantize(Decimal("0.01"), rounding=decimal.ROUND_HALF_UP)
+        calculated += owed
+        if owed > 0:
+            rows.append([uid, owed])
+    remainder = amount - calculated
+    if remainder and rows:
+        rows[0][1] += remainder
+    return rows
+
+
+def _workload(participants, rng):
+    user_ids = list(range(1, participants + 1))
+    amount = Decimal(rng.randint(100_000, 10_000_000)) / 100
+
+    cents = [rng.randint(0, 1000) for _ in user_ids]
+    cents[-1] += to_cents(amount) - sum(cents)
+    values = [(uid, Decimal(c) / 100) for uid, c in zip(user_ids, cents)]
+
+    basis = [1] * participants
+    for _ in range(10_000 - participants):
+        basis[rng.randrange(participants)] += 1
+    percentages = [(uid, Decimal(b) / 100) for uid, b in zip(user_ids, basis)]
+    return amount, user_ids, values, percentages
+
+
+class Command(BaseCommand):
+    help = "Compara o motor de divisão em centavos com o cálculo Decimal antigo."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--participants", type=int, default=1000)
+        parser.add_argument("--expenses", type=int, default=50, help="Despesas por rodada.")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, participants, expenses, repeat, seed, **options):
+        rng = random.Random(seed)
+        workloads = [_workload(participants, rng) for _ in range(expenses)]
+
+        cases = {
+            "EQUAL": (
+                lambda: [_legacy_equal(a, ids) for a, ids, _, _ in workloads],
+                [("EQUAL", to_cents(a), ids) for a, ids, _, _ in workloads],
+            ),
+            "UNEQUAL_VALUE": (
+                lambda: [_legacy_values(a, values) for a, _, values, _ in workloads],
+                [("UNEQUAL_VALUE", to_cents(a), [(uid, to_cents(v)) for uid, v in values]) for a, _, values, _ in workloads],
+            ),
+            "UNEQUAL_PERCENTAGE": (
+                lambda: [_legacy_percentages(a, percs) for a, _, _, percs in workloads],
+                [("UNEQUAL_PERCENTAGE", to_cents(a), percs) for a, _, _, percs in workloads],
+            ),
+        }
+
+        self.stdout.write(f"{participants} participantes, {expenses} despesas por rodada")
+        self.stdout.write(f"{'método':>20} {'decimal desp/s':>15} {'centavos desp/s':>16} {'ganho':>7}")
+        for method, (legacy, batch) in cases.items():
+            _, legacy_ms = time_call(legacy, repeat)
+            results, engine_ms = time_call(lambda: split_batch(batch), repeat)
+            errors = [r for r in results if isinstance(r, Exception)]
+            if errors:
+                self.stderr.write(f"{method}: {len(errors)} divisão(ões) inválida(s): {errors[0]}")
+
+            legacy_rate = expenses / (summarize(legacy_ms)["p50"] / 1000)
+            engine_rate = expenses / (summarize(engine_ms)["p50"] / 1000)
+            self.stdout.write(
+                f"{method:>20} {legacy_rate:>15.0f} {engine_rate:>16.0f} {engine_rate / legacy_rate:>6.1f}x"
+            )
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rachais.balances import BALANCE_ENGINES, calculate_balances
+from rachais.models import Group
+
+
+class Command(BaseCommand):
+    help = "Compara os motores de saldo entre si e aponta grupos com divergência."
+
+    def add_arguments(self, parser):
+        parser.add_argument("group_ids", nargs="*", type=int, help="IDs dos grupos (padrão: todos).")
+        parser.add_argument(
+            "--engines",
+            default=",".join(BALANCE_ENGINES),
+            help="Motores a comparar, separados por vírgula (o primeiro é a referência).",
+        )
+
+    def handle(self, *args, group_ids, engines, **options):
+        names = [name.strip() for name in engines.split(",") if name.strip()]
+        unknown = [name for name in names if name not in BALANCE_ENGINES]
+        if unknown or len(names) < 2:
+            raise CommandError(f"Informe ao menos dois motores entre {sorted(BALANCE_ENGINES)}.")
+
+        groups = Group.objects.order_by("pk")
+        if group_ids:
+            groups = groups.filter(pk__in=group_ids)
+
+        reference, *others = names
+        mismatches = 0
+        for group in groups.iterator():
+            expected = _non_zero(calculate_balances(group, engine=reference))
+            for name in others:
+                got = _non_zero(calculate_balances(group, engine=name))
+                if got != expected:
+                    mismatches += 1
+                    self.stderr.write(f"Grupo {group.pk}: {reference}={expected} {name}={got}")
+
+        if mismatches:
+            raise CommandError(f"{mismatches} divergência(s) encontrada(s).")
+        self.stdout.write(self.style.SUCCESS("Todos os motores concordam."))
+
+
+def _non_zero(balances):
+    return {user_id: amount for user_id, amount in balances.items() if amount}
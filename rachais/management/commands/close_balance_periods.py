@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from rachais.balances import close_balance_period
+from rachais.models import Group
+
+
+class Command(BaseCommand):
+    help = "Fecha o período dos grupos, gravando os saldos num BalanceCheckpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument("group_ids", nargs="*", type=int, help="IDs dos grupos (padrão: todos).")
+        parser.add_argument("--before", help="Data/hora ISO do fechamento (padrão: agora menos --min-age-hours).")
+        parser.add_argument(
+            "--min-age-hours",
+            type=float,
+            default=24,
+            help="Só fecha atividade com pelo menos essa idade, longe de transações em andamento.",
+        )
+
+    def handle(self, *args, group_ids, before, min_age_hours, **options):
+        if before:
+            try:
+                as_of = datetime.fromisoformat(before)
+            except ValueError:
+                raise CommandError(f"Data inválida: {before!r}.")
+            if timezone.is_naive(as_of):
+                as_of = timezone.make_aware(as_of)
+        else:
+            as_of = timezone.now() - timedelta(hours=min_age_hours)
+
+        groups = Group.objects.order_by("pk")
+        if group_ids:
+            groups = groups.filter(pk__in=group_ids)
+
+        closed = skipped = 0
+        for group in groups.iterator():
+            if close_balance_period(group, as_of) is None:
+                skipped += 1
+            else:
+                closed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"{closed} grupo(s) fechado(s) em {as_of:%d/%m/%Y %H:%M}, {skipped} sem atividade nova."
+        ))
@@ -0,0 +1,57 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rachais.balances import implicit_shares, maintaining_ledger
+from rachais.models import Expense, ExpenseSplit
+
+
+class Command(BaseCommand):
+    help = "Converte despesas EQUAL já gravadas para o modo implícito (sem uma ExpenseSplit por participante)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="Só conta o que seria convertido.")
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        converted = skipped = removed = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                Expense.objects.filter(split_method="EQUAL", equal_split_user_ids__isnull=True, pk__gt=last_pk)
+                .order_by("pk").only("pk", "amount")[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            rows = defaultdict(list)
+            for expense_id, user_id, owed in (
+                ExpenseSplit.objects.filter(expense__in=batch).order_by("id").values_list("expense_id", "user_id", "amount_owed")
+            ):
+                rows[expense_id].append((user_id, owed))
+
+            compacted = []
+            for expense in batch:
+                # Quem levou o centavo a mais vem primeiro, como em split_equal.
+                shares = sorted(rows.get(expense.pk, []), key=lambda share: -share[1])
+                user_ids = [user_id for user_id, _ in shares]
+                if not user_ids or implicit_shares(expense.amount, user_ids) != shares:
+                    skipped += 1  # divisão antiga que não bate com a regra atual: mantém as linhas
+                    continue
+                expense.equal_split_user_ids = user_ids
+                compacted.append(expense)
+                removed += len(user_ids)
+
+            converted += len(compacted)
+            if compacted and not dry_run:
+                # Os saldos não mudam: só a forma de guardar as partes.
+                with transaction.atomic(), maintaining_ledger():
+                    Expense.objects.bulk_update(compacted, ["equal_split_user_ids"])
+                    ExpenseSplit.objects.filter(expense__in=compacted).delete()
+
+        verb = "seriam convertidas" if dry_run else "convertidas"
+        self.stdout.write(self.style.SUCCESS(
+            f"{converted} despesa(s) {verb} ({removed} partes), {skipped} mantida(s) com linhas."
+        ))
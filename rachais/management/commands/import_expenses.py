@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rachais.importers import import_expenses, iter_csv_rows, iter_jsonl_rows
+from rachais.models import Group
+
+
+class Command(BaseCommand):
+    help = "Importa despesas de um arquivo CSV ou JSON-lines para um grupo."
+
+    def add_arguments(self, parser):
+        parser.add_argument("group_id", type=int)
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Padrão: detectado pela extensão.")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Linhas por transação.")
+
+    def handle(self, *args, group_id, path, format, chunk_size, **options):
+        try:
+            group = Group.objects.get(pk=group_id)
+        except Group.DoesNotExist:
+            raise CommandError(f"Grupo {group_id} não existe.")
+
+        fmt = format or ("jsonl" if path.lower().endswith((".jsonl", ".json")) else "csv")
+        reader = iter_jsonl_rows if fmt == "jsonl" else iter_csv_rows
+        with open(path, encoding="utf-8-sig", newline="") as stream:
+            result = import_expenses(group, reader(stream), chunk_size=chunk_size)
+
+        for line, error in result.errors:
+            self.stderr.write(f"Linha {line}: {error}")
+        self.stdout.write(self.style.SUCCESS(f"{result.created} despesa(s) importada(s), {len(result.errors)} erro(s)."))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from rachais.middleware import PROFILE_HEADER, profile_token
+
+
+class Command(BaseCommand):
+    help = "Gera um token assinado para perfilar requisições via cabeçalho."
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{PROFILE_HEADER}: {profile_token()}")
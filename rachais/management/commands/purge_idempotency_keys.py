@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rachais.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Apaga em lotes as chaves de idempotência vencidas."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, batch_size, **options):
+        expired = IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+        removed = 0
+        while ids := list(expired.values_list("id", flat=True)[:batch_size]):
+            IdempotencyKey.objects.filter(id__in=ids).delete()
+            removed += len(ids)
+        self.stdout.write(self.style.SUCCESS(f"{removed} chave(s) vencida(s) apagada(s)."))
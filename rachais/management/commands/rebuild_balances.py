@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from rachais.balances import rebuild_group_balances
+from rachais.models import Group
+
+
+class Command(BaseCommand):
+    help = "Reconstrói o livro-razão de saldos (GroupBalance) a partir do histórico dos grupos."
+
+    def add_arguments(self, parser):
+        parser.add_argument("group_ids", nargs="*", type=int, help="IDs dos grupos (padrão: todos).")
+
+    def handle(self, *args, group_ids, **options):
+        groups = Group.objects.order_by("pk")
+        if group_ids:
+            groups = groups.filter(pk__in=group_ids)
+
+        count = 0
+        for group in groups.iterator():
+            rebuild_group_balances(group)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"{count} grupo(s) reconstruído(s)."))
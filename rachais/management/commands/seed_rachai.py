@@ -0,0 +1,125 @@
+import random
+from collections import defaultdict
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from rachais.balances import build_splits
+from rachais.caching import bump_revision
+from rachais.models import Expense, ExpenseSplit, Group, GroupBalance, Participant, Payment
+from rachais.settlements import settle
+from rachais.splits import from_cents, split
+
+User = get_user_model()
+METHODS = [choice for choice, _ in Expense.SPLIT_METHOD_CHOICES]
+
+
+class Command(BaseCommand):
+    help = "Gera usuários, grupos, despesas e pagamentos sintéticos (com bulk inserts) para benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--groups", type=int, default=20)
+        parser.add_argument("--participants", type=int, default=8, help="Participantes por grupo.")
+        parser.add_argument("--expenses", type=int, default=500, help="Despesas por grupo.")
+        parser.add_argument("--payments", type=int, default=20, help="Pagamentos por grupo.")
+        parser.add_argument("--password", default="senhaSuperF0rte")
+        parser.add_argument("--prefix", default="seed")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options["participants"] > options["users"]:
+            raise CommandError("--participants não pode ser maior que --users.")
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+
+        users = self._create_users(options["users"], options["prefix"], options["password"])
+        groups = 0
+        for index in range(options["groups"]):
+            with transaction.atomic():
+                self._create_group(index, users, options)
+            groups += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(users)} usuários e {groups} grupos gerados "
+            f"(login: {users[0].username} / {options['password']})."
+        ))
+
+    def _create_users(self, count, prefix, password):
+        offset = User.objects.filter(username__startswith=f"{prefix}-").count()
+        hashed = make_password(password)  # um único hash: gerar milhares seria o gargalo
+        users = [
+            User(
+                username=f"{prefix}-{offset + i}@rachai.test",
+                email=f"{prefix}-{offset + i}@rachai.test",
+                first_name=f"Pessoa {offset + i}",
+                password=hashed,
+            )
+            for i in range(count)
+        ]
+        return User.objects.bulk_create(users, batch_size=self.batch_size)
+
+    def _create_group(self, index, users, options):
+        members = self.rng.sample(users, options["participants"])
+        group = Group.objects.create(name=f"{options['prefix']} grupo {index}", creator=members[0])
+        Participant.objects.bulk_create(Participant(group=group, user=user) for user in members)
+        member_ids = [user.pk for user in members]
+
+        balances = defaultdict(int)
+        expenses = []
+        plans = []
+        for number in range(options["expenses"]):
+            method = self.rng.choice(METHODS)
+            total = self.rng.randint(500, 100_000)
+            payer_id = self.rng.choice(member_ids)
+            shares = split(method, total, self._spec(method, total, member_ids))
+            expense = Expense(
+                group=group, description=f"Despesa {number}", amount=from_cents(total),
+                paid_by_id=payer_id, split_method=method,
+            )
+            expenses.append(expense)
+            plans.append(build_splits(expense, shares)[1])
+            balances[payer_id] += total
+            for user_id, cents in shares:
+                balances[user_id] -= cents
+
+        # As partes apontam para as despesas, que ganham pk no bulk_create.
+        Expense.objects.bulk_create(expenses, batch_size=self.batch_size)
+        ExpenseSplit.objects.bulk_create(
+            (split_row for splits in plans for split_row in splits),
+            batch_size=self.batch_size,
+        )
+
+        payments = []
+        suggestions = settle({uid: from_cents(cents) for uid, cents in balances.items()}, "greedy")
+        for debtor_id, creditor_id, amount in suggestions[:options["payments"]]:
+            paid = self.rng.randint(1, int(amount * 100))
+            payments.append(Payment(
+                group=group, payer_id=debtor_id, receiver_id=creditor_id,
+                amount=from_cents(paid), created_by_id=debtor_id,
+            ))
+            balances[debtor_id] += paid
+            balances[creditor_id] -= paid
+        Payment.objects.bulk_create(payments, batch_size=self.batch_size)
+
+        GroupBalance.objects.bulk_create(
+            GroupBalance(group=group, user_id=user_id, amount=from_cents(cents))
+            for user_id, cents in balances.items()
+        )
+        bump_revision(group)
+
+    def _spec(self, method, total, member_ids):
+        if method == "EQUAL":
+            return member_ids
+        if method == "UNEQUAL_VALUE":
+            cuts = sorted(self.rng.randint(0, total) for _ in range(len(member_ids) - 1))
+            bounds = [0, *cuts, total]
+            return [(uid, bounds[i + 1] - bounds[i]) for i, uid in enumerate(member_ids)]
+        weights = [self.rng.randint(1, 100) for _ in member_ids]
+        basis = [w * 10_000 // sum(weights) for w in weights]
+        basis[0] += 10_000 - sum(basis)
+        return [(uid, Decimal(b) / 100) for uid, b in zip(member_ids, basis)]
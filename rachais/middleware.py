@@ -0,0 +1,260 @@
+import cProfile
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .db_router import begin_routing, end_routing, read_replicas
+
+try:
+    import pyinstrument
+except ImportError:  # perfilador por amostragem é opcional
+    pyinstrument = None
+
+logger = logging.getLogger("rachais.timing")
+
+_current_timings = ContextVar("rachai_request_timings", default=None)
+
+_IN_LIST = re.compile(r"IN \((?:%s, )*%s\)")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def current_timings():
+    """Coletor da requisição em andamento (ou ``None`` fora do middleware)."""
+    return _current_timings.get()
+
+
+class RequestTimings:
+    def __init__(self):
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.queries = Counter()
+
+    def record_query(self, sql, duration_ms):
+        self.db_ms += duration_ms
+        self.queries[_normalize(sql)] += 1
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+
+def _normalize(sql):
+    """Agrupa consultas que só diferem nos parâmetros (padrão N+1)."""
+    return _LITERAL.sub("?", _IN_LIST.sub("IN (...)", sql))
+
+
+class RequestTimingMiddleware:
+    """Conta e cronometra consultas, template e view de cada requisição.
+
+    Ativado por ``RACHAI_REQUEST_TIMING``. O resultado sai no cabeçalho
+    ``Server-Timing`` e numa linha de log JSON no logger ``rachais.timing``;
+    consultas repetidas ``RACHAI_DUPLICATE_QUERY_THRESHOLD`` vezes ou mais são
+    sinalizadas como prováveis N+1.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "RACHAI_REQUEST_TIMING", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = getattr(settings, "RACHAI_DUPLICATE_QUERY_THRESHOLD", 5)
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_QueryTimer(timings)))
+                response = self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        total_ms = (time.perf_counter() - start) * 1000
+
+        duplicates = {sql: count for sql, count in timings.queries.items() if count >= self.threshold}
+        app_ms = max(total_ms - timings.db_ms - timings.template_ms, 0.0)
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={timings.db_ms:.1f};desc="{timings.query_count} queries"',
+            f"tpl;dur={timings.template_ms:.1f}",
+            f"app;dur={app_ms:.1f}",
+            f"total;dur={total_ms:.1f}",
+        ])
+
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": round(total_ms, 1),
+            "db_ms": round(timings.db_ms, 1),
+            "template_ms": round(timings.template_ms, 1),
+            "queries": timings.query_count,
+            "duplicate_queries": max(duplicates.values(), default=0),
+        }
+        logger.info(json.dumps(record))
+        for sql, count in duplicates.items():
+            logger.warning("Consulta repetida %d vezes em %s (possível N+1): %s", count, request.path, sql)
+        return response
+
+
+class _QueryTimer:
+    def __init__(self, timings):
+        self.timings = timings
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.timings.record_query(sql, (time.perf_counter() - start) * 1000)
+
+
+PRIMARY_PIN_SESSION_KEY = "rachai_primary_until"
+_SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class PrimaryPinningMiddleware:
+    """Decide, por requisição, se as leituras podem ir para as réplicas.
+
+    Ativado quando há ``RACHAI_READ_REPLICAS``; deve vir depois do
+    ``SessionMiddleware``. Requisições que alteram dados leem do primário, e
+    uma escrita fixa a sessão no primário por ``RACHAI_PRIMARY_PIN_SECONDS``,
+    cobrindo o redirecionamento que mostra o resultado.
+    """
+
+    def __init__(self, get_response):
+        if not read_replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, "RACHAI_PRIMARY_PIN_SECONDS", 10)
+
+    def __call__(self, request):
+        pinned = request.method not in _SAFE_METHODS or request.session.get(PRIMARY_PIN_SESSION_KEY, 0) > time.time()
+        state, token = begin_routing(pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            end_routing(token)
+        if state.wrote:
+            request.session[PRIMARY_PIN_SESSION_KEY] = time.time() + self.pin_seconds
+        return response
+
+
+PROFILE_HEADER = "X-Rachai-Profile"
+_PROFILE_SALT = "rachais.profile"
+PROFILE_NAME = re.compile(r"^[0-9]{8}T[0-9]{6}-[0-9a-f]{12}\.(?:prof|collapsed)$")
+
+
+def profile_token():
+    """Token assinado para pedir o perfil de uma requisição via cabeçalho."""
+    return signing.TimestampSigner(salt=_PROFILE_SALT).sign("profile")
+
+
+def profile_dir():
+    return Path(getattr(settings, "RACHAI_PROFILE_DIR", Path(settings.BASE_DIR) / "profiles"))
+
+
+class ProfilingMiddleware:
+    """Perfila requisições pedidas por staff (``?_profile=1``) ou com token assinado.
+
+    Ativado por ``RACHAI_PROFILING``. Usa o ``pyinstrument`` (amostragem, pilhas
+    colapsadas) quando instalado e ``RACHAI_PROFILER`` pede, senão ``cProfile``
+    (``.prof``). No máximo ``RACHAI_PROFILE_MAX_CONCURRENT`` requisições são
+    perfiladas ao mesmo tempo; as demais seguem sem perfil, sem esperar. Com
+    ``cProfile`` o limite é sempre 1: a partir do Python 3.12 só um perfilador
+    pode estar ativo por processo e um segundo ``cProfile`` falha.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "RACHAI_PROFILING", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.token_max_age = getattr(settings, "RACHAI_PROFILE_TOKEN_MAX_AGE", 60 * 60)
+        self.keep = getattr(settings, "RACHAI_PROFILE_KEEP", 50)
+        self.sampling = getattr(settings, "RACHAI_PROFILER", "cprofile") == "pyinstrument" and pyinstrument
+        max_concurrent = getattr(settings, "RACHAI_PROFILE_MAX_CONCURRENT", 1) if self.sampling else 1
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+
+    def __call__(self, request):
+        if not self._wants_profile(request):
+            return self.get_response(request)
+        if not self.slots.acquire(blocking=False):
+            response = self.get_response(request)
+            response[PROFILE_HEADER] = "busy"
+            return response
+        try:
+            name = f"{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:12]}"
+            if self.sampling:
+                response, name = self._sample(request, name)
+            else:
+                response, name = self._cprofile(request, name)
+            self._prune()
+        finally:
+            self.slots.release()
+        response[PROFILE_HEADER] = name
+        return response
+
+    def _wants_profile(self, request):
+        token = request.headers.get(PROFILE_HEADER)
+        if token:
+            try:
+                signing.TimestampSigner(salt=_PROFILE_SALT).unsign(token, max_age=self.token_max_age)
+                return True
+            except signing.BadSignature:
+                return False
+        user = getattr(request, "user", None)
+        return "_profile" in request.GET and user is not None and user.is_staff
+
+    def _cprofile(self, request, name):
+        profiler = cProfile.Profile()
+        response = profiler.runcall(self.get_response, request)
+        name += ".prof"
+        profile_dir().mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(profile_dir() / name)
+        return response, name
+
+    def _sample(self, request, name):
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+        name += ".collapsed"
+        profile_dir().mkdir(parents=True, exist_ok=True)
+        root = profiler.last_session.root_frame()
+        with open(profile_dir() / name, "w") as out:
+            for line in _collapsed_stacks(root):
+                out.write(line + "\n")
+        return response, name
+
+    def _prune(self):
+        if not self.keep:
+            return
+        files = sorted(path for path in profile_dir().iterdir() if PROFILE_NAME.match(path.name))
+        for path in files[:-self.keep]:
+            path.unlink(missing_ok=True)
+
+
+def _collapsed_stacks(frame, prefix=""):
+    """Formato "pilha;colapsada microssegundos" lido por flamegraph.pl e speedscope."""
+    if frame is None:
+        return
+    stack = f"{prefix};{frame.function}" if prefix else frame.function
+    own = frame.time - sum(child.time for child in frame.children)
+    if own > 0:
+        yield f"{stack} {round(own * 1_000_000)}"
+    for child in frame.children:
+        yield from _collapsed_stacks(child, stack)
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:36
+
+from collections import defaultdict
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_group_balances(apps, schema_editor):
+    Expense = apps.get_model("rachais", "Expense")
+    ExpenseSplit = apps.get_model("rachais", "ExpenseSplit")
+    Payment = apps.get_model("rachais", "Payment")
+    GroupBalance = apps.get_model("rachais", "GroupBalance")
+
+    balances = defaultdict(Decimal)
+    for group_id, user_id, amount in Expense.objects.values_list("group_id", "paid_by_id", "amount").iterator():
+        balances[(group_id, user_id)] += amount
+    for group_id, user_id, amount in ExpenseSplit.objects.values_list("expense__group_id", "user_id", "amount_owed").iterator():
+        balances[(group_id, user_id)] -= amount
+    for group_id, payer_id, receiver_id, amount in Payment.objects.values_list("group_id", "payer_id", "receiver_id", "amount").iterator():
+        balances[(group_id, payer_id)] += amount
+        balances[(group_id, receiver_id)] -= amount
+
+    GroupBalance.objects.bulk_create(
+        (
+            GroupBalance(group_id=group_id, user_id=user_id, amount=amount)
+            for (group_id, user_id), amount in balances.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rachais', '0005_payment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='rachais.group')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_balances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('group', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_group_balances, migrations.RunPython.noop),
+    ]
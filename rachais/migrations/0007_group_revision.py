@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rachais', '0006_groupbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='revision',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
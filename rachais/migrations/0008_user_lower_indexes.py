@@ -0,0 +1,25 @@
+from django.db import migrations
+
+# Índices funcionais para as buscas de login/convite sem diferenciar maiúsculas.
+# As consultas comparam LOWER(coluna) = valor já minúsculo (ver backends.py),
+# que é exatamente a expressão indexada.
+INDEXES = [
+    ("rachais_user_username_lower", "username"),
+    ("rachais_user_email_lower", "email"),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('rachais', '0007_group_revision'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=f'CREATE INDEX IF NOT EXISTS {name} ON auth_user (LOWER({column}))',
+            reverse_sql=f'DROP INDEX IF EXISTS {name}',
+        )
+        for name, column in INDEXES
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rachais', '0009_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='equal_split_user_ids',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -8,6 +8,10 @@ class Group(models.Model):
     creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_groups')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    revision = models.PositiveIntegerField(default=0, editable=False)
+    # Resumo do histórico arquivado, para a página do grupo não consultar o arquivo.
+    archived_expense_count = models.PositiveIntegerField(default=0, editable=False)
+    archived_expense_total = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False)
 
     class Meta:
         constraints = [
@@ -55,6 +59,10 @@ class Expense(models.Model):
         through='ExpenseSplit',
         related_name='expenses_participated'
     )
+    # Modo implícito (RACHAI_EQUAL_SPLIT_STORAGE="implicit"): despesas EQUAL
+    # guardam só os ids dos participantes, na ordem da divisão, em vez de uma
+    # ExpenseSplit por pessoa. As partes são derivadas com splits.split_equal.
+    equal_split_user_ids = models.JSONField(null=True, blank=True, editable=False)
     def __str__(self):
         return f"{self.description} (R$ {self.amount}) em {self.group.name}"
 
@@ -62,6 +70,10 @@ class Expense(models.Model):
         verbose_name = "Despesa"
         verbose_name_plural = "Despesas"
         ordering = ['-created_at']
+        indexes = [
+            # Listagem do grupo por keyset: WHERE group_id = ? ORDER BY created_at DESC, id DESC.
+            models.Index(fields=["group", "-created_at", "-id"], name="expense_group_created_idx"),
+        ]
 class ExpenseSplit(models.Model):
     expense=models.ForeignKey(Expense,on_delete=models.CASCADE,related_name='splits')
     user=models.ForeignKey(User,on_delete=models.CASCADE,related_name='splits')
@@ -69,6 +81,10 @@ class ExpenseSplit(models.Model):
 
     class Meta:
         unique_together=('expense','user')
+        indexes = [
+            # Extrato e dívidas do usuário: WHERE user_id = ? junto com expense_id.
+            models.Index(fields=["user", "expense"], name="split_user_expense_idx"),
+        ]
     def __str__(self):
         return f"{self.user.username} deve R$ {self.amount_owed} para {self.expense.description}"
 
@@ -84,7 +100,113 @@ class Payment(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["group", "payer"], name="payment_group_payer_idx"),
+            models.Index(fields=["group", "receiver"], name="payment_group_receiver_idx"),
+        ]
     
     def __str__(self):
         return f"{self.payer} pagou R$ {self.amount} para {self.receiver} em {self.group}"
-    
\ No newline at end of file
+    
+
+class GroupBalance(models.Model):
+    """Saldo líquido materializado de um usuário dentro de um grupo."""
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name="balances")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="group_balances")
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ("group", "user")
+
+    def __str__(self):
+        return f"{self.user} tem saldo R$ {self.amount} em {self.group}"
+
+
+class BalanceCheckpoint(models.Model):
+    """Saldo de um usuário no fechamento de um período do grupo.
+
+    Cobre as despesas com id até ``last_expense_id`` e os pagamentos com id até
+    ``last_payment_id``; os motores que percorrem o histórico partem do
+    fechamento mais recente e somam apenas o que veio depois dele.
+    """
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name="checkpoints")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="balance_checkpoints")
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    as_of = models.DateTimeField()
+    last_expense_id = models.BigIntegerField(default=0)
+    last_payment_id = models.BigIntegerField(default=0)
+    # Histórico até aqui foi movido para o arquivo: a reconstrução parte deste fechamento.
+    archived = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ("group", "user", "as_of")
+        indexes = [
+            models.Index(fields=["group", "-as_of"], name="checkpoint_group_as_of_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user} tinha saldo R$ {self.amount} em {self.group} ({self.as_of:%d/%m/%Y})"
+
+
+class ArchivedExpense(models.Model):
+    """Despesa movida para o arquivo após o fechamento de um período quitado.
+
+    As partes ficam em ``shares`` (``[[user_id, "valor"], ...]``), sem linhas
+    de ExpenseSplit.
+    """
+    original_id = models.BigIntegerField(unique=True)
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name="archived_expenses")
+    description = models.CharField(max_length=255)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    paid_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_paid_expenses")
+    split_method = models.CharField(max_length=20, choices=Expense.SPLIT_METHOD_CHOICES)
+    shares = models.JSONField(default=list)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["group", "-original_id"], name="archived_expense_group_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.description} (arquivada, {self.group})"
+
+
+class ArchivedPayment(models.Model):
+    """Pagamento movido para o arquivo junto com as despesas do período."""
+    original_id = models.BigIntegerField(unique=True)
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name="archived_payments")
+    payer = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_payments_made")
+    receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_payments_received")
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField()
+    paid_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["group", "-original_id"], name="archived_payment_group_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.payer} pagou R$ {self.amount} para {self.receiver} (arquivado)"
+
+
+class IdempotencyKey(models.Model):
+    """Resultado de um POST enviado com ``Idempotency-Key``, guardado até ``expires_at``.
+
+    Um reenvio com a mesma chave recebe o mesmo redirecionamento, sem gravar
+    nada de novo. ``status_code`` nulo indica requisição ainda em andamento.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="idempotency_keys")
+    key = models.CharField(max_length=64)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    location = models.CharField(max_length=255, blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ("user", "key")
+
+    def __str__(self):
+        return f"{self.key} ({self.user})"
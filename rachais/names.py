@@ -0,0 +1,85 @@
+"""Nomes de exibição dos usuários.
+
+O nome é derivado uma vez por usuário e guardado no cache do app por id;
+``display_names`` resolve um conjunto de ids de uma vez (uma ida ao cache e,
+para os ausentes, uma consulta). O sinal de ``post_save`` do usuário descarta
+o nome guardado.
+"""
+from typing import Optional
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AbstractUser
+from django.db import DEFAULT_DB_ALIAS
+
+from .caching import ledger_cache, ledger_cache_timeout
+
+User = get_user_model()
+
+
+def display_name(user: Optional[AbstractUser]) -> str:
+    if not user:
+        return "Usuário"
+
+    full = (user.get_full_name() or "").strip()
+    if full:
+        return full
+
+    first = (getattr(user, "first_name", "") or "").strip()
+    if first:
+        return first
+
+    for attr in ("name", "full_name", "display_name"):
+        val = (getattr(user, attr, "") or "").strip()
+        if val:
+            return val
+
+    prof = getattr(user, "profile", None)
+    if prof:
+        for attr in ("display_name", "name", "full_name", "first_name"):
+            val = (getattr(prof, attr, "") or "").strip()
+            if val:
+                return val
+
+    uname = (getattr(user, "username", "") or "").strip()
+    if "@" in uname:
+        uname = uname.split("@", 1)[0]
+    return uname or "Usuário"
+
+
+def name_key(user_id):
+    return f"rachai:name:{user_id}"
+
+
+def display_names(user_ids, loaded=()):
+    """``{user_id: nome}`` para todos os ids; desconhecidos viram "Usuário".
+
+    ``loaded``: usuários já carregados pela view; os ausentes do cache são
+    calculados a partir deles antes de se recorrer ao banco.
+    """
+    ids = {user_id for user_id in user_ids if user_id is not None}
+    if not ids:
+        return {}
+    cache = ledger_cache()
+    keys = {user_id: name_key(user_id) for user_id in ids}
+    cached = cache.get_many(keys.values())
+    names = {user_id: cached[key] for user_id, key in keys.items() if key in cached}
+
+    missing = ids - names.keys()
+    if missing:
+        # Só nomes lidos do primário vão para o cache: vindos de uma réplica
+        # atrasada, ficariam desatualizados até expirar.
+        users = {user.pk: user for user in loaded if user.pk in missing}
+        if missing - users.keys():
+            users.update(
+                User.objects.using(DEFAULT_DB_ALIAS).only("first_name", "last_name", "username")
+                .in_bulk(missing - users.keys())
+            )
+        fresh = {user_id: display_name(users.get(user_id)) for user_id in missing}
+        cache.set_many({keys[user_id]: fresh[user_id] for user_id, user in users.items()
+                        if user._state.db == DEFAULT_DB_ALIAS}, ledger_cache_timeout())
+        names.update(fresh)
+    return names
+
+
+def forget_display_name(user_id):
+    ledger_cache().delete(name_key(user_id))
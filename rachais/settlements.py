@@ -0,0 +1,185 @@
+"""Sugestão de transferências para quitar os saldos de um grupo.
+
+Os saldos chegam como ``{user_id: Decimal}`` e as transferências saem como
+``(devedor_id, credor_id, Decimal)``. Internamente tudo é feito em centavos
+inteiros; saldos de até um centavo são ignorados, como sempre foram.
+"""
+import heapq
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+CENT = Decimal("0.01")
+
+# Acima disso a busca exata (2^n estados) deixa de ser viável.
+EXACT_LIMIT = 16
+# O híbrido só faz a busca exata até aqui (alguns milissegundos). O corte é
+# pelo tamanho, não pelo tempo: os mesmos saldos geram sempre as mesmas
+# transferências, com qualquer carga e em qualquer processo.
+HYBRID_EXACT_LIMIT = 13
+
+
+def _to_cents(balances):
+    cents = {}
+    for user_id, balance in balances.items():
+        value = int((Decimal(balance) / CENT).to_integral_value())
+        if abs(value) > 1:
+            cents[user_id] = value
+    return cents
+
+
+def _from_cents(value):
+    return (Decimal(value) * CENT).quantize(CENT)
+
+
+def _sequential(cents):
+    """Algoritmo original: credores e devedores na ordem em que aparecem."""
+    creditors = [[uid, value] for uid, value in cents.items() if value > 0]
+    debtors = [[uid, -value] for uid, value in cents.items() if value < 0]
+
+    rows = []
+    i = j = 0
+    while i < len(creditors) and j < len(debtors):
+        transfer = min(creditors[i][1], debtors[j][1])
+        rows.append((debtors[j][0], creditors[i][0], transfer))
+        creditors[i][1] -= transfer
+        debtors[j][1] -= transfer
+        if not creditors[i][1]:
+            i += 1
+        if not debtors[j][1]:
+            j += 1
+    return rows
+
+
+def _greedy(cents):
+    """Maior credor paga pelo maior devedor, via heaps: O(n log n)."""
+    creditors = [(-value, uid) for uid, value in cents.items() if value > 0]
+    debtors = [(value, uid) for uid, value in cents.items() if value < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    rows = []
+    while creditors and debtors:
+        credit, creditor_id = heapq.heappop(creditors)
+        debt, debtor_id = heapq.heappop(debtors)
+        transfer = min(-credit, -debt)
+        rows.append((debtor_id, creditor_id, transfer))
+        if -credit > transfer:
+            heapq.heappush(creditors, (credit + transfer, creditor_id))
+        if -debt > transfer:
+            heapq.heappush(debtors, (debt + transfer, debtor_id))
+    return rows
+
+
+def _exact_pairs(cents):
+    """Quita de uma vez devedor e credor com o mesmo valor (sempre ótimo)."""
+    creditors_by_value = {}
+    for uid, value in sorted(cents.items(), key=lambda item: str(item[0])):
+        if value > 0:
+            creditors_by_value.setdefault(value, []).append(uid)
+
+    rows = []
+    rest = dict(cents)
+    for uid, value in sorted(cents.items(), key=lambda item: str(item[0])):
+        if value < 0 and creditors_by_value.get(-value):
+            creditor_id = creditors_by_value[-value].pop()
+            rows.append((uid, creditor_id, -value))
+            del rest[uid], rest[creditor_id]
+    return rows, rest
+
+
+def _zero_sum_partition(cents):
+    """Particiona os saldos no maior número de subconjuntos de soma zero.
+
+    Cada subconjunto de ``k`` pessoas quita com ``k - 1`` transferências, então
+    maximizar os subconjuntos minimiza o total.
+    """
+    ids = list(cents)
+    values = [cents[uid] for uid in ids]
+    n = len(ids)
+    full = (1 << n) - 1
+
+    sums = [0] * (full + 1)
+    best = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low = (mask & -mask).bit_length() - 1
+        sums[mask] = sums[mask & (mask - 1)] + values[low]
+        m = mask
+        top = 0
+        while m:
+            bit = m & -m
+            candidate = best[mask ^ bit]
+            if candidate > top:
+                top = candidate
+            m ^= bit
+        best[mask] = top + (1 if sums[mask] == 0 else 0)
+
+    order = []
+    mask = full
+    while mask:
+        target = best[mask] - (1 if sums[mask] == 0 else 0)
+        m = mask
+        while m:
+            bit = m & -m
+            if best[mask ^ bit] == target:
+                break
+            m ^= bit
+        order.append(bit.bit_length() - 1)
+        mask ^= bit
+    order.reverse()
+
+    groups, current, running = [], {}, 0
+    for index in order:
+        current[ids[index]] = values[index]
+        running += values[index]
+        if running == 0:
+            groups.append(current)
+            current = {}
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _exact(cents):
+    """Número mínimo de transferências (busca exata, só para grupos pequenos).
+
+    Acima de ``EXACT_LIMIT`` saldos não nulos a busca seria exponencial; usa
+    o guloso, como o híbrido.
+    """
+    if len(cents) > EXACT_LIMIT:
+        return _greedy(cents)
+    rows = []
+    for group in _zero_sum_partition(cents):
+        rows.extend(_greedy(group))
+    return rows
+
+
+def _hybrid(cents):
+    """Pares exatos, depois busca exata se sobrarem até ``HYBRID_EXACT_LIMIT`` saldos; senão heaps."""
+    rows, rest = _exact_pairs(cents)
+    rows.extend(_exact(rest) if len(rest) <= HYBRID_EXACT_LIMIT else _greedy(rest))
+    return rows
+
+
+STRATEGIES = {
+    "sequential": _sequential,
+    "greedy": _greedy,
+    "exact": _exact,
+    "hybrid": _hybrid,
+}
+
+
+def default_strategy():
+    return getattr(settings, "RACHAI_SETTLEMENT_STRATEGY", "hybrid")
+
+
+def settle(balances, strategy=None):
+    """Transferências ``(devedor_id, credor_id, valor)`` que zeram os saldos."""
+    strategy = strategy or default_strategy()
+    if strategy not in STRATEGIES:
+        raise ImproperlyConfigured(
+            f"Estratégia de liquidação desconhecida: {strategy!r}. Use uma de {sorted(STRATEGIES)}."
+        )
+    rows = STRATEGIES[strategy](_to_cents(balances))
+    return [(debtor_id, creditor_id, _from_cents(amount)) for debtor_id, creditor_id, amount in rows]
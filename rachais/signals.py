@@ -0,0 +1,96 @@
+import threading
+import weakref
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .balances import ledger_maintained, rebuild_group_balances
+from .caching import forget_sidebar, forget_user
+from .names import forget_display_name
+from .models import Expense, ExpenseSplit, Group, Participant, Payment
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+    forget_display_name(instance.pk)
+
+
+@receiver(post_save, sender=Participant)
+@receiver(post_delete, sender=Participant)
+def forget_participant_sidebar(sender, instance, **kwargs):
+    forget_sidebar(instance.user_id)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def forget_group_sidebars(sender, instance, created=False, **kwargs):
+    user_ids = {instance.creator_id}
+    if kwargs["signal"] is post_save and not created:
+        # Renomear muda o sidebar de todos os membros.
+        user_ids.update(instance.participants.values_list("user_id", flat=True))
+    forget_sidebar(*user_ids)
+
+
+class _StaleLedgers:
+    """Grupos com histórico alterado fora das views, reconstruídos após o commit.
+
+    A reconstrução também avança a revisão do grupo, o que invalida os saldos e
+    liquidações cacheados por qualquer motor (``ledger``, ``sql`` ou ``python``).
+    """
+
+    def __init__(self):
+        self.group_ids = set()
+        self.expense_ids = set()
+        self.ran = False
+
+    def __call__(self):
+        self.ran = True
+        group_ids = self.group_ids | set(
+            Expense.objects.filter(pk__in=self.expense_ids).values_list("group_id", flat=True)
+        )
+        for group in Group.objects.filter(pk__in=group_ids):
+            rebuild_group_balances(group)
+
+
+_stale = threading.local()
+
+
+def _mark_stale(group_id=None, expense_id=None):
+    # Uma reconstrução por grupo e transação, mesmo numa cascata com milhares
+    # de linhas. A referência fraca some se a transação for desfeita, porque o
+    # Django descarta o callback junto.
+    ref = getattr(_stale, "pending", None)
+    pending = ref() if ref is not None else None
+    registered = pending is not None and not pending.ran
+    if not registered:
+        pending = _StaleLedgers()
+    if group_id is not None:
+        pending.group_ids.add(group_id)
+    if expense_id is not None:
+        pending.expense_ids.add(expense_id)
+    if not registered:
+        _stale.pending = weakref.ref(pending)
+        transaction.on_commit(pending)
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def rebuild_edited_ledger(sender, instance, **kwargs):
+    if not ledger_maintained():
+        _mark_stale(group_id=instance.group_id)
+
+
+@receiver(post_save, sender=ExpenseSplit)
+@receiver(post_delete, sender=ExpenseSplit)
+def rebuild_edited_split_ledger(sender, instance, **kwargs):
+    if not ledger_maintained():
+        # O grupo sai da despesa no callback, numa consulta só para todas as partes.
+        _mark_stale(expense_id=instance.expense_id)
@@ -0,0 +1,106 @@
+"""Divisão de despesas em centavos inteiros.
+
+Os três métodos (igual, por valor e por porcentagem) produzem
+``[(user_id, centavos)]`` cuja soma é sempre exatamente o total. Sobras de
+arredondamento vão para quem teve a maior parte fracionária descartada
+(método do maior resto), empatando pela ordem de entrada.
+"""
+import heapq
+from decimal import ROUND_HALF_UP, Decimal
+
+CENT = Decimal("0.01")
+
+
+class SplitError(ValueError):
+    """Divisão inválida; a mensagem é mostrada ao usuário."""
+
+
+def to_cents(value):
+    return int((Decimal(value) / CENT).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    return (Decimal(cents) * CENT).quantize(CENT)
+
+
+def allocate(total_cents, weights):
+    """Reparte ``total_cents`` proporcionalmente a ``weights`` (inteiros >= 0).
+
+    Uma passada calcula quocientes e restos; os centavos que sobram vão para
+    os maiores restos (empate: ordem de entrada).
+    """
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        raise SplitError("Não há participantes no grupo para dividir.")
+
+    shares, remainders = zip(*(divmod(total_cents * weight, weight_sum) for weight in weights))
+    shares = list(shares)
+    leftover = total_cents - sum(shares)
+    if leftover:
+        for index in heapq.nlargest(leftover, range(len(shares)), key=remainders.__getitem__):
+            shares[index] += 1
+    return shares
+
+
+def split_equal(total_cents, user_ids):
+    """Pesos iguais: os primeiros ``resto`` participantes levam um centavo a mais."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        raise SplitError("Não há participantes no grupo para dividir.")
+    base, extra = divmod(total_cents, len(user_ids))
+    return [(user_id, base + 1 if index < extra else base) for index, user_id in enumerate(user_ids)]
+
+
+def split_values(total_cents, values):
+    """``values``: ``[(user_id, centavos)]`` que precisam somar o total."""
+    values = list(values)
+    total = sum(cents for _, cents in values)
+    if total != total_cents:
+        raise SplitError(
+            f"A soma das partes (R$ {from_cents(total):.2f}) não corresponde "
+            f"ao valor total da despesa (R$ {from_cents(total_cents):.2f})"
+        )
+    return [(user_id, cents) for user_id, cents in values if cents > 0]
+
+
+def split_percentages(total_cents, percentages):
+    """``percentages``: ``[(user_id, Decimal)]`` que precisam somar 100%."""
+    percentages = list(percentages)
+    total = sum((percentage for _, percentage in percentages), Decimal("0"))
+    if total.quantize(CENT) != Decimal("100.00"):
+        raise SplitError(f"A soma das porcentagens ({total:.2f}%) não é exatamente 100%")
+
+    # Escala as porcentagens para inteiros sem perder casas decimais: a soma
+    # tem o expoente da parcela com mais casas.
+    exponent = min(total.as_tuple().exponent, 0)
+    weights = [int(percentage.scaleb(-exponent)) for _, percentage in percentages]
+    shares = allocate(total_cents, weights)
+    return [(user_id, cents) for (user_id, _), cents in zip(percentages, shares) if cents > 0]
+
+
+SPLITTERS = {
+    "EQUAL": split_equal,
+    "UNEQUAL_VALUE": split_values,
+    "UNEQUAL_PERCENTAGE": split_percentages,
+}
+
+
+def split(method, total_cents, spec):
+    """Divide uma despesa; ``spec`` depende do método (ids, valores ou porcentagens)."""
+    if method not in SPLITTERS:
+        raise SplitError("Método de divisão inválido.")
+    return SPLITTERS[method](total_cents, spec)
+
+
+def split_batch(items):
+    """Divide várias despesas de uma vez: ``[(método, centavos, spec)]``.
+
+    Devolve, na mesma ordem, a lista de partes ou a ``SplitError`` da despesa.
+    """
+    results = []
+    for method, total_cents, spec in items:
+        try:
+            results.append(split(method, total_cents, spec))
+        except SplitError as exc:
+            results.append(exc)
+    return results
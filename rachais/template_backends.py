@@ -0,0 +1,36 @@
+import time
+
+from django.template.backends.django import DjangoTemplates
+
+from .middleware import current_timings
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Backend do Django que soma o tempo de renderização à requisição atual.
+
+    Usado junto com ``RequestTimingMiddleware``; fora dele não mede nada.
+    """
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+class _TimedTemplate:
+    def __init__(self, template):
+        self._wrapped = template
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def render(self, context=None, request=None):
+        timings = current_timings()
+        if timings is None:
+            return self._wrapped.render(context, request)
+        start = time.perf_counter()
+        try:
+            return self._wrapped.render(context, request)
+        finally:
+            timings.template_ms += (time.perf_counter() - start) * 1000
@@ -0,0 +1,14 @@
+import uuid
+
+from django import template
+from django.utils.html import format_html
+
+from rachais.idempotency import FIELD_NAME
+
+register = template.Library()
+
+
+@register.simple_tag
+def idempotency_field():
+    """Campo oculto com uma chave nova a cada renderização do formulário."""
+    return format_html('<input type="hidden" name="{}" value="{}">', FIELD_NAME, uuid.uuid4().hex)
@@ -1,17 +1,42 @@
+import json
+import threading
 import time
 import os, tempfile, shutil
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.urls import reverse
+from django.utils import timezone
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait, Select
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.alert import Alert
+from rachais.balances import BALANCE_ENGINES, apply_expense, calculate_balances, maintaining_ledger, rebuild_group_balances
+from rachais.caching import forget_sidebar, ledger_cache
+from rachais.settlements import HYBRID_EXACT_LIMIT, STRATEGIES, settle
+from rachais.splits import SplitError, allocate, split, split_batch
+from rachais.models import ArchivedExpense, BalanceCheckpoint, Expense, ExpenseSplit, Group, GroupBalance, IdempotencyKey, Participant, Payment
+from rachais.importers import import_expenses
+from rachais.backends import EmailOrUsernameModelBackend
+from rachais.db_router import PrimaryReplicaRouter, begin_routing, end_routing, primary_reads
+from rachais.middleware import PRIMARY_PIN_SESSION_KEY, PrimaryPinningMiddleware
+from rachais.names import display_names
+from rachais.views import SidebarGroup, _calculate_settlements, _group_ledger, _my_debts_snapshot, _sidebar_groups
 
 User = get_user_model()
 
 
+@tag("e2e")
 class E2EFullFlowTests(StaticLiveServerTestCase):
     """
     Testa o fluxo completo da aplicação RachAi de forma automatizada
@@ -512,4 +537,1317 @@ class E2EFullFlowTests(StaticLiveServerTestCase):
         self.assertIn('Rafael', paid_html)
         print("-> Pagamento de R$ 50,00 para Rafael aparece na aba de quitadas.")
 
-        print("\n--> Teste de MARCAR DÍVIDA COMO PAGA concluído com sucesso!")
\ No newline at end of file
+        print("\n--> Teste de MARCAR DÍVIDA COMO PAGA concluído com sucesso!")
+
+
+class BalanceLedgerTests(TestCase):
+    """Garante que o livro-razão (GroupBalance) acompanha o histórico do grupo."""
+
+    def setUp(self):
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", password="senhaSuperF0rte")
+        self.bia = User.objects.create_user(username="bia", first_name="Bia", password="senhaSuperF0rte")
+        self.caio = User.objects.create_user(username="caio", first_name="Caio", password="senhaSuperF0rte")
+        self.group = Group.objects.create(name="Viagem", creator=self.ana)
+        for user in (self.ana, self.bia, self.caio):
+            Participant.objects.create(group=self.group, user=user)
+        self.client.force_login(self.ana)
+        ledger_cache().clear()
+
+    def _ledger(self):
+        return dict(GroupBalance.objects.filter(group=self.group).values_list("user_id", "amount"))
+
+    def _assert_ledger_matches_history(self):
+        ledger = self._ledger()
+        for engine in BALANCE_ENGINES:
+            with self.subTest(engine=engine):
+                computed = calculate_balances(self.group, engine=engine)
+                for user_id in set(computed) | set(ledger):
+                    self.assertEqual(ledger.get(user_id, Decimal("0")), computed.get(user_id, Decimal("0")))
+
+    def test_ledger_follows_expenses_and_payments(self):
+        url = reverse("rachais:add_expense", args=[self.group.id])
+        self.client.post(url, {"description": "Jantar", "amount": "100,00", "paid_by": self.ana.id, "split_method": "EQUAL"})
+        self.client.post(url, {
+            "description": "Mercado", "amount": "90,00", "paid_by": self.bia.id, "split_method": "UNEQUAL_VALUE",
+            f"split_user_{self.ana.id}": "10,00", f"split_user_{self.bia.id}": "30,00", f"split_user_{self.caio.id}": "50,00",
+        })
+        self.client.post(url, {
+            "description": "Hotel", "amount": "200,00", "paid_by": self.caio.id, "split_method": "UNEQUAL_PERCENTAGE",
+            f"split_perc_{self.ana.id}": "33,33", f"split_perc_{self.bia.id}": "33,33", f"split_perc_{self.caio.id}": "33,34",
+        })
+        self._assert_ledger_matches_history()
+        self.assertEqual(sum(self._ledger().values()), Decimal("0"))
+
+        ledger = self._ledger()
+        participants = list(self.group.participants.select_related("user"))
+        settlement = next(
+            s for s in _calculate_settlements(ledger, participants) if s.person_from.id == self.bia.id
+        )
+        self.client.force_login(self.bia)
+        self.client.post(reverse("rachais:pay_debt"), {
+            "group_id": self.group.id, "receiver_id": settlement.person_to.id, "amount": str(settlement.amount),
+        })
+        self.assertGreater(self._ledger()[self.bia.id], ledger[self.bia.id])
+        self._assert_ledger_matches_history()
+        call_command("check_balances", stdout=StringIO())
+
+    def test_edits_outside_the_views_rebuild_the_ledger(self):
+        url = reverse("rachais:add_expense", args=[self.group.id])
+        self.client.post(url, {"description": "Jantar", "amount": "90,00", "paid_by": self.bia.id, "split_method": "EQUAL"})
+        self.client.post(url, {"description": "Cinema", "amount": "30,00", "paid_by": self.caio.id, "split_method": "EQUAL"})
+        jantar = Expense.objects.get(description="Jantar")
+
+        # Como pelo admin: editar e apagar sem passar pelas views.
+        for change in (
+            lambda: Expense.objects.filter(pk=jantar.pk).first().save(),
+            lambda: jantar.splits.first().delete(),
+            lambda: jantar.delete(),
+            lambda: self.caio.delete(),
+        ):
+            revision = Group.objects.get(pk=self.group.pk).revision
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    change()
+            # Uma reconstrução por transação, por mais linhas que a cascata apague.
+            self.assertEqual(Group.objects.get(pk=self.group.pk).revision, revision + 1)
+            self._assert_ledger_matches_history()
+        self.assertNotIn(self.caio.id, self._ledger())
+
+    def test_non_finite_values_are_rejected(self):
+        url = reverse("rachais:add_expense", args=[self.group.id])
+        for data in (
+            {"amount": "Infinity", "split_method": "EQUAL"},
+            {"amount": "NaN", "split_method": "EQUAL"},
+            {"amount": "10,00", "split_method": "UNEQUAL_VALUE", f"split_user_{self.ana.id}": "Infinity"},
+            {"amount": "10,00", "split_method": "UNEQUAL_PERCENTAGE", f"split_perc_{self.ana.id}": "-Infinity"},
+            {"amount": "10,00", "split_method": "UNEQUAL_PERCENTAGE", f"split_perc_{self.ana.id}": "NaN"},
+        ):
+            with self.subTest(**data):
+                response = self.client.post(url, {"description": "Conta", "paid_by": self.ana.id, **data})
+                self.assertEqual(response.status_code, 200)
+        self.assertFalse(Expense.objects.exists())
+
+
+class DebtSnapshotTests(TestCase):
+    """O snapshot de dívidas não pode crescer em consultas com o número de grupos."""
+
+    def setUp(self):
+        self.me = User.objects.create_user(username="eu", first_name="Eu", password="senhaSuperF0rte")
+        self.friend = User.objects.create_user(username="amiga", first_name="Amiga", password="senhaSuperF0rte")
+        ledger_cache().clear()
+
+    def _add_group(self, index):
+        group = Group.objects.create(name=f"Grupo {index}", creator=self.me)
+        Participant.objects.create(group=group, user=self.me)
+        Participant.objects.create(group=group, user=self.friend)
+        with maintaining_ledger():
+            expense = Expense.objects.create(group=group, description="Conta", amount=Decimal("20.00"), paid_by=self.friend)
+            splits = [
+                ExpenseSplit(expense=expense, user=self.me, amount_owed=Decimal("10.00")),
+                ExpenseSplit(expense=expense, user=self.friend, amount_owed=Decimal("10.00")),
+            ]
+            ExpenseSplit.objects.bulk_create(splits)
+            apply_expense(expense, splits)
+
+    def _snapshot_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            snapshot = _my_debts_snapshot(self.me)
+        return snapshot, len(ctx.captured_queries)
+
+    def test_query_count_is_independent_of_group_count(self):
+        self._add_group(0)
+        snapshot, few = self._snapshot_queries()
+        self.assertEqual(len(snapshot["pending_to_pay"]), 1)
+
+        for index in range(1, 8):
+            self._add_group(index)
+        snapshot, many = self._snapshot_queries()
+        self.assertEqual(len(snapshot["pending_to_pay"]), 8)
+        self.assertEqual(few, many)
+        self.assertTrue(all(debt["amount"] == Decimal("10.00") for debt in snapshot["pending_to_pay"]))
+
+
+class SettlementCacheTests(TestCase):
+    """Liquidações ficam em cache até a revisão do grupo mudar."""
+
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", password="senhaSuperF0rte")
+        self.bia = User.objects.create_user(username="bia", first_name="Bia", password="senhaSuperF0rte")
+        self.group = Group.objects.create(name="Casa", creator=self.ana)
+        Participant.objects.create(group=self.group, user=self.ana)
+        Participant.objects.create(group=self.group, user=self.bia)
+        self.participants = list(self.group.participants.select_related("user"))
+
+    def _add_expense(self, amount):
+        with maintaining_ledger():
+            expense = Expense.objects.create(group=self.group, description="Luz", amount=amount, paid_by=self.ana)
+            splits = [ExpenseSplit(expense=expense, user=self.bia, amount_owed=amount)]
+            ExpenseSplit.objects.bulk_create(splits)
+            apply_expense(expense, splits)
+        self.group.refresh_from_db()
+
+    def test_cache_hit_until_revision_changes(self):
+        self._add_expense(Decimal("30.00"))
+        self.assertEqual(self.group.revision, 1)
+
+        _, settlements = _group_ledger(self.group, self.participants)
+        self.assertEqual([s.amount for s in settlements], [Decimal("30.00")])
+
+        with self.assertNumQueries(0):
+            _, cached = _group_ledger(self.group, self.participants)
+        self.assertEqual([(s.person_from, s.person_to, s.amount) for s in cached],
+                         [(s.person_from, s.person_to, s.amount) for s in settlements])
+
+        self._add_expense(Decimal("12.50"))
+        self.assertEqual(self.group.revision, 2)
+        _, settlements = _group_ledger(self.group, self.participants)
+        self.assertEqual([s.amount for s in settlements], [Decimal("42.50")])
+
+    @override_settings(RACHAI_BALANCE_ENGINE="python")
+    def test_edits_outside_the_views_invalidate_the_cache(self):
+        self._add_expense(Decimal("30.00"))
+        self._add_expense(Decimal("12.50"))
+        _group_ledger(self.group, self.participants)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Expense.objects.get(amount=Decimal("12.50")).delete()  # como pelo admin
+        self.group.refresh_from_db()
+        _, settlements = _group_ledger(self.group, self.participants)
+        self.assertEqual([s.amount for s in settlements], [Decimal("30.00")])
+
+
+class SettlementStrategyTests(SimpleTestCase):
+    balances = {1: Decimal("10.00"), 2: Decimal("5.00"), 3: Decimal("-5.00"), 4: Decimal("-10.00")}
+
+    def _apply(self, balances, rows):
+        remaining = dict(balances)
+        for debtor_id, creditor_id, amount in rows:
+            remaining[debtor_id] += amount
+            remaining[creditor_id] -= amount
+        return remaining
+
+    def test_every_strategy_clears_all_balances(self):
+        for strategy in STRATEGIES:
+            with self.subTest(strategy=strategy):
+                remaining = self._apply(self.balances, settle(self.balances, strategy))
+                self.assertTrue(all(value == 0 for value in remaining.values()))
+
+    def test_exact_and_hybrid_minimise_transfers(self):
+        self.assertEqual(len(settle(self.balances, "sequential")), 3)
+        self.assertEqual(len(settle(self.balances, "exact")), 2)
+        self.assertEqual(len(settle(self.balances, "hybrid")), 2)
+
+    def test_exact_falls_back_to_greedy_for_large_groups(self):
+        balances = {user_id: Decimal(user_id) for user_id in range(1, 20)}
+        balances[20] = -sum(balances.values())
+        remaining = self._apply(balances, settle(balances, "exact"))
+        self.assertTrue(all(value == 0 for value in remaining.values()))
+
+    def test_hybrid_cutoff_depends_only_on_the_number_of_balances(self):
+        for size, same_as in ((HYBRID_EXACT_LIMIT, "exact"), (HYBRID_EXACT_LIMIT + 1, "greedy")):
+            balances = {user_id: Decimal(user_id) for user_id in range(1, size)}
+            balances[size] = -sum(balances.values())
+            with self.subTest(size=size):
+                self.assertEqual(settle(balances, "hybrid"), settle(balances, same_as))
+
+    def test_sub_cent_balances_are_ignored(self):
+        self.assertEqual(settle({1: Decimal("0.01"), 2: Decimal("-0.01")}, "greedy"), [])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", password="senhaSuperF0rte")
+        self.group = Group.objects.create(name="Praia", creator=self.ana)
+        Participant.objects.create(group=self.group, user=self.ana)
+        self.client.force_login(self.ana)
+        self.url = reverse("rachais:group_detail", args=[self.group.id])
+
+    def test_not_modified_until_group_changes(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertLessEqual(len(ctx.captured_queries), 3)
+
+        self.client.post(reverse("rachais:add_expense", args=[self.group.id]), {
+            "description": "Sorvete", "amount": "12,00", "paid_by": self.ana.id, "split_method": "EQUAL",
+        })
+        # A mensagem de sucesso pendente impede o 304 na primeira visita.
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_group_list_is_conditional(self):
+        url = reverse("rachais:group_list")
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+@override_settings(RACHAI_EXPENSE_PAGE_SIZE=3)
+class ExpensePaginationTests(TestCase):
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", password="senhaSuperF0rte")
+        self.group = Group.objects.create(name="Feira", creator=self.ana)
+        Participant.objects.create(group=self.group, user=self.ana)
+        Expense.objects.bulk_create(
+            Expense(group=self.group, description=f"Item {i}", amount=Decimal("1.10"), paid_by=self.ana)
+            for i in range(8)
+        )
+        # Metade com o mesmo instante, para exercitar o desempate por id.
+        first_ids = list(self.group.expenses.order_by("id").values_list("id", flat=True)[:4])
+        Expense.objects.filter(id__in=first_ids).update(created_at=self.group.created_at)
+        self.client.force_login(self.ana)
+
+    def test_pages_cover_every_expense_once(self):
+        response = self.client.get(reverse("rachais:group_detail", args=[self.group.id]))
+        seen = [e.id for e in response.context["expenses"]]
+        self.assertEqual(response.context["total"], Decimal("8.80"))
+        cursor = response.context["next_cursor"]
+
+        while cursor:
+            response = self.client.get(reverse("rachais:group_expenses", args=[self.group.id]), {"cursor": cursor})
+            self.assertEqual(response.status_code, 200)
+            seen.extend(e.id for e in response.context["expenses"])
+            cursor = response.context["next_cursor"]
+
+        expected = list(self.group.expenses.order_by("-created_at", "-id").values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse("rachais:group_expenses", args=[self.group.id]), {"cursor": "abc"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ExpenseImportTests(TestCase):
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", email="ana@teste.com", first_name="Ana", password="senhaSuperF0rte")
+        self.bia = User.objects.create_user(username="bia", email="bia@teste.com", first_name="Bia", password="senhaSuperF0rte")
+        self.group = Group.objects.create(name="Planilha", creator=self.ana)
+        Participant.objects.create(group=self.group, user=self.ana)
+        Participant.objects.create(group=self.group, user=self.bia)
+        self.client.force_login(self.ana)
+
+    def test_csv_import_reports_bad_rows_and_keeps_good_ones(self):
+        content = (
+            "description,amount,paid_by,split_method,splits,created_at\n"
+            "Aluguel,\"1.000,00\",ana,EQUAL,,2024-01-05T10:00:00\n"
+            "Mercado,90.50,bia@teste.com,UNEQUAL_VALUE,\"ana:40,50; bia:50,00\",\n"
+            "Luz,100,ana,UNEQUAL_PERCENTAGE,ana:30;bia:70,\n"
+            "Sem valor,,ana,EQUAL,,\n"
+            "Estranho,10,carlos,EQUAL,,\n"
+            "Soma errada,10,ana,UNEQUAL_VALUE,ana:1;bia:1,\n"
+        )
+        upload = SimpleUploadedFile("despesas.csv", content.encode(), content_type="text/csv")
+        response = self.client.post(reverse("rachais:import_expenses", args=[self.group.id]), {"file": upload})
+
+        self.assertEqual(response.status_code, 200)
+        result = response.context["result"]
+        self.assertEqual(result.created, 3)
+        self.assertEqual([line for line, _ in result.errors], [5, 6, 7])
+        self.assertEqual(self.group.expenses.get(description="Aluguel").created_at.year, 2024)
+
+        ledger = calculate_balances(self.group, engine="ledger")
+        self.assertEqual(ledger, calculate_balances(self.group, engine="python"))
+        self.assertEqual(ledger[self.bia.id], Decimal("-500.00") + Decimal("40.50") - Decimal("70.00"))
+
+    def test_jsonl_import_via_command(self):
+        rows = [
+            {"description": "Taxi", "amount": 30, "paid_by": "bia"},
+            {"description": "Hotel", "amount": "200,00", "paid_by": "ana", "split_method": "UNEQUAL_VALUE",
+             "splits": {"ana": "50,00", "bia": "150,00"}},
+            "não é objeto",
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as handle:
+            handle.write("\n".join(json.dumps(row) for row in rows))
+        err = StringIO()
+        call_command("import_expenses", self.group.id, handle.name, chunk_size=1, stdout=StringIO(), stderr=err)
+        os.unlink(handle.name)
+
+        self.assertEqual(self.group.expenses.count(), 2)
+        self.assertIn("Linha 3", err.getvalue())
+        self.assertEqual(calculate_balances(self.group)[self.ana.id], Decimal("-15.00") + Decimal("150.00"))
+
+    def test_bad_values_are_reported_per_row(self):
+        rows = [
+            {"description": "NaN", "amount": "NaN", "paid_by": "ana"},
+            {"description": "Infinito", "amount": "Infinity", "paid_by": "ana"},
+            {"description": "Lista", "amount": [1], "paid_by": "ana"},
+            {"description": "Partes em lista", "amount": "10", "paid_by": "ana", "split_method": "UNEQUAL_VALUE",
+             "splits": ["ana", "bia"]},
+            {"description": "Porcentagem", "amount": "10", "paid_by": "ana", "split_method": "UNEQUAL_PERCENTAGE",
+             "splits": {"ana": "NaN", "bia": "100"}},
+            {"description": "Data", "amount": "10", "paid_by": "ana", "created_at": "2020-13-45T00:00:00"},
+            {"description": "Grande demais", "amount": "1e12", "paid_by": "ana"},
+            {"description": "Boa", "amount": "10", "paid_by": "ana"},
+        ]
+        result = import_expenses(self.group, enumerate(rows, start=1), chunk_size=1)
+
+        self.assertEqual(result.created, 1)
+        self.assertEqual([line for line, _ in result.errors], [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(list(self.group.expenses.values_list("description", flat=True)), ["Boa"])
+
+    def test_repeated_participants_in_splits_are_rejected(self):
+        rows = [
+            {"description": "Dobrada", "amount": "100", "paid_by": "ana", "split_method": "UNEQUAL_VALUE",
+             "splits": "ana:50; ANA:50"},
+            {"description": "Por id", "amount": "100", "paid_by": "ana", "split_method": "UNEQUAL_PERCENTAGE",
+             "splits": f"ana:50; {self.ana.id}:50"},
+            {"description": "Boa", "amount": "100", "paid_by": "ana", "split_method": "UNEQUAL_VALUE",
+             "splits": "ana:50; bia:50"},
+        ]
+        result = import_expenses(self.group, enumerate(rows, start=1))
+
+        self.assertEqual(result.created, 1)
+        self.assertEqual([line for line, _ in result.errors], [1, 2])
+        self.assertIn("repetido", result.errors[0][1])
+
+    def test_unreadable_bytes_keep_the_rows_already_imported(self):
+        # Bem maior que o buffer de decodificação: as primeiras linhas são lidas antes do byte inválido.
+        good = "".join(f"Linha {i},10,ana,EQUAL,,\n" for i in range(1200))
+        content = ("description,amount,paid_by,split_method,splits,created_at\n" + good).encode() + b"Ruim,\xff\xfe,ana\n"
+        upload = SimpleUploadedFile("despesas.csv", content, content_type="text/csv")
+        response = self.client.post(reverse("rachais:import_expenses", args=[self.group.id]), {"file": upload})
+
+        result = response.context["result"]
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(result.created, 0)
+        self.assertEqual(result.created, self.group.expenses.count())
+        self.assertEqual(len(result.errors), 1)
+        self.assertIn("Não foi possível ler o arquivo", result.errors[0][1])
+
+
+class LedgerExportTests(TestCase):
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", password="senhaSuperF0rte")
+        self.bia = User.objects.create_user(username="bia", first_name="Bia", password="senhaSuperF0rte")
+        self.group = Group.objects.create(name="Sítio", creator=self.ana)
+        Participant.objects.create(group=self.group, user=self.ana)
+        Participant.objects.create(group=self.group, user=self.bia)
+        self.client.force_login(self.ana)
+        self.client.post(reverse("rachais:add_expense", args=[self.group.id]), {
+            "description": "Lenha", "amount": "40,00", "paid_by": self.ana.id, "split_method": "EQUAL",
+        })
+
+    def test_group_export_streams_csv(self):
+        response = self.client.get(reverse("rachais:export_group", args=[self.group.id]), {"format": "csv"})
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lines[0].startswith("kind,id,group"))
+        self.assertEqual([line.split(",")[0] for line in lines[1:]], ["expense", "split", "split"])
+
+    def test_statement_export_streams_jsonl(self):
+        self.client.force_login(self.bia)
+        response = self.client.get(reverse("rachais:export_statement"), {"format": "jsonl"})
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows, [{
+            "kind": "split", "id": rows[0]["id"], "group": "Sítio", "expense_id": rows[0]["expense_id"],
+            "created_at": rows[0]["created_at"], "description": "Lenha", "split_method": "EQUAL",
+            "user": "bia", "counterparty": "ana", "amount": "20.00",
+        }])
+
+    def test_unknown_format_is_rejected(self):
+        response = self.client.get(reverse("rachais:export_statement"), {"format": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+
+class SplitEngineTests(SimpleTestCase):
+    def test_equal_split_spreads_leftover_cents(self):
+        self.assertEqual(split("EQUAL", 20000, [1, 2, 3]), [(1, 6667), (2, 6667), (3, 6666)])
+
+    def test_largest_remainder_gets_the_leftover(self):
+        self.assertEqual(allocate(100, [1, 1, 1]), [34, 33, 33])
+        self.assertEqual(allocate(1000, [3333, 3333, 3334]), [333, 333, 334])
+
+    def test_percentages_always_add_up_to_the_total(self):
+        shares = split("UNEQUAL_PERCENTAGE", 10001, [(1, Decimal("33.333")), (2, Decimal("33.333")), (3, Decimal("33.334"))])
+        self.assertEqual(sum(cents for _, cents in shares), 10001)
+        with self.assertRaisesMessage(SplitError, "não é exatamente 100%"):
+            split("UNEQUAL_PERCENTAGE", 100, [(1, Decimal("50")), (2, Decimal("40"))])
+
+    def test_values_must_match_the_total_and_zero_parts_are_dropped(self):
+        self.assertEqual(split("UNEQUAL_VALUE", 500, [(1, 500), (2, 0)]), [(1, 500)])
+        with self.assertRaisesMessage(SplitError, "não corresponde"):
+            split("UNEQUAL_VALUE", 500, [(1, 100)])
+
+    def test_batch_reports_errors_per_expense(self):
+        results = split_batch([("EQUAL", 10, [1, 2]), ("UNEQUAL_VALUE", 10, [(1, 1)]), ("OTHER", 1, [])])
+        self.assertEqual(results[0], [(1, 5), (2, 5)])
+        self.assertIsInstance(results[1], SplitError)
+        self.assertIsInstance(results[2], SplitError)
+
+
+class BenchmarkToolingTests(TestCase):
+    def setUp(self):
+        ledger_cache().clear()
+
+    def test_seed_data_is_consistent_and_benchmarkable(self):
+        call_command("seed_rachai", users=6, groups=2, participants=4, expenses=30, payments=3, stdout=StringIO())
+        self.assertEqual(Group.objects.count(), 2)
+        self.assertEqual(Expense.objects.count(), 60)
+        call_command("check_balances", stdout=StringIO())
+
+        payments = Payment.objects.count()
+        out = StringIO()
+        call_command("bench_rachai", repeat=2, stdout=out)
+        for view in ("group_list", "group_detail", "add_expense", "pay_debt"):
+            self.assertIn(view, out.getvalue())
+        self.assertEqual(Payment.objects.count(), payments + 2)
+
+    def test_explain_uses_composite_indexes(self):
+        call_command("seed_rachai", users=4, groups=1, participants=3, expenses=20, payments=2, stdout=StringIO())
+        out = StringIO()
+        call_command("bench_rachai", repeat=1, read_only=True, explain=True, stdout=out)
+        for index in ("expense_group_created_idx", "split_user_expense_idx", "payment_group_payer_idx",
+                      "payment_group_receiver_idx"):
+            self.assertIn(index, out.getvalue())
+
+
+@override_settings(RACHAI_REQUEST_TIMING=True, RACHAI_DUPLICATE_QUERY_THRESHOLD=2)
+class RequestTimingTests(TestCase):
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", password="senhaSuperF0rte")
+        self.group = Group.objects.create(name="Praia", creator=self.ana)
+        Participant.objects.create(group=self.group, user=self.ana)
+        self.client.force_login(self.ana)
+
+    def test_server_timing_header_and_log_line(self):
+        with self.assertLogs("rachais.timing", level="INFO") as logs:
+            response = self.client.get(reverse("rachais:group_detail", args=[self.group.id]))
+        header = response["Server-Timing"]
+        for phase in ("db;dur=", "tpl;dur=", "app;dur=", "total;dur="):
+            self.assertIn(phase, header)
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["path"], reverse("rachais:group_detail", args=[self.group.id]))
+        self.assertEqual(record["status"], 200)
+        self.assertGreater(record["queries"], 0)
+        self.assertIn(f'desc="{record["queries"]} queries"', header)
+
+    def test_repeated_queries_are_flagged(self):
+        from rachais.middleware import _normalize
+
+        self.assertEqual(
+            _normalize('SELECT * FROM "x" WHERE "id" IN (%s, %s, %s) AND "n" = 3'),
+            _normalize('SELECT * FROM "x" WHERE "id" IN (%s) AND "n" = 7'),
+        )
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from rachais.middleware import RequestTimingMiddleware
+
+        def n_plus_one(request):
+            for group in Group.objects.all():
+                list(Participant.objects.filter(group_id=group.id))
+            return HttpResponse("ok")
+
+        Group.objects.create(name="Serra", creator=self.ana)
+        middleware = RequestTimingMiddleware(n_plus_one)
+        with self.assertLogs("rachais.timing", level="WARNING") as logs:
+            response = middleware(RequestFactory().get("/n-mais-um/"))
+        self.assertIn('desc="3 queries"', response["Server-Timing"])
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("Consulta repetida 2 vezes em /n-mais-um/", logs.output[0])
+
+    @override_settings(RACHAI_REQUEST_TIMING=False)
+    def test_disabled_by_default(self):
+        from django.test import Client
+
+        client = Client()
+        client.force_login(self.ana)
+        self.assertNotIn("Server-Timing", client.get(reverse("rachais:group_list")))
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        ledger_cache().clear()
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        enabled = override_settings(RACHAI_PROFILING=True, RACHAI_PROFILE_DIR=self.profile_dir, RACHAI_PROFILER="cprofile")
+        enabled.enable()
+        self.addCleanup(enabled.disable)
+        self.admin = User.objects.create_user(username="admin", password="senhaSuperF0rte", is_staff=True)
+        self.ana = User.objects.create_user(username="ana", password="senhaSuperF0rte")
+        self.url = reverse("rachais:group_list")
+
+    def test_staff_request_is_profiled_and_downloadable(self):
+        self.client.force_login(self.admin)
+        name = self.client.get(self.url, {"_profile": "1"})["X-Rachai-Profile"]
+        self.assertTrue(name.endswith(".prof"))
+        self.assertTrue(os.path.exists(os.path.join(self.profile_dir, name)))
+
+        response = self.client.get(reverse("rachais:download_profile", args=[name]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("attachment", response["Content-Disposition"])
+        self.assertEqual(self.client.get(reverse("rachais:download_profile", args=["..secret.prof"])).status_code, 404)
+
+    def test_regular_user_needs_signed_header(self):
+        from rachais.middleware import profile_token
+
+        self.client.force_login(self.ana)
+        self.assertNotIn("X-Rachai-Profile", self.client.get(self.url, {"_profile": "1"}))
+        self.assertNotIn("X-Rachai-Profile", self.client.get(self.url, HTTP_X_RACHAI_PROFILE="forjado"))
+        name = self.client.get(self.url, HTTP_X_RACHAI_PROFILE=profile_token())["X-Rachai-Profile"]
+        self.assertTrue(name.endswith(".prof"))
+        self.assertEqual(self.client.get(reverse("rachais:download_profile", args=[name])).status_code, 404)
+
+    def test_busy_when_all_slots_are_taken(self):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from rachais.middleware import ProfilingMiddleware
+
+        middleware = ProfilingMiddleware(lambda request: HttpResponse("ok"))
+        request = RequestFactory().get(self.url, {"_profile": "1"})
+        request.user = self.admin
+        middleware.slots.acquire()
+        self.assertEqual(middleware(request)["X-Rachai-Profile"], "busy")
+        middleware.slots.release()
+        self.assertNotEqual(middleware(request)["X-Rachai-Profile"], "busy")
+
+    @override_settings(RACHAI_PROFILE_MAX_CONCURRENT=4)
+    def test_cprofile_runs_one_profile_at_a_time(self):
+        from rachais.middleware import ProfilingMiddleware
+
+        middleware = ProfilingMiddleware(lambda request: HttpResponse("ok"))
+        self.assertTrue(middleware.slots.acquire(blocking=False))
+        self.assertFalse(middleware.slots.acquire(blocking=False))
+        middleware.slots.release()
+
+
+@tag("budget")
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class QueryBudgetTests(TestCase):
+    """Limites de consultas e de tempo por view, independentes do volume de dados.
+
+    Cada view é medida em volumes crescentes com o mesmo limite: um N+1 faz o
+    número de consultas crescer com os dados e estoura o orçamento.
+    Rode só esta camada com ``manage.py test --tag budget``.
+    """
+
+    GROUP_SIZES = (1, 50, 500)
+    EXPENSE_SIZES = (10, 10_000)
+    QUERY_BUDGETS = {
+        "group_list": 3,
+        "group_detail": 12,
+        "add_expense": 14,
+        "add_participant": 7,
+        "pay_debt": 12,
+        "login": 9,
+    }
+    TIME_BUDGET_MS = 1500
+
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(
+            username="ana@rachai.test", email="ana@rachai.test", first_name="Ana", password="senhaSuperF0rte",
+        )
+        self.others = User.objects.bulk_create(
+            User(username=f"p{i}@rachai.test", email=f"p{i}@rachai.test", first_name=f"Pessoa {i}")
+            for i in range(3)
+        )
+        self.members = [self.ana, *self.others]
+        self.groups = []
+        self.client.force_login(self.ana)
+
+    def _grow_groups(self, total, expenses_per_group=2):
+        """Cria grupos até ``total``, todos com os mesmos membros e algumas despesas."""
+        new = Group.objects.bulk_create(
+            Group(name=f"Grupo {i}", creator=self.ana) for i in range(len(self.groups), total)
+        )
+        Participant.objects.bulk_create(Participant(group=g, user=u) for g in new for u in self.members)
+        forget_sidebar(*(user.pk for user in self.members))  # bulk_create não dispara os sinais
+        for group in new:
+            self._add_expenses(group, expenses_per_group)
+        self.groups.extend(new)
+
+    def _add_expenses(self, group, count):
+        member_ids = [user.pk for user in self.members]
+        expenses = Expense.objects.bulk_create(
+            Expense(group=group, description=f"Despesa {i}", amount=Decimal("40.00"),
+                    paid_by_id=member_ids[i % len(member_ids)], split_method="EQUAL")
+            for i in range(count)
+        )
+        ExpenseSplit.objects.bulk_create(
+            (ExpenseSplit(expense=expense, user_id=user_id, amount_owed=Decimal("10.00"))
+             for expense in expenses for user_id in member_ids),
+            batch_size=2000,
+        )
+        rebuild_group_balances(group)
+
+    def _measure(self, name, request):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            response = request()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        self.assertLess(response.status_code, 400)
+        self.assertLessEqual(
+            len(ctx.captured_queries), self.QUERY_BUDGETS[name],
+            f"{name}: {len(ctx.captured_queries)} consultas\n" + "\n".join(q["sql"] for q in ctx.captured_queries),
+        )
+        self.assertLess(elapsed_ms, self.TIME_BUDGET_MS, f"{name}: {elapsed_ms:.0f} ms")
+        return response
+
+    def test_views_by_number_of_groups(self):
+        for size in self.GROUP_SIZES:
+            self._grow_groups(size)
+            group = self.groups[-1]
+            with self.subTest(groups=size):
+                self._measure("group_list", lambda: self.client.get(reverse("rachais:group_list")))
+                self._measure("group_detail", lambda: self.client.get(reverse("rachais:group_detail", args=[group.id])))
+
+    def test_views_by_number_of_expenses(self):
+        self._grow_groups(1, expenses_per_group=0)
+        group = self.groups[0]
+        added = 0
+        for size in self.EXPENSE_SIZES:
+            self._add_expenses(group, size - added)
+            added = size
+            with self.subTest(expenses=size):
+                self._measure("group_detail", lambda: self.client.get(reverse("rachais:group_detail", args=[group.id])))
+                # Despesa alta paga por outro: Ana sai devendo e o pagamento abaixo é aceito.
+                self._measure("add_expense", lambda: self.client.post(reverse("rachais:add_expense", args=[group.id]), {
+                    "description": "Pizza", "amount": "400,00", "paid_by": self.others[0].id, "split_method": "EQUAL",
+                }))
+                debt = next(row for row in settle(calculate_balances(group)) if row[0] == self.ana.pk)
+                payments = Payment.objects.count()
+                self._measure("pay_debt", lambda: self.client.post(reverse("rachais:pay_debt"), {
+                    "group_id": group.id, "receiver_id": debt[1], "amount": str(debt[2]).replace(".", ","),
+                }))
+                self.assertEqual(Payment.objects.count(), payments + 1)
+
+    def test_add_participant_and_login(self):
+        self._grow_groups(1)
+        group = self.groups[0]
+        newcomer = User.objects.create_user(username="novo@rachai.test", email="novo@rachai.test")
+        self._measure("add_participant", lambda: self.client.post(
+            reverse("rachais:add_participant", args=[group.id]), {"identifier": newcomer.email},
+        ))
+        self.assertTrue(Participant.objects.filter(group=group, user=newcomer).exists())
+
+        self.client.logout()
+        response = self._measure("login", lambda: self.client.post(
+            reverse("accounts:login"), {"email": "ana@rachai.test", "password": "senhaSuperF0rte"},
+        ))
+        self.assertEqual(response.status_code, 302)
+
+
+class UserLookupTests(TestCase):
+    def setUp(self):
+        self.ana = User.objects.create_user(
+            username="ana", email="Ana.Souza@Example.com", first_name="Ana", password="senhaSuperF0rte",
+        )
+
+    def test_lookup_ignores_case_on_username_then_email(self):
+        from rachais.backends import get_user_by_identifier
+
+        self.assertEqual(get_user_by_identifier("ANA"), self.ana)
+        self.assertEqual(get_user_by_identifier("ana.souza@example.COM"), self.ana)
+        self.assertIsNone(get_user_by_identifier("bia"))
+        # Um username igual ao e-mail de outra pessoa tem prioridade.
+        other = User.objects.create_user(username="ana.souza@example.com", password="senhaSuperF0rte")
+        self.assertEqual(get_user_by_identifier("ANA.SOUZA@example.com"), other)
+
+    def test_lookup_compares_the_indexed_expression(self):
+        from rachais.backends import users_iexact
+
+        with CaptureQueriesContext(connection) as ctx:
+            list(users_iexact("email", "ANA.SOUZA@EXAMPLE.COM"))
+        sql = ctx.captured_queries[0]["sql"].upper()
+        self.assertIn('LOWER("AUTH_USER"."EMAIL")', sql)
+        self.assertNotIn("LIKE", sql)
+        self.assertNotIn(" OR ", sql)
+
+    def test_accented_identifier_typed_as_stored_is_found(self):
+        from rachais.backends import get_user_by_identifier
+
+        jose = User.objects.create_user(username="jose", email="JOSÉ@EXEMPLO.COM", password="senhaSuperF0rte")
+        self.assertEqual(get_user_by_identifier("JOSÉ@EXEMPLO.COM"), jose)
+
+    def test_login_form_accepts_any_case(self):
+        response = self.client.post(reverse("accounts:login"), {
+            "email": "ANA.SOUZA@example.com", "password": "senhaSuperF0rte",
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(int(self.client.session["_auth_user_id"]), self.ana.pk)
+
+
+class CachedAuthTests(TestCase):
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", password="senhaSuperF0rte")
+        self.group = Group.objects.create(name="Praia", creator=self.ana)
+        Participant.objects.create(group=self.group, user=self.ana)
+        self.client.force_login(self.ana)
+        self.url = reverse("rachais:group_list")
+
+    def _queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        return [q["sql"] for q in ctx.captured_queries]
+
+    def test_session_and_user_come_from_cache(self):
+        self._queries()
+        queries = self._queries()
+        self.assertFalse([sql for sql in queries if "django_session" in sql])
+        # O .get(pk=...) do backend (LIMIT 21) não acontece mais; o sidebar ainda busca os membros.
+        self.assertFalse([sql for sql in queries if 'FROM "auth_user"' in sql and "LIMIT 21" in sql])
+
+    def test_saving_the_user_invalidates_the_cache(self):
+        self._queries()
+        self.ana.first_name = "Ana Paula"
+        self.ana.save()
+        self.assertContains(self.client.get(self.url), "Ana Paula")
+
+    def test_password_change_logs_out_other_sessions(self):
+        self._queries()
+        self.ana.set_password("outraSenhaF0rte")
+        self.ana.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse("accounts:login"), response["Location"])
+
+    def test_inactive_user_is_rejected(self):
+        self._queries()
+        User.objects.filter(pk=self.ana.pk).update(is_active=False)
+        self.assertEqual(self.client.get(self.url).status_code, 200)  # ainda no cache
+        self.ana.refresh_from_db()
+        self.ana.save()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+
+class SidebarCacheTests(TestCase):
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", password="senhaSuperF0rte")
+        self.bia = User.objects.create_user(username="bia", first_name="Bia", password="senhaSuperF0rte")
+        self.praia = Group.objects.create(name="Praia", creator=self.ana)
+        Participant.objects.create(group=self.praia, user=self.ana)
+        self.serra = Group.objects.create(name="Serra", creator=self.bia)
+        Participant.objects.create(group=self.serra, user=self.bia)
+        self.client.force_login(self.ana)
+        self.url = reverse("rachais:group_list")
+
+    def test_sidebar_costs_no_queries_on_cache_hit(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertContains(response, "Praia")
+        self.assertNotContains(response, "Serra")
+        # Só a consulta agregada da ETag.
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_joining_a_group_refreshes_the_sidebar(self):
+        self.assertNotContains(self.client.get(self.url), "Serra")
+        Participant.objects.create(group=self.serra, user=self.ana)
+        self.assertContains(self.client.get(self.url), "Serra")
+
+        self.serra.name = "Serra Gaúcha"
+        self.serra.save()
+        self.assertContains(self.client.get(self.url), "Serra Gaúcha")
+
+    def test_membership_is_checked_against_the_database(self):
+        self.client.get(self.url)
+        detail = reverse("rachais:group_detail", args=[self.serra.id])
+        self.assertEqual(self.client.get(detail).status_code, 404)
+        # Criador que não é participante continua com acesso.
+        solo = Group.objects.create(name="Solo", creator=self.ana)
+        self.assertEqual(self.client.get(reverse("rachais:group_detail", args=[solo.id])).status_code, 200)
+
+    def test_member_and_creator_are_listed_once(self):
+        from rachais.views import _sidebar_groups
+
+        _, groups = _sidebar_groups(self.ana)
+        self.assertEqual([g.name for g in groups], ["Praia"])
+
+
+class DisplayNameTests(TestCase):
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", last_name="Souza")
+        self.bia = User.objects.create_user(username="bia@rachai.test")
+
+    def test_bulk_resolver_uses_one_query_then_the_cache(self):
+        from rachais.names import display_names
+
+        with self.assertNumQueries(1):
+            names = display_names([self.ana.id, self.bia.id, self.ana.id])
+        self.assertEqual(names, {self.ana.id: "Ana Souza", self.bia.id: "bia"})
+        with self.assertNumQueries(0):
+            self.assertEqual(display_names([self.bia.id]), {self.bia.id: "bia"})
+        self.assertEqual(display_names([999_999]), {999_999: "Usuário"})
+
+    def test_saving_the_user_refreshes_the_name(self):
+        from rachais.names import display_names
+
+        display_names([self.bia.id])
+        self.bia.first_name = "Beatriz"
+        self.bia.save()
+        self.assertEqual(display_names([self.bia.id])[self.bia.id], "Beatriz")
+
+
+@override_settings(RACHAI_EQUAL_SPLIT_STORAGE="implicit")
+class ImplicitEqualSplitTests(TestCase):
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", password="senhaSuperF0rte")
+        self.bia = User.objects.create_user(username="bia", first_name="Bia", password="senhaSuperF0rte")
+        self.caio = User.objects.create_user(username="caio", first_name="Caio", password="senhaSuperF0rte")
+        self.group = Group.objects.create(name="Festa", creator=self.ana)
+        for user in (self.ana, self.bia, self.caio):
+            Participant.objects.create(group=self.group, user=user)
+        self.client.force_login(self.ana)
+
+    def _add(self, **data):
+        self.client.post(reverse("rachais:add_expense", args=[self.group.id]), {"paid_by": self.ana.id, **data})
+
+    def _assert_engines_agree(self):
+        ledger = calculate_balances(self.group, engine="ledger")
+        for engine in ("sql", "python"):
+            with self.subTest(engine=engine):
+                self.assertEqual(calculate_balances(self.group, engine=engine), ledger)
+        return ledger
+
+    def test_equal_split_stores_only_the_participant_list(self):
+        self._add(description="Bolo", amount="100,00", split_method="EQUAL")
+        self._add(description="Som", amount="90,00", split_method="UNEQUAL_VALUE",
+                  **{f"split_user_{self.ana.id}": "30,00", f"split_user_{self.bia.id}": "60,00"})
+
+        bolo = Expense.objects.get(description="Bolo")
+        self.assertEqual(bolo.equal_split_user_ids, [self.ana.id, self.bia.id, self.caio.id])
+        self.assertFalse(bolo.splits.exists())
+        self.assertEqual(Expense.objects.get(description="Som").splits.count(), 2)
+
+        ledger = self._assert_engines_agree()
+        self.assertEqual(ledger[self.bia.id], Decimal("-33.33") - Decimal("60.00"))
+        self.assertEqual(sum(ledger.values()), Decimal("0"))
+
+        response = self.client.get(reverse("rachais:group_detail", args=[self.group.id]))
+        bolo = next(e for e in response.context["expenses"] if e.description == "Bolo")
+        self.assertEqual(bolo.split_list, [{"name": "Bia", "amount": Decimal("33.33")},
+                                           {"name": "Caio", "amount": Decimal("33.33")}])
+
+    def test_import_and_exports_derive_the_shares(self):
+        content = "description,amount,paid_by\nPão,\"10,00\",bia\n"
+        upload = SimpleUploadedFile("despesas.csv", content.encode(), content_type="text/csv")
+        self.client.post(reverse("rachais:import_expenses", args=[self.group.id]), {"file": upload})
+        self.assertFalse(ExpenseSplit.objects.exists())
+        self._assert_engines_agree()
+
+        response = self.client.get(reverse("rachais:export_group", args=[self.group.id]), {"format": "csv"})
+        lines = b"".join(response.streaming_content).decode().splitlines()[1:]
+        self.assertEqual([line.split(",")[0] for line in lines], ["expense", "split", "split", "split"])
+        self.assertEqual([line.split(",")[-1] for line in lines[1:]], ["3.34", "3.33", "3.33"])
+
+        self.client.force_login(self.caio)
+        response = self.client.get(reverse("rachais:export_statement"), {"format": "jsonl"})
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row["kind"], row["user"], row["amount"]) for row in rows], [("split", "caio", "3.33")])
+
+    def test_compact_command_converts_existing_rows(self):
+        with override_settings(RACHAI_EQUAL_SPLIT_STORAGE="rows"):
+            self._add(description="Pizza", amount="100,00", split_method="EQUAL")
+        self.assertEqual(ExpenseSplit.objects.count(), 3)
+        before = self._assert_engines_agree()
+
+        out = StringIO()
+        call_command("compact_equal_splits", stdout=out)
+        self.assertIn("1 despesa(s) convertidas (3 partes)", out.getvalue())
+        self.assertFalse(ExpenseSplit.objects.exists())
+        rebuild_group_balances(self.group)
+        self.assertEqual(self._assert_engines_agree(), before)
+
+
+class BalanceCheckpointTests(TestCase):
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", password="senhaSuperF0rte")
+        self.bia = User.objects.create_user(username="bia", first_name="Bia", password="senhaSuperF0rte")
+        self.group = Group.objects.create(name="Casa", creator=self.ana)
+        for user in (self.ana, self.bia):
+            Participant.objects.create(group=self.group, user=user)
+        self.client.force_login(self.ana)
+
+    def _add(self, description, amount, paid_by):
+        self.client.post(reverse("rachais:add_expense", args=[self.group.id]), {
+            "description": description, "amount": amount, "paid_by": paid_by.id, "split_method": "EQUAL",
+        })
+
+    def _assert_engines_agree(self):
+        ledger = calculate_balances(self.group, engine="ledger")
+        for engine in ("sql", "python"):
+            with self.subTest(engine=engine):
+                self.assertEqual(calculate_balances(self.group, engine=engine), ledger)
+        return ledger
+
+    def test_engines_start_from_the_latest_checkpoint(self):
+        self._add("Aluguel", "1000,00", self.ana)
+        self.client.force_login(self.bia)
+        self.client.post(reverse("rachais:pay_debt"), {"group_id": self.group.id, "receiver_id": self.ana.id, "amount": "500.00"})
+        self._add("Mercado", "600,00", self.bia)
+
+        out = StringIO()
+        call_command("close_balance_periods", "--min-age-hours", "0", stdout=out)
+        self.assertIn("1 grupo(s) fechado(s)", out.getvalue())
+        self.assertEqual(
+            dict(BalanceCheckpoint.objects.values_list("user_id", "amount")),
+            {self.ana.id: Decimal("-300.00"), self.bia.id: Decimal("300.00")},
+        )
+        with override_settings(RACHAI_EQUAL_SPLIT_STORAGE="implicit"):
+            self._add("Luz", "90,01", self.bia)
+        before = self._assert_engines_agree()
+
+        # O histórico fechado não é mais lido: alterá-lo por fora não muda os motores...
+        Expense.objects.filter(description="Aluguel").update(amount=Decimal("10.00"))
+        self.assertEqual(calculate_balances(self.group, engine="python"), before)
+        # ...até a reconstrução, que percorre tudo e descarta os fechamentos.
+        rebuild_group_balances(self.group)
+        self.assertFalse(BalanceCheckpoint.objects.exists())
+        self.assertEqual(self._assert_engines_agree()[self.ana.id], before[self.ana.id] - Decimal("990.00"))
+
+    def test_period_without_new_activity_is_skipped(self):
+        self._add("Internet", "100,00", self.ana)
+        call_command("close_balance_periods", "--min-age-hours", "0", stdout=StringIO())
+        out = StringIO()
+        call_command("close_balance_periods", "--min-age-hours", "0", stdout=out)
+        self.assertIn("0 grupo(s) fechado(s)", out.getvalue())
+        self.assertEqual(BalanceCheckpoint.objects.values("as_of").distinct().count(), 1)
+
+        self._add("Gás", "50,00", self.bia)
+        call_command("close_balance_periods", "--min-age-hours", "0", stdout=StringIO())
+        self.assertEqual(BalanceCheckpoint.objects.values("as_of").distinct().count(), 2)
+        self._assert_engines_agree()
+
+
+class ArchiveHistoryTests(TestCase):
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", password="senhaSuperF0rte")
+        self.bia = User.objects.create_user(username="bia", first_name="Bia", password="senhaSuperF0rte")
+        self.group = Group.objects.create(name="Apê", creator=self.ana)
+        for user in (self.ana, self.bia):
+            Participant.objects.create(group=self.group, user=user)
+
+    def _add(self, description, amount, paid_by):
+        self.client.force_login(paid_by)
+        self.client.post(reverse("rachais:add_expense", args=[self.group.id]), {
+            "description": description, "amount": amount, "paid_by": paid_by.id, "split_method": "EQUAL",
+        })
+
+    def _assert_engines_agree(self):
+        ledger = calculate_balances(self.group, engine="ledger")
+        for engine in ("sql", "python"):
+            with self.subTest(engine=engine):
+                self.assertEqual(calculate_balances(self.group, engine=engine), ledger)
+        return ledger
+
+    def test_settled_period_moves_to_the_archive(self):
+        self._add("Aluguel", "100,00", self.ana)
+        self.client.force_login(self.bia)
+        self.client.post(reverse("rachais:pay_debt"), {"group_id": self.group.id, "receiver_id": self.ana.id, "amount": "50.00"})
+        call_command("close_balance_periods", "--min-age-hours", "0", stdout=StringIO())
+        self._add("Feira", "40,00", self.bia)
+
+        out = StringIO()
+        call_command("archive_history", "--batch-size", "1", stdout=out)
+        self.assertIn("1 grupo(s): 1 despesa(s) e 1 pagamento(s) arquivados.", out.getvalue())
+        self.assertEqual(list(Expense.objects.values_list("description", flat=True)), ["Feira"])
+        self.assertFalse(ExpenseSplit.objects.filter(expense__description="Aluguel").exists())
+        archived = ArchivedExpense.objects.get()
+        self.assertEqual(archived.shares, [[self.ana.id, "50.00"], [self.bia.id, "50.00"]])
+
+        before = self._assert_engines_agree()
+        self.assertEqual(before[self.ana.id], Decimal("-20.00"))
+        rebuild_group_balances(self.group)
+        self.assertEqual(self._assert_engines_agree(), before)
+
+        self.client.force_login(self.ana)
+        response = self.client.get(reverse("rachais:group_detail", args=[self.group.id]))
+        self.assertEqual(response.context["total"], Decimal("140.00"))
+        archive_url = response.context["archive_url"]
+        self.assertContains(response, "Ver histórico arquivado (1 despesa)")
+        response = self.client.get(archive_url)
+        self.assertContains(response, "Aluguel")
+        self.assertContains(response, "Bia deve R$")
+
+        response = self.client.get(reverse("rachais:export_group", args=[self.group.id]), {"format": "csv"})
+        kinds = [line.split(",")[0] for line in b"".join(response.streaming_content).decode().splitlines()[1:]]
+        self.assertEqual(kinds, ["expense", "expense", "split", "split", "split", "split", "payment"])
+
+    def test_open_balances_are_kept_unless_asked(self):
+        self._add("Luz", "80,00", self.ana)
+        call_command("close_balance_periods", "--min-age-hours", "0", stdout=StringIO())
+
+        out = StringIO()
+        call_command("archive_history", stdout=out)
+        self.assertIn("0 grupo(s)", out.getvalue())
+        call_command("archive_history", "--include-unsettled", stdout=out)
+        self.assertFalse(Expense.objects.exists())
+        self.assertEqual(self._assert_engines_agree()[self.bia.id], Decimal("-40.00"))
+
+
+class ConcurrentWriteTests(TransactionTestCase):
+    """Escritas simultâneas no mesmo grupo, cada uma numa thread com sua conexão."""
+
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", password="senhaSuperF0rte")
+        self.bia = User.objects.create_user(username="bia", first_name="Bia", password="senhaSuperF0rte")
+        self.group = Group.objects.create(name="Sítio", creator=self.ana)
+        for user in (self.ana, self.bia):
+            Participant.objects.create(group=self.group, user=user)
+
+    def _run_concurrently(self, user, requests):
+        """Dispara ``requests`` (funções que recebem um Client) ao mesmo tempo."""
+        barrier = threading.Barrier(len(requests))
+        statuses = []
+
+        def worker(request):
+            client = Client()
+            client.force_login(user)
+            try:
+                barrier.wait()
+                statuses.append(request(client).status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(request,)) for request in requests]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return statuses
+
+    def test_double_click_pays_the_debt_only_once(self):
+        self.client.force_login(self.ana)
+        self.client.post(reverse("rachais:add_expense", args=[self.group.id]), {
+            "description": "Lenha", "amount": "100,00", "paid_by": self.ana.id, "split_method": "EQUAL",
+        })
+        pay = lambda client: client.post(reverse("rachais:pay_debt"), {
+            "group_id": self.group.id, "receiver_id": self.ana.id, "amount": "50.00",
+        })
+        self.assertEqual(self._run_concurrently(self.bia, [pay] * 4), [302] * 4)
+
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(calculate_balances(self.group), {self.ana.id: Decimal("0.00"), self.bia.id: Decimal("0.00")})
+
+    def test_concurrent_expenses_all_reach_the_ledger(self):
+        add = lambda client: client.post(reverse("rachais:add_expense", args=[self.group.id]), {
+            "description": "Carvão", "amount": "10,00", "paid_by": self.ana.id, "split_method": "EQUAL",
+        })
+        self._run_concurrently(self.ana, [add] * 6)
+
+        self.assertEqual(Expense.objects.count(), 6)
+        ledger = calculate_balances(self.group, engine="ledger")
+        self.assertEqual(ledger, calculate_balances(self.group, engine="python"))
+        self.assertEqual(ledger[self.bia.id], Decimal("-30.00"))
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", password="senhaSuperF0rte")
+        self.bia = User.objects.create_user(username="bia", first_name="Bia", password="senhaSuperF0rte")
+        self.group = Group.objects.create(name="Bloco", creator=self.ana)
+        for user in (self.ana, self.bia):
+            Participant.objects.create(group=self.group, user=user)
+        self.client.force_login(self.ana)
+        self.add_url = reverse("rachais:add_expense", args=[self.group.id])
+
+    def _expense(self, key, amount="30,00"):
+        return self.client.post(self.add_url, {
+            "description": "Fantasia", "amount": amount, "paid_by": self.ana.id, "split_method": "EQUAL",
+            "idempotency_key": key,
+        })
+
+    def test_form_retry_replays_the_redirect_without_writing(self):
+        response = self.client.get(self.add_url)
+        self.assertContains(response, 'name="idempotency_key"')
+
+        first = self._expense("k1")
+        ledger = calculate_balances(self.group)
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self._expense("k1")
+        self.assertRedirects(retry, first["Location"], fetch_redirect_response=False)
+        self.assertFalse(any("rachais_expense" in q["sql"] for q in ctx.captured_queries))
+        self.assertEqual(Expense.objects.count(), 1)
+        self.assertEqual(calculate_balances(self.group), ledger)
+
+        self.assertEqual(self._expense("k1", amount="31,00").status_code, 422)
+        self._expense("k2")
+        self.assertEqual(Expense.objects.count(), 2)
+
+    def test_header_key_on_pay_debt_and_failed_forms_release_the_key(self):
+        self._expense("k1")
+        self.client.force_login(self.bia)
+        pay = {"group_id": self.group.id, "receiver_id": self.ana.id, "amount": "15.00"}
+        for _ in range(2):
+            self.client.post(reverse("rachais:pay_debt"), pay, HTTP_IDEMPOTENCY_KEY="pagamento-1")
+        self.assertEqual(Payment.objects.count(), 1)
+
+        # Erro de validação (200) não guarda a chave: o reenvio corrigido passa.
+        self.client.force_login(self.ana)
+        self.assertEqual(self._expense("k3", amount="abc").status_code, 200)
+        self._expense("k3")
+        self.assertEqual(Expense.objects.count(), 2)
+
+    def test_refused_payment_releases_the_key(self):
+        bia = Client()
+        bia.force_login(self.bia)
+        url = reverse("rachais:pay_debt")
+        pay = {"group_id": self.group.id, "receiver_id": self.ana.id, "amount": "15.00"}
+
+        # Recusado (redireciona com erro): a dívida ainda não existe.
+        response = bia.post(url, pay, HTTP_IDEMPOTENCY_KEY="pagamento-1", follow=True)
+        self.assertContains(response, "Não encontramos essa dívida")
+        self.assertFalse(IdempotencyKey.objects.filter(key="pagamento-1").exists())
+
+        self._expense("k1")
+        response = bia.post(url, pay, HTTP_IDEMPOTENCY_KEY="pagamento-1", follow=True)
+        self.assertContains(response, "Pagamento registrado com sucesso!")
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_purge_removes_only_expired_keys(self):
+        self._expense("k1")
+        self._expense("k2", amount="10,00")
+        IdempotencyKey.objects.filter(key="k1").update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        out = StringIO()
+        call_command("purge_idempotency_keys", "--batch-size", "1", stdout=out)
+        self.assertIn("1 chave(s) vencida(s) apagada(s).", out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list("key", flat=True)), ["k2"])
+
+
+@override_settings(RACHAI_READ_REPLICAS=["replica0"], RACHAI_PRIMARY_PIN_SECONDS=10)
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        self.session = {}
+        self.seen = []
+
+        def view(request):
+            self.seen.append(self.router.db_for_read(Group))
+            if request.path == "/escreve/":
+                self.router.db_for_write(Group)
+                self.seen.append(self.router.db_for_read(Group))
+            return HttpResponse("ok")
+
+        self.middleware = PrimaryPinningMiddleware(view)
+
+    def _request(self, method, path="/"):
+        request = getattr(self.factory, method)(path)
+        request.session = self.session
+        self.middleware(request)
+        return self.seen.pop(0)
+
+    def test_reads_go_to_replicas_until_the_session_writes(self):
+        self.assertIsNone(self.router.db_for_read(Group))  # fora de requisição: primário
+        self.assertEqual(self._request("get"), "replica0")
+        self.assertEqual(self._request("post"), "default")
+
+        self.assertEqual(self._request("get", "/escreve/"), "replica0")
+        self.assertEqual(self.seen.pop(0), "default")  # lê o que acabou de gravar
+        self.assertEqual(self._request("get"), "default")  # e o redirecionamento também
+
+        self.session[PRIMARY_PIN_SESSION_KEY] = time.time() - 1
+        self.assertEqual(self._request("get"), "replica0")
+
+    @override_settings(RACHAI_READ_REPLICAS=["replica0", "replica1", "replica2"])
+    def test_one_replica_per_request_and_related_reads_follow_the_instance(self):
+        state, token = begin_routing(pinned=False)
+        try:
+            chosen = {self.router.db_for_read(model) for model in (Group, GroupBalance, Participant) for _ in range(10)}
+            group = Group(pk=1)
+            group._state.db = "replica1" if state.replica != "replica1" else "replica2"
+            related = self.router.db_for_read(GroupBalance, instance=group)
+            with primary_reads():
+                primary = self.router.db_for_read(GroupBalance)
+            after = self.router.db_for_read(GroupBalance)
+        finally:
+            end_routing(token)
+
+        self.assertEqual(chosen, {state.replica})
+        self.assertEqual(related, group._state.db)
+        self.assertEqual(primary, "default")
+        self.assertEqual(after, state.replica)
+
+    def test_only_the_primary_is_migrated(self):
+        self.assertTrue(self.router.allow_migrate("default", "rachais"))
+        self.assertFalse(self.router.allow_migrate("replica0", "rachais"))
+        self.assertEqual(self.router.db_for_write(Group), "default")
+
+    @override_settings(RACHAI_READ_REPLICAS=[])
+    def test_disabled_without_replicas(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            PrimaryPinningMiddleware(lambda request: None)
+
+
+@override_settings(RACHAI_READ_REPLICAS=["sqlite_replica"], DATABASE_ROUTERS=["rachais.db_router.PrimaryReplicaRouter"])
+class SqliteReplicaTests(TestCase):
+    """Réplica de verdade: um segundo arquivo SQLite, só com a tabela de grupos.
+
+    A réplica tem um nome de grupo antigo e não tem usuários nem participantes,
+    então qualquer leitura que fosse parar nela por engano falharia.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Registrada depois do setUpClass: fica fora da transação do TestCase,
+        # como uma réplica de verdade.
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.settings["sqlite_replica"] = {
+            **connections.settings["default"],
+            "NAME": os.path.join(cls.replica_dir, "replica.sqlite3"),
+            "TEST": {"NAME": None, "MIRROR": None, "CHARSET": None, "COLLATION": None, "MIGRATE": False},
+        }
+        cls.databases = cls.databases | {"sqlite_replica"}
+        with connections["sqlite_replica"].schema_editor() as editor:
+            editor.create_model(Group)
+        # Sem auth_user na réplica, então as chaves estrangeiras ficam sem checagem.
+        connections["sqlite_replica"].disable_constraint_checking()
+
+    @classmethod
+    def tearDownClass(cls):
+        connections["sqlite_replica"].close()
+        del connections["sqlite_replica"]
+        del connections.settings["sqlite_replica"]
+        shutil.rmtree(cls.replica_dir)
+        cls.databases = cls.databases - {"sqlite_replica"}
+        super().tearDownClass()
+
+    def _should_check_constraints(self, connection):
+        return connection.alias != "sqlite_replica" and super()._should_check_constraints(connection)
+
+    def setUp(self):
+        ledger_cache().clear()
+        self.ana = User.objects.create_user(username="ana", first_name="Ana", password="senhaSuperF0rte")
+        self.group = Group.objects.create(name="Novo nome", creator=self.ana)
+        Participant.objects.create(group=self.group, user=self.ana)
+        Group.objects.using("sqlite_replica").bulk_create([
+            Group(pk=self.group.pk, name="Nome antigo", creator_id=self.ana.pk, created_at=self.group.created_at),
+        ])
+
+    def test_reads_hit_the_replica_but_caches_are_filled_from_the_primary(self):
+        state, token = begin_routing(pinned=False)
+        try:
+            self.assertEqual(Group.objects.get(pk=self.group.pk).name, "Nome antigo")
+            _, sidebar = _sidebar_groups(self.ana)
+            names = display_names([self.ana.pk])
+            self.assertIsNotNone(EmailOrUsernameModelBackend().get_user(self.ana.pk))
+            balances, _ = _group_ledger(self.group, [])
+        finally:
+            end_routing(token)
+
+        self.assertEqual(sidebar, [SidebarGroup(self.group.pk, "Novo nome")])
+        self.assertEqual(names, {self.ana.pk: "Ana"})
+        self.assertEqual(balances, {})
+        self.assertFalse(state.wrote)
\ No newline at end of file
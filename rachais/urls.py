@@ -9,7 +9,13 @@ urlpatterns = [
     path("groups/", views.group_list, name="group_list"),
     path("groups/create/", views.create_group, name="create_group"),
     path("groups/<int:group_id>/", views.group_detail, name="group_detail"),
+    path("groups/<int:group_id>/expenses/", views.group_expenses, name="group_expenses"),
+    path("groups/<int:group_id>/archive/", views.group_archive, name="group_archive"),
     path("groups/<int:group_id>/add-participant/", views.add_participant, name="add_participant"),
     path("groups/<int:group_id>/expenses/add/", views.add_expense, name="add_expense"),
+    path("groups/<int:group_id>/expenses/import/", views.import_expenses, name="import_expenses"),
+    path("groups/<int:group_id>/export/", views.export_group, name="export_group"),
+    path("statement/export/", views.export_statement, name="export_statement"),
     path("debts/pay/", views.pay_debt, name="pay_debt"),
+    path("profiles/<str:name>/", views.download_profile, name="download_profile"),
 ]
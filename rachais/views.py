@@ -1,217 +1,364 @@
+import hashlib
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
 from decimal import Decimal, InvalidOperation
-import decimal
-from typing import Optional
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from types import SimpleNamespace
-from django.db import transaction
+from django.db import DEFAULT_DB_ALIAS, transaction
 from .models import Group, Participant, Expense, ExpenseSplit, Payment
+from .balances import (
+    apply_expense, apply_payment, build_splits, calculate_balances, calculate_group_balances, implicit_shares,
+    maintaining_ledger,
+)
+from .settlements import default_strategy, settle
+from .splits import SplitError, from_cents, split as split_expense, to_cents
+from .exports import FORMATS as EXPORT_FORMATS, group_rows, statement_rows
+from .importers import import_expenses as import_expenses_from_rows, iter_csv_rows, iter_jsonl_rows, text_stream
+from .backends import get_user_by_identifier
+from .idempotency import idempotent, mark_written
+from .names import display_name, display_names
+from .middleware import PROFILE_NAME, profile_dir
+from .db_router import primary_reads
+from .caching import bump_revision, claim_revision, ledger_cache, ledger_cache_timeout, ledger_key, sidebar_key
+from django.http import FileResponse, Http404, HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth import get_user_model
-from django.contrib.auth.models import AbstractUser
-from django.db.models import Q
-from django.views.decorators.http import require_POST
+from django.conf import settings
+from django.db.models import Count, Exists, Max, OuterRef, Q, Sum
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
 
 User = get_user_model()
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+# Tentativas de uma escrita que perdeu a corrida pela revisão do grupo.
+_WRITE_ATTEMPTS = 3
 
 
-def _display_name(user: Optional[AbstractUser]) -> str:
-    if not user:
-        return "Usuário"
+SidebarGroup = namedtuple("SidebarGroup", "id name")
 
-    full = (user.get_full_name() or "").strip()
-    if full:
-        return full
 
-    first = (getattr(user, "first_name", "") or "").strip()
-    if first:
-        return first
+def _member_group_ids(user: User):
+    """IDs dos grupos em que o usuário participa ou que criou (UNION, sem DISTINCT)."""
+    return (
+        Participant.objects.filter(user=user).values("group_id")
+        .union(Group.objects.filter(creator=user).values("id"))
+    )
 
-    for attr in ("name", "full_name", "display_name"):
-        val = (getattr(user, attr, "") or "").strip()
-        if val:
-            return val
 
-    prof = getattr(user, "profile", None)
-    if prof:
-        for attr in ("display_name", "name", "full_name", "first_name"):
-            val = (getattr(prof, attr, "") or "").strip()
-            if val:
-                return val
+def _user_groups_qs(user: User):
+    return Group.objects.filter(pk__in=_member_group_ids(user)).order_by("-created_at")
 
-    uname = (getattr(user, "username", "") or "").strip()
-    if "@" in uname:
-        uname = uname.split("@", 1)[0]
-    return uname or "Usuário"
 
+def _member_group_or_404(user: User, group_id):
+    """O grupo, se o usuário participa dele ou o criou; senão 404."""
+    is_member = Exists(Participant.objects.filter(group=OuterRef("pk"), user=user))
+    return get_object_or_404(Group.objects.filter(Q(creator=user) | is_member), pk=group_id)
 
-def _sidebar_groups_qs(user: User):
-    """QS padrão para preencher a sidebar com os grupos do usuário."""
-    return (
+
+def _sidebar_groups(user: User):
+    """``(token, [SidebarGroup])`` para o sidebar, cacheado por usuário.
+
+    A lista é descartada quando o usuário entra num grupo ou um grupo seu muda
+    (ver signals.py). O token é novo a cada reconstrução e faz parte da chave
+    do fragmento ``{% cache %}`` do sidebar, então o HTML acompanha a lista.
+    """
+    cache = ledger_cache()
+    key = sidebar_key(user.pk)
+    cached = cache.get(key)
+    if cached is None:
+        # Lido do primário: a lista fica no cache até o próximo sinal, e uma
+        # réplica atrasada a gravaria desatualizada logo após a invalidação.
+        groups = Group.objects.using(DEFAULT_DB_ALIAS)
+        rows = (
+            groups.filter(participants__user=user).values_list("id", "name", "created_at")
+            .union(groups.filter(creator=user).values_list("id", "name", "created_at"))
+            .order_by("-created_at")
+        )
+        cached = (uuid.uuid4().hex[:12], [(group_id, name) for group_id, name, _ in rows])
+        cache.set(key, cached, ledger_cache_timeout())
+    token, rows = cached
+    return token, [SidebarGroup(*row) for row in rows]
+
+
+def _sidebar_context(user: User):
+    token, groups = _sidebar_groups(user)
+    return {"groups": groups, "sidebar_token": token}
+
+def _groups_etag(request, group_id=None):
+    """ETag barata: revisões dos grupos do usuário + usuário + sessão.
+
+    Qualquer despesa, pagamento ou participante novo em um dos grupos avança a
+    revisão e muda a ETag. Com mensagens pendentes não há resposta condicional,
+    para que o aviso não se perca num 304.
+    """
+    if not request.user.is_authenticated or len(messages.get_messages(request)):
+        return None
+
+    stats = (
         Group.objects
-        .filter(Q(participants__user=user) | Q(creator=user))
-        .distinct()
-        .order_by("-created_at")
-        .prefetch_related("participants__user")
+        .filter(pk__in=_member_group_ids(request.user))
+        .aggregate(count=Count("pk"), revisions=Sum("revision"), last=Max("pk"))
     )
+    # A sessão (e o token CSRF) é renovada a cada login; a chave entra na ETag
+    # para que uma página cacheada nunca carregue um token antigo.
+    session = request.session.session_key or ""
+    raw = f"{request.user.pk}:{group_id}:{stats['count']}:{stats['revisions']}:{stats['last']}:{session}"
+    return hashlib.sha1(raw.encode()).hexdigest()
 
-def _calculate_balances(group):
-    participants = list(group.participants.select_related("user").all())
-    
-    expenses = list(group.expenses.select_related("paid_by").all())
-    
-    balances = defaultdict(Decimal)
 
-    all_splits = ExpenseSplit.objects.filter(
-        expense__in=expenses
-    ).select_related('user')
+def _encode_cursor(expense):
+    """Cursor opaco ``<microssegundos>-<id>`` da última despesa de uma página."""
+    delta = expense.created_at - _EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+    return f"{micros}-{expense.id}"
 
+
+def _decode_cursor(raw):
+    try:
+        micros, expense_id = (raw or "").split("-")
+        return _EPOCH + timedelta(microseconds=int(micros)), int(expense_id)
+    except (ValueError, OverflowError):
+        return None
+
+
+def _expense_page(group, cursor=None):
+    """Uma página de despesas em ordem ``(-created_at, -id)``, por keyset.
+
+    Em vez de OFFSET, filtra pelo último ``(created_at, id)`` visto, então o
+    custo de cada página não depende de quantas despesas o grupo já tem.
+    """
+    page_size = getattr(settings, "RACHAI_EXPENSE_PAGE_SIZE", 50)
+    qs = group.expenses.order_by("-created_at", "-id")
+    if cursor is not None:
+        created_at, expense_id = cursor
+        qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=expense_id))
+
+    expenses = list(qs[:page_size + 1])
+    next_cursor = None
+    if len(expenses) > page_size:
+        expenses = expenses[:page_size]
+        next_cursor = _encode_cursor(expenses[-1])
+
+    _decorate_expenses(expenses)
+    return expenses, next_cursor
+
+
+def _archive_url(group, next_cursor):
+    """Link para o histórico arquivado, oferecido depois da última página viva."""
+    if next_cursor or not group.archived_expense_count:
+        return None
+    return reverse("rachais:group_archive", args=[group.id])
+
+
+def _archived_page(group, before=None):
+    """Uma página do histórico arquivado, da mais nova para a mais antiga.
+
+    Devolve ``(despesas, url da próxima página)``; as partes vêm do JSON da
+    própria linha, sem consultar outras tabelas além dos nomes.
+    """
+    page_size = getattr(settings, "RACHAI_EXPENSE_PAGE_SIZE", 50)
+    qs = group.archived_expenses.order_by("-original_id")
+    if before is not None:
+        qs = qs.filter(original_id__lt=before)
+
+    expenses = list(qs[:page_size + 1])
+    next_url = None
+    if len(expenses) > page_size:
+        expenses = expenses[:page_size]
+        next_url = reverse("rachais:group_archive", args=[group.id]) + f"?before={expenses[-1].original_id}"
+
+    names = display_names(
+        [e.paid_by_id for e in expenses] + [user_id for e in expenses for user_id, _ in e.shares]
+    )
+    for e in expenses:
+        setattr(e, "paid_by_name", names[e.paid_by_id])
+        setattr(e, "split_list", [
+            {"name": names[user_id], "amount": Decimal(amount)}
+            for user_id, amount in e.shares if user_id != e.paid_by_id
+        ])
+    return expenses, next_url
+
+
+def _decorate_expenses(expenses):
+    """Anexa ``paid_by_name`` e ``split_list`` às despesas de uma página."""
+    all_splits = ExpenseSplit.objects.filter(
+        expense__in=[e for e in expenses if e.equal_split_user_ids is None]
+    ).only("expense_id", "user_id", "amount_owed")
+    
     splits_by_expense = defaultdict(list)
     for split in all_splits:
         splits_by_expense[split.expense_id].append(split)
 
-    for expense in expenses:
-        balances[expense.paid_by.id] += expense.amount
+    shares_by_expense = {
+        e.id: implicit_shares(e.amount, e.equal_split_user_ids)
+        if e.equal_split_user_ids is not None
+        else [(split.user_id, split.amount_owed) for split in splits_by_expense.get(e.id, [])]
+        for e in expenses
+    }
+    names = display_names(
+        [e.paid_by_id for e in expenses]
+        + [user_id for shares in shares_by_expense.values() for user_id, _ in shares]
+    )
 
-        splits_for_this_expense = splits_by_expense.get(expense.id, [])
+    for e in expenses:
+        setattr(e, "paid_by_name", names[e.paid_by_id])
+        
+        split_list = []
+        
+        for user_id, amount_owed in shares_by_expense[e.id]:
+            if user_id == e.paid_by_id:
+                continue 
+                
+            split_list.append({
+                "name": names[user_id], 
+                "amount": amount_owed 
+            })
+            
+        setattr(e, "split_list", split_list)
 
-        for split in splits_for_this_expense:
-            balances[split.user.id] -= split.amount_owed
-    
-    payments = group.payments.select_related("payer", "receiver").all()
-    for payment in payments:
-        balances[payment.payer_id] += payment.amount
-        balances[payment.receiver_id] -= payment.amount
 
-    return dict(balances)
+def _calculate_balances(group):
+    return calculate_balances(group)
 
-def _calculate_settlements(balances, participants_qs):
+def _hydrate_settlements(rows, participants_qs):
     user_map = {p.user.id: p.user for p in participants_qs}
-    creditors = []
-    debtors = []
-
-    for user_id, balance in balances.items():
-        if balance > Decimal("0.01"):
-            creditors.append([user_id, balance])
-        elif balance < Decimal("-0.01"):
-            debtors.append([user_id, -balance])
-    
-    settlements = []
-    i = j = 0
-
-    while i < len(creditors) and j < len(debtors):
-        creditor_id, credit = creditors[i]
-        debtor_id, debt = debtors[j]
-        transfer = min(credit, debt).quantize(Decimal("0.01"))
-
-        settlements.append(SimpleNamespace(
-            person_from=user_map[debtor_id],
-            person_to=user_map[creditor_id],
-            amount=transfer,  
-        ))
-
-        creditors[i][1] -= transfer
-        debtors[j][1] -= transfer
-
-        if creditors[i][1] < Decimal("0.01"):
-            i+=1
-        if debtors[j][1] < Decimal("0.01"):
-            j+=1
-    
-    return settlements
-
-def _my_debts_snapshot(user):
+    return [
+        SimpleNamespace(person_from=user_map[debtor_id], person_to=user_map[creditor_id], amount=amount)
+        for debtor_id, creditor_id, amount in rows
+    ]
+
+def _calculate_settlements(balances, participants_qs, strategy=None):
+    return _hydrate_settlements(settle(balances, strategy), participants_qs)
+
+def _cached_ledgers(groups):
+    """Saldos e liquidações por grupo, cacheados por ``(group_id, revision)``.
+
+    Só os grupos ausentes do cache são calculados, todos numa mesma consulta.
+    """
+    cache = ledger_cache()
+    engine = getattr(settings, "RACHAI_BALANCE_ENGINE", "ledger")
+    strategy = default_strategy()
+    keys = {group.id: ledger_key(group.id, group.revision, engine, strategy) for group in groups}
+    cached = cache.get_many(keys.values())
+
+    ledgers = {}
+    missing = []
+    for group_id, key in keys.items():
+        if key in cached:
+            ledgers[group_id] = cached[key]
+        else:
+            missing.append(group_id)
+
+    if missing:
+        fresh = {}
+        # Do primário: uma réplica atrasada gravaria saldos antigos sob a revisão nova.
+        with primary_reads():
+            balances_by_group = calculate_group_balances(missing, engine)
+        for group_id in missing:
+            balances = balances_by_group.get(group_id, {})
+            ledgers[group_id] = fresh[keys[group_id]] = (balances, settle(balances, strategy))
+        cache.set_many(fresh, ledger_cache_timeout())
+
+    return ledgers
+
+def _group_ledger(group, participants):
+    """``(saldos, liquidações)`` do grupo, servidos do cache quando possível."""
+    balances, rows = _cached_ledgers([group])[group.id]
+    return balances, _hydrate_settlements(rows, participants)
+
+def _my_debts_snapshot(user, groups=None):
+    """Pendências e pagamentos do usuário em todos os seus grupos.
+
+    Saldos e liquidações vêm do cache por revisão; os grupos ausentes são
+    calculados juntos, numa única consulta agrupada por ``group_id``. Só as
+    contrapartes das pendências do usuário são carregadas, numa consulta.
+    """
     pending_to_pay = []
     pending_to_receive = []
-    paid = []
 
-    sidebar_groups = list(_sidebar_groups_qs(user))
-
-    for group in sidebar_groups:
-        participants = list(group.participants.select_related("user"))
-        balances = _calculate_balances(group)
-        settlements = _calculate_settlements(balances, participants)
+    if groups is None:
+        groups = list(_user_groups_qs(user))
+    groups_by_id = {group.id: group for group in groups}
+
+    ledgers = _cached_ledgers(groups)
+    mine = [
+        (group, debtor_id, creditor_id, amount)
+        for group in groups
+        for debtor_id, creditor_id, amount in ledgers[group.id][1]
+        if user.id in (debtor_id, creditor_id)
+    ]
+    counterparties = User.objects.in_bulk(
+        {creditor_id if debtor_id == user.id else debtor_id for _, debtor_id, creditor_id, _ in mine}
+    )
 
-        for settlement in settlements:
-            if settlement.person_from.id == user.id:
-                pending_to_pay.append({"group": group, "counterparty": settlement.person_to, "amount": settlement.amount})
-            elif settlement.person_to.id == user.id:
-                pending_to_receive.append({"group": group, "counterparty": settlement.person_from, "amount": settlement.amount})
+    for group, debtor_id, creditor_id, amount in mine:
+        if debtor_id == user.id:
+            pending_to_pay.append({"group": group, "counterparty": counterparties[creditor_id], "amount": amount})
+        else:
+            pending_to_receive.append({"group": group, "counterparty": counterparties[debtor_id], "amount": amount})
 
-        paid_qs = group.payments.filter(Q(payer=user) | Q(receiver=user)).select_related("payer", "receiver")
-        
-        for payment in paid_qs:
-            paid.append(payment)
+    paid = list(
+        Payment.objects
+        .filter(group_id__in=groups_by_id)
+        .filter(Q(payer=user) | Q(receiver=user))
+        .select_related("payer", "receiver")
+        .order_by("-created_at")
+    )
+    for payment in paid:
+        payment.group = groups_by_id[payment.group_id]
 
-    return {"pending_to_pay": pending_to_pay, "pending_to_receive": pending_to_receive, "paid": sorted(paid, key=lambda p: p.created_at, reverse=True),}
+    return {"pending_to_pay": pending_to_pay, "pending_to_receive": pending_to_receive, "paid": paid}
 
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_groups_etag)
 def group_list(request):
-    groups = _sidebar_groups_qs(request.user)
-    return render(request, "rachais/group_list.html", {"groups": groups})
+    return render(request, "rachais/group_list.html", _sidebar_context(request.user))
 
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_groups_etag)
 def group_detail(request, group_id):
-    groups = _sidebar_groups_qs(request.user)
-    group = get_object_or_404(groups, pk=group_id)
+    group = _member_group_or_404(request.user, group_id)
 
-    expenses = list(group.expenses.select_related("paid_by").all())
     participants = list(group.participants.select_related("user").all())
+    # Guarda no cache os nomes dos membros já carregados; a página de
+    # despesas abaixo os reaproveita sem consultar o banco.
+    names = display_names([p.user_id for p in participants], loaded=[p.user for p in participants])
+    expenses, next_cursor = _expense_page(group)
 
     for p in participants:
-        setattr(p, "display_name", _display_name(p.user))
+        setattr(p, "display_name", names[p.user_id])
 
-    total = sum((e.amount for e in expenses), Decimal("0"))
+    total = group.expenses.aggregate(total=Sum("amount"))["total"] or Decimal("0")
+    total = (Decimal(total) + group.archived_expense_total).quantize(Decimal("0.01"))
     
-    balances = _calculate_balances(group) 
-    
-    settlements = _calculate_settlements(balances, participants)
+    balances, settlements = _group_ledger(group, participants)
 
     my_debts = _my_debts_snapshot(request.user)
 
     for s in settlements:
-        setattr(s, "from_name", _display_name(s.person_from))
-        setattr(s, "to_name", _display_name(s.person_to))
+        setattr(s, "from_name", names[s.person_from.id])
+        setattr(s, "to_name", names[s.person_to.id])
 
     for participant in participants:
         balance = balances.get(participant.user.id, Decimal("0"))
         setattr(participant, "balance", balance)
         setattr(participant, "balance_abs", balance.copy_abs())
-    all_splits = ExpenseSplit.objects.filter(
-        expense__in=expenses
-    ).select_related('user')
-    
-    splits_by_expense = defaultdict(list)
-    for split in all_splits:
-        splits_by_expense[split.expense_id].append(split)
-
-    for e in expenses:
-        setattr(e, "paid_by_name", _display_name(e.paid_by))
-        
-        split_list = []
-        splits_for_this_expense = splits_by_expense.get(e.id, [])
-        
-        for split in splits_for_this_expense:
-            if split.user.id == e.paid_by_id:
-                continue 
-                
-            split_list.append({
-                "name": _display_name(split.user), 
-                "amount": split.amount_owed 
-            })
-            
-        setattr(e, "split_list", split_list)
-
     return render(
         request,
         "rachais/group_detail.html",
         {
+            **_sidebar_context(request.user),
             "group": group,
-            "groups": groups,
             "expenses": expenses,
+            "next_cursor": next_cursor,
+            "archive_url": _archive_url(group, next_cursor),
             "participants": participants,
             "total": total,
             "settlements": settlements,
@@ -219,10 +366,96 @@ def group_detail(request, group_id):
         }
     )
 
+@login_required
+def group_expenses(request, group_id):
+    """Fragmento com a próxima página de despesas (carregado sob demanda)."""
+    group = _member_group_or_404(request.user, group_id)
+    cursor = _decode_cursor(request.GET.get("cursor"))
+    if cursor is None:
+        return HttpResponseBadRequest("Cursor inválido.")
+
+    expenses, next_cursor = _expense_page(group, cursor)
+    return render(
+        request,
+        "rachais/expense_items.html",
+        {"group": group, "expenses": expenses, "next_cursor": next_cursor, "archive_url": _archive_url(group, next_cursor)},
+    )
+
+@login_required
+def group_archive(request, group_id):
+    """Fragmento com uma página do histórico arquivado (carregado sob demanda)."""
+    group = _member_group_or_404(request.user, group_id)
+    before = request.GET.get("before")
+    if before is not None and not before.isdigit():
+        return HttpResponseBadRequest("Cursor inválido.")
+
+    expenses, next_url = _archived_page(group, int(before) if before else None)
+    return render(
+        request,
+        "rachais/expense_items.html",
+        {"group": group, "expenses": expenses, "archived": True, "archive_url": next_url},
+    )
+
+@login_required
+def import_expenses(request, group_id):
+    """Importa despesas de um arquivo CSV ou JSON-lines para o grupo."""
+    group = get_object_or_404(Group, pk=group_id)
+
+    if not Participant.objects.filter(group=group, user=request.user).exists():
+        messages.error(request, "Você não participa deste grupo.")
+        return redirect("rachais:group_detail", group_id=group.id)
+
+    context = {"group": group}
+    if request.method == "POST":
+        upload = request.FILES.get("file")
+        if upload is None:
+            messages.error(request, "Selecione um arquivo para importar.")
+            return render(request, "rachais/import_expenses.html", context)
+
+        fmt = request.POST.get("format") or ("jsonl" if upload.name.lower().endswith((".jsonl", ".json")) else "csv")
+        reader = iter_jsonl_rows if fmt == "jsonl" else iter_csv_rows
+        result = import_expenses_from_rows(group, reader(text_stream(upload.file)))
+
+        if result.created:
+            messages.success(request, f"{result.created} despesa(s) importada(s).")
+        if result.errors:
+            messages.error(request, f"{len(result.errors)} linha(s) com erro não foram importadas.")
+        context["result"] = result
+
+    return render(request, "rachais/import_expenses.html", context)
+
+def _streaming_export(request, rows, filename):
+    fmt = request.GET.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        return HttpResponseBadRequest("Formato inválido.")
+    content_type, serializer = EXPORT_FORMATS[fmt]
+    response = StreamingHttpResponse(serializer(rows), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+@login_required
+def export_group(request, group_id):
+    """Exporta despesas, partes e pagamentos do grupo sem carregá-los em memória."""
+    group = _member_group_or_404(request.user, group_id)
+    return _streaming_export(request, group_rows(group), f"rachai-grupo-{group.id}")
+
+@login_required
+def export_statement(request):
+    """Extrato do usuário logado em todos os grupos."""
+    return _streaming_export(request, statement_rows(request.user), "rachai-extrato")
+
+@login_required
+def download_profile(request, name):
+    """Baixa um perfil gravado pelo ProfilingMiddleware (apenas staff)."""
+    path = profile_dir() / name
+    if not request.user.is_staff or not PROFILE_NAME.match(name) or not path.is_file():
+        raise Http404
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=name)
+
 @login_required
 def create_group(request):
     """Cria um grupo; impede nomes repetidos apenas para o MESMO criador."""
-    groups = _sidebar_groups_qs(request.user)
+    sidebar = _sidebar_context(request.user)
 
     if request.method == "POST":
         name = (request.POST.get("name") or "").strip()
@@ -242,10 +475,10 @@ def create_group(request):
         return render(
             request,
             "rachais/create_group.html",
-            {"groups": groups, "name": name},
+            {**sidebar, "name": name},
         )
 
-    return render(request, "rachais/create_group.html", {"groups": groups})
+    return render(request, "rachais/create_group.html", sidebar)
 
 
 @login_required
@@ -263,13 +496,7 @@ def add_participant(request, group_id):
             messages.error(request, "Informe o username ou e-mail do usuário.")
             return redirect("rachais:group_detail", group_id=group.id)
 
-        try:
-            user = User.objects.get(username__iexact=ident)
-        except User.DoesNotExist:
-            try:
-                user = User.objects.get(email__iexact=ident)
-            except User.DoesNotExist:
-                user = None
+        user = get_user_by_identifier(ident)
 
         if not user:
             messages.error(request, "Usuário não encontrado.")
@@ -280,13 +507,15 @@ def add_participant(request, group_id):
             return redirect("rachais:group_detail", group_id=group.id)
 
         Participant.objects.create(group=group, user=user)
-        messages.success(request, f"{_display_name(user)} adicionado(a) com sucesso!")
+        bump_revision(group)
+        messages.success(request, f"{display_name(user)} adicionado(a) com sucesso!")
         return redirect("rachais:group_detail", group_id=group.id)
 
     return redirect("rachais:group_detail", group_id=group.id)
 
 
 @login_required
+@idempotent
 def add_expense(request, group_id):
     group = get_object_or_404(Group, pk=group_id)
 
@@ -295,8 +524,9 @@ def add_expense(request, group_id):
         return redirect("rachais:group_detail", group_id=group.id)
 
     participants = list(group.participants.select_related("user").all())
+    names = display_names([p.user_id for p in participants], loaded=[p.user for p in participants])
     for p in participants:
-        setattr(p, "display_name", _display_name(p.user))
+        setattr(p, "display_name", names[p.user_id])
     context = {
         "group": group,
         "participants": participants,
@@ -315,7 +545,9 @@ def add_expense(request, group_id):
 
         norm = raw_amount.replace(".", "").replace(",", ".")
         try:
-            amount = Decimal(norm) 
+            amount = Decimal(norm)
+            if not amount.is_finite():
+                raise InvalidOperation("Valor precisa ser finito")
         except (InvalidOperation, AttributeError):
             messages.error(request, "Informe um valor válido (ex.: 100,00).")
             return render(request, "rachais/add_expense.html", context)
@@ -336,52 +568,11 @@ def add_expense(request, group_id):
 
         participant_users = [p.user for p in participants]
 
-        
         if split_method == 'EQUAL':
-            n_participants = len(participant_users)
-            if n_participants == 0:
-                messages.error(request, "Não há participantes no grupo para dividir.")
-                return render(request, "rachais/add_expense.html", context)
-
-            split_amount = round(amount / n_participants, 2)
-            remainder = amount - (split_amount * n_participants)
-
-            try:
-                with transaction.atomic():
-                    expense = Expense.objects.create(
-                        group=group,
-                        description=description,
-                        amount=amount,
-                        paid_by=payer,
-                        split_method=split_method
-                    )
-                    
-                    splits_to_create = []
-                    for i, user in enumerate(participant_users):
-                        amount_owed = split_amount
-                        if i == 0: 
-                            amount_owed += remainder
-                        
-                        splits_to_create.append(
-                            ExpenseSplit(
-                                expense=expense,
-                                user=user,
-                                amount_owed=amount_owed
-                            )
-                        )
-                    ExpenseSplit.objects.bulk_create(splits_to_create)
-                
-                messages.success(request, "Despesa registrada com sucesso.")
-                return redirect("rachais:group_detail", group_id=group.id)
-
-            except Exception as e:
-                messages.error(request, f"Erro ao salvar: {e}")
-                return render(request, "rachais/add_expense.html", context)
+            spec = [user.id for user in participant_users]
 
         elif split_method == 'UNEQUAL_VALUE':
-            total_split_sum = Decimal('0.00')
-            splits_data_to_save = [] 
-
+            spec = []
             for user in participant_users:
                 field_name = f'split_user_{user.id}'
                 raw_value = (request.POST.get(field_name) or "0").strip()
@@ -389,56 +580,18 @@ def add_expense(request, group_id):
                 
                 try:
                     value_decimal = Decimal(norm_value)
+                    if not value_decimal.is_finite():
+                        raise InvalidOperation("Valor precisa ser finito")
                     if value_decimal < 0:
                         raise InvalidOperation("Valor não pode ser negativo")
                 except (InvalidOperation, AttributeError):
                     messages.error(request, f"Valor inválido inserido para {user.username}.")
                     return render(request, "rachais/add_expense.html", context)
 
-                total_split_sum += value_decimal
-                splits_data_to_save.append((user, value_decimal))
-
-            if total_split_sum.quantize(Decimal("0.01")) != amount.quantize(Decimal("0.01")):
-                error_msg = (
-                    f"A soma das partes (R$ {total_split_sum:.2f}) não corresponde "
-                    f"ao valor total da despesa (R$ {amount:.2f})"
-                )
-                messages.error(request, error_msg)
-                return render(request, "rachais/add_expense.html", context)
-            
-            try:
-                with transaction.atomic():
-                    expense = Expense.objects.create(
-                        group=group,
-                        description=description,
-                        amount=amount,
-                        paid_by=payer,
-                        split_method=split_method
-                    )
-                    
-                    splits_to_create = []
-                    for user, amount_owed in splits_data_to_save:
-                        if amount_owed > 0:
-                            splits_to_create.append(
-                                ExpenseSplit(
-                                    expense=expense,
-                                    user=user,
-                                    amount_owed=amount_owed
-                                )
-                            )
-                    ExpenseSplit.objects.bulk_create(splits_to_create)
-                
-                messages.success(request, "Despesa registrada com sucesso.")
-                return redirect("rachais:group_detail", group_id=group.id)
-
-            except Exception as e:
-                messages.error(request, f"Erro ao salvar: {e}")
-                return render(request, "rachais/add_expense.html", context)
+                spec.append((user.id, to_cents(value_decimal)))
 
         elif split_method == 'UNEQUAL_PERCENTAGE':
-            total_percentage_sum = Decimal('0.00')
-            perc_data_to_save = [] 
-
+            spec = []
             for user in participant_users:
                 field_name = f'split_perc_{user.id}'
                 raw_perc = (request.POST.get(field_name) or "0").strip()
@@ -447,80 +600,60 @@ def add_expense(request, group_id):
                 
                 try:
                     perc_decimal = Decimal(norm_perc)
+                    if not perc_decimal.is_finite():
+                        raise InvalidOperation("Porcentagem precisa ser finita")
                     if perc_decimal < 0:
                         raise InvalidOperation("Porcentagem não pode ser negativa")
                 except (InvalidOperation, AttributeError):
                     messages.error(request, f"Porcentagem inválida para {user.username}.")
                     return render(request, "rachais/add_expense.html", context)
 
-                total_percentage_sum += perc_decimal
-                perc_data_to_save.append((user, perc_decimal))
-            
-            if total_percentage_sum.quantize(Decimal("0.01")) != Decimal('100.00'):
-                error_msg = (
-                    f"A soma das porcentagens ({total_percentage_sum:.2f}%) não é "
-                    f"exatamente 100%"
-                )
-                messages.error(request, error_msg)
-                return render(request, "rachais/add_expense.html", context)
-            
-            try:
-                with transaction.atomic():
-                    expense = Expense.objects.create(
-                        group=group,
-                        description=description,
-                        amount=amount,
-                        paid_by=payer,
-                        split_method=split_method
-                    )
-                    
-                    splits_to_create = []
-                    total_calculated_amount = Decimal('0.00')
-                    
-                    perc_data_to_save.sort(key=lambda x: x[0].id) 
-
-                    for i, (user, percentage) in enumerate(perc_data_to_save):
-                        amount_owed = (percentage / Decimal('100.00') * amount).quantize(
-                            Decimal("0.01"), rounding=decimal.ROUND_HALF_UP
-                        )
-                        total_calculated_amount += amount_owed
-
-                        if amount_owed > 0:
-                            splits_to_create.append(
-                                ExpenseSplit(
-                                    expense=expense,
-                                    user=user,
-                                    amount_owed=amount_owed
-                                )
-                            )
-                    
-                    remainder = amount - total_calculated_amount
-                    if remainder != Decimal('0.00') and splits_to_create:
-                        splits_to_create[0].amount_owed += remainder
-
-                    ExpenseSplit.objects.bulk_create(splits_to_create)
-                
-                messages.success(request, "Despesa registrada com sucesso.")
-                return redirect("rachais:group_detail", group_id=group.id)
-
-            except Exception as e:
-                messages.error(request, f"Erro ao salvar: {e}")
-                return render(request, "rachais/add_expense.html", context)
+                spec.append((user.id, perc_decimal))
             
         else:
             messages.error(request, "Método de divisão inválido.")
             return render(request, "rachais/add_expense.html", context)
 
+        amount_cents = to_cents(amount)
+        try:
+            shares = split_expense(split_method, amount_cents, spec)
+        except SplitError as e:
+            messages.error(request, str(e))
+            return render(request, "rachais/add_expense.html", context)
+
+        try:
+            with transaction.atomic(), maintaining_ledger():
+                expense = Expense(
+                    group=group,
+                    description=description,
+                    amount=from_cents(amount_cents),
+                    paid_by=payer,
+                    split_method=split_method
+                )
+                splits, splits_to_create = build_splits(expense, shares)
+                expense.save()
+                
+                if splits_to_create:
+                    ExpenseSplit.objects.bulk_create(splits_to_create)
+                apply_expense(expense, splits)
+            
+            mark_written(request)
+            messages.success(request, "Despesa registrada com sucesso.")
+            return redirect("rachais:group_detail", group_id=group.id)
+
+        except Exception as e:
+            messages.error(request, f"Erro ao salvar: {e}")
+            return render(request, "rachais/add_expense.html", context)
 
     return render(request, "rachais/add_expense.html", context)
 
 @require_POST
 @login_required
+@idempotent
 def pay_debt(request):
     group_id = request.POST.get("group_id")
     receiver_id = request.POST.get("receiver_id")
     amount_raw = request.POST.get("amount")
-    print(f"Raw amount received: '{amount_raw}'")
 
     if not (group_id and receiver_id and amount_raw):
         messages.error(request, "Requisição inválida.")
@@ -541,34 +674,50 @@ def pay_debt(request):
         return redirect("rachais:group_detail", group_id=group.id)
     
     participants = list(group.participants.select_related("user"))
-    balances = _calculate_balances(group)
-    settlements = _calculate_settlements(balances, participants)
-
-    candidate = next(
-        (
-            s for s in settlements
-            if s.person_from.id == request.user.id
-            and s.person_to.id == int(receiver_id)
-        ),
-        None,
-    )
+    # A dívida é conferida na revisão lida e o pagamento só entra se a revisão
+    # não mudou (claim_revision trava o grupo até o commit). Se outra escrita
+    # chegou antes, recalcula na revisão nova: um segundo clique encontra a
+    # dívida já quitada em vez de pagá-la de novo.
+    for _ in range(_WRITE_ATTEMPTS):
+        _, settlements = _group_ledger(group, participants)
+
+        candidate = next(
+            (
+                s for s in settlements
+                if s.person_from.id == request.user.id
+                and s.person_to.id == int(receiver_id)
+            ),
+            None,
+        )
 
-    if candidate is None:
-        messages.error(request, "Não encontramos essa dívida ou ela já foi quitada.")
-        return redirect("rachais:group_detail", group_id=group.id)
-    
-    transfer_amount = candidate.amount.quantize(Decimal("0.01"))
-    if amount.quantize(Decimal("0.01")) != transfer_amount:
-        messages.error(request, "O valor informado não corresponde ao saldo atual dessa dívida.")
+        if candidate is None:
+            messages.error(request, "Não encontramos essa dívida ou ela já foi quitada.")
+            return redirect("rachais:group_detail", group_id=group.id)
+
+        transfer_amount = candidate.amount.quantize(Decimal("0.01"))
+        if amount.quantize(Decimal("0.01")) != transfer_amount:
+            messages.error(request, "O valor informado não corresponde ao saldo atual dessa dívida.")
+            return redirect("rachais:group_detail", group_id=group.id)
+
+        with transaction.atomic(), maintaining_ledger():
+            claimed = claim_revision(group, group.revision)
+            if claimed:
+                payment = Payment.objects.create(
+                    group=group,
+                    payer=request.user,
+                    receiver=candidate.person_to,
+                    amount=transfer_amount,
+                    created_by=request.user,
+                )
+                apply_payment(payment, revision_claimed=True)
+        if claimed:
+            break
+        group.refresh_from_db(fields=["revision"])
+    else:
+        messages.error(request, "O grupo foi alterado por outra operação. Tente novamente.")
         return redirect("rachais:group_detail", group_id=group.id)
-    
-    Payment.objects.create(
-        group=group,
-        payer=request.user,
-        receiver_id=receiver_id,
-        amount=transfer_amount,
-        created_by=request.user,
-    )
+
+    mark_written(request)
     messages.success(request, "Pagamento registrado com sucesso!")
     return redirect("rachais:group_detail", group_id=group.id)
 